@@ -1,155 +1,920 @@
-# --- 簡略化版 api_handler.py (Streamlit用) ---
+# --- 簡略化版 api_handler.py ---
 
+import google.ai.generativelanguage as glm
+import google.api_core.exceptions
 import google.generativeai as genai
 import googlemaps
+import googlemaps.exceptions
+import hashlib
+import logging
+import numpy as np
+import threading
+import time
 import traceback
-import streamlit as st
+from requests.adapters import HTTPAdapter
 
-# グローバル変数
-gmaps_client = None
-gemini_model = None
+import async_api
+from constants import API_CONFIG, CACHE_CONFIG, ESTIMATOR_CONFIG, VALIDATION_CONFIG
+from distance_cache import DistanceCache, departure_bucket, normalize_address
+from geocode_cache import GeocodeCache
+from resource_registry import registry
+from response_cache import ResponseCache, response_key
+from travel_estimator import TravelEstimator, great_circle_pairs
+from travel_matrix import TravelMatrix
 
-def initialize_gmaps(api_key):
-    """Google Maps APIクライアントの初期化"""
-    global gmaps_client
+# 警告・エラーはUIに直接表示せず、呼び出し元へ返す診断情報とこのロガーに出力する
+logger = logging.getLogger(__name__)
+
+_LOG_LEVELS = {'info': logging.INFO, 'warning': logging.WARNING, 'error': logging.ERROR}
+
+def _diagnose(diagnostics, level, message):
+    """診断情報（level: 'info' / 'warning' / 'error'）を記録"""
+    logger.log(_LOG_LEVELS[level], message)
+    if diagnostics is not None:
+        diagnostics.append({'level': level, 'message': message})
+
+# APIキー検証結果のキャッシュ（プロセス共通：キーのハッシュ → 検証状態）
+_key_validations = {}
+_key_validation_lock = threading.Lock()
+
+def _key_hash(provider, api_key):
+    """APIキーをそのまま保持しないよう、検証キャッシュのキーにはハッシュを使う"""
+    return hashlib.sha256(f"{provider}:{api_key}".encode("utf-8")).hexdigest()
+
+def _record_key_validation(key_hash, status, message=""):
+    """APIキーの検証結果を記録（status: 'valid' / 'pending' / 'invalid'）"""
+    if not key_hash:
+        return
+    with _key_validation_lock:
+        _key_validations[key_hash] = {'status': status, 'message': message, 'checked_at': time.time()}
+
+def get_key_validation(provider, api_key):
+    """APIキーの検証状態を取得（未検証または有効期限切れの場合はNone）"""
+    with _key_validation_lock:
+        entry = _key_validations.get(_key_hash(provider, api_key))
+    if entry is None:
+        return None
+    ttl_seconds = API_CONFIG["key_validation_ttl_hours"] * 3600
+    if entry['status'] == 'valid' and time.time() - entry['checked_at'] > ttl_seconds:
+        return None
+    return dict(entry)
+
+def _is_network_error(error):
+    """キーの有効性とは無関係な通信エラーかを判定"""
+    return isinstance(error, (googlemaps.exceptions.TransportError, googlemaps.exceptions.Timeout,
+                              google.api_core.exceptions.ServiceUnavailable,
+                              google.api_core.exceptions.DeadlineExceeded,
+                              ConnectionError, TimeoutError))
+
+def _validate_in_background(key_hash, check, api_key):
+    """接続テストをバックグラウンドで実行し、結果を検証キャッシュに記録"""
+    _record_key_validation(key_hash, 'pending')
+    
+    def run_check():
+        try:
+            if check():
+                _record_key_validation(key_hash, 'valid')
+            else:
+                _record_key_validation(key_hash, 'invalid', '接続テストに失敗しました')
+        except Exception as e:
+            if _is_network_error(e):
+                # 通信できなかっただけなので未検証に戻し、実際の利用時の結果に委ねる
+                with _key_validation_lock:
+                    _key_validations.pop(key_hash, None)
+                return
+            # エラーメッセージのURLにキーが含まれる場合があるため伏せ字にする
+            _record_key_validation(key_hash, 'invalid', str(e).replace(api_key, '***'))
+    
+    threading.Thread(target=run_check, name="api-key-validation", daemon=True).start()
+
+def _start_lazy_validation(provider, api_key, check):
+    """検証済みキャッシュを確認し、未検証ならバックグラウンド検証を開始（無効と分かっている場合はFalse）"""
+    validation = get_key_validation(provider, api_key)
+    if validation is None:
+        _validate_in_background(_key_hash(provider, api_key), check, api_key)
+        return True
+    if validation['status'] == 'invalid':
+        # 次回の適用時には改めて検証する
+        with _key_validation_lock:
+            _key_validations.pop(_key_hash(provider, api_key), None)
+        return False
+    return True
+
+def initialize_gmaps(api_key, lazy=None, diagnostics=None):
+    """Google Maps APIキーの検証（lazy=Trueの場合、接続テストはバックグラウンドで実行）
+
+    クライアントは保持しない（利用時はApiClientsが共有クライアントを取得する）。
+    失敗理由はdiagnostics（リスト）に追加する。
+    """
     if not api_key:
-        st.warning("Google Maps APIキーが設定されていません")
-        gmaps_client = None
+        _diagnose(diagnostics, 'warning', "Google Maps APIキーが設定されていません")
         return False
+    if lazy is None:
+        lazy = API_CONFIG["lazy_key_validation"]
     
     try:
-        gmaps_client = googlemaps.Client(key=api_key)
+        client = _shared_gmaps_client(api_key)
+        
+        if lazy:
+            if not _start_lazy_validation('google_maps', api_key, lambda: bool(client.geocode("Tokyo, Japan"))):
+                _diagnose(diagnostics, 'error', "Google Maps APIキーの検証に失敗しています。キーを確認してください。")
+                registry.evict('gmaps_client', api_key)
+                return False
+            return True
+        
         # 簡単な接続テスト
-        test_response = gmaps_client.geocode("Tokyo, Japan")
+        test_response = client.geocode("Tokyo, Japan")
         if not test_response:
-            st.error("Google Maps API接続テストに失敗しました")
-            gmaps_client = None
+            _diagnose(diagnostics, 'error', "Google Maps API接続テストに失敗しました")
+            registry.evict('gmaps_client', api_key)
             return False
+        _record_key_validation(_key_hash('google_maps', api_key), 'valid')
         return True
     except Exception as e:
-        st.error(f"Google Maps API初期化エラー: {e}")
-        gmaps_client = None
+        _diagnose(diagnostics, 'error', f"Google Maps API初期化エラー: {str(e).replace(api_key, '***')}")
         return False
 
-def initialize_gemini(api_key):
-    """Gemini APIの初期化"""
-    global gemini_model
+def _shared_gmaps_client(api_key):
+    """同じキーのクライアント（接続プールを含む）は全セッションで共有する"""
+    return registry.get_or_create(
+        'gmaps_client', api_key, lambda: _create_gmaps_client(api_key),
+        on_evict=lambda client: client.session.close()
+    )
+
+def _create_gmaps_client(api_key):
+    """接続プールを設定したGoogle Mapsクライアントを作成"""
+    client = googlemaps.Client(key=api_key)
+    _configure_connection_pool(client)
+    return client
+
+def _configure_connection_pool(client):
+    """並列リクエストでHTTP接続を使い回せるよう、接続プールを同時実行数に合わせる"""
+    pool_size = API_CONFIG["google_maps"]["max_workers"]
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    client.session.mount("https://", adapter)
+
+def initialize_gemini(api_key, lazy=None, diagnostics=None):
+    """Gemini APIキーの検証（lazy=Trueの場合、接続テストはバックグラウンドで実行）
+
+    モデルは保持しない（利用時はApiClientsが共有モデルを取得する）。
+    失敗理由はdiagnostics（リスト）に追加する。
+    """
     if not api_key:
-        st.warning("Gemini APIキーが設定されていません")
-        gemini_model = None
+        _diagnose(diagnostics, 'warning', "Gemini APIキーが設定されていません")
         return False
+    if lazy is None:
+        lazy = API_CONFIG["lazy_key_validation"]
     
     try:
-        genai.configure(api_key=api_key)
-        gemini_model = genai.GenerativeModel('gemini-1.5-flash')
+        model = _shared_gemini_model(api_key)
+        
+        if lazy:
+            # モデル情報の取得は生成を伴わないため、課金なしでキーを確認できる
+            model_name = model.model_name
+            if not _start_lazy_validation(
+                'gemini', api_key,
+                lambda: glm.ModelServiceClient(client_options={"api_key": api_key}).get_model(name=model_name) is not None
+            ):
+                _diagnose(diagnostics, 'error', "Gemini APIキーの検証に失敗しています。キーを確認してください。")
+                registry.evict('gemini_model', api_key)
+                return False
+            return True
+        
         # 簡単な接続テスト
-        test_response = gemini_model.generate_content(
+        test_response = model.generate_content(
             "テスト", 
             generation_config=genai.types.GenerationConfig(temperature=0.1)
         )
         if not test_response.text:
-            st.error("Gemini API接続テストに失敗しました")
-            gemini_model = None
+            _diagnose(diagnostics, 'error', "Gemini API接続テストに失敗しました")
+            registry.evict('gemini_model', api_key)
             return False
+        _record_key_validation(_key_hash('gemini', api_key), 'valid')
         return True
     except Exception as e:
-        st.error(f"Gemini API初期化エラー: {e}")
-        gemini_model = None
+        _diagnose(diagnostics, 'error', f"Gemini API初期化エラー: {str(e).replace(api_key, '***')}")
         return False
 
-def get_distance_matrix(locations, start_time, use_tolls):
-    """距離マトリックスの取得"""
-    if not gmaps_client:
-        return {'status': 'ERROR', 'message': 'Google Mapsクライアントが初期化されていません。'}
+def _shared_gemini_model(api_key):
+    """同じキーのモデルは全セッションで共有する"""
+    return registry.get_or_create('gemini_model', api_key, lambda: _create_gemini_model(api_key))
+
+def _create_gemini_model(api_key):
+    """キー専用のクライアントを持つGeminiモデルを作成
+
+    genai.configureはプロセス全体の既定キーを書き換えるため使わない。
+    非同期クライアントはイベントループに結び付くため、バックグラウンドのループ内で作成する。
+    """
+    client_options = {"api_key": api_key}
+    model = genai.GenerativeModel('gemini-1.5-flash')
+    model._client = glm.GenerativeServiceClient(client_options=client_options)
+    model._async_client = async_api.create_in_loop(
+        lambda: glm.GenerativeServiceAsyncClient(client_options=client_options)
+    )
+    return model
+
+class ApiClients:
+    """セッションごとのAPIクライアント
+
+    キーだけを保持し、クライアントは利用のたびに共有レジストリから取得する（アイドル時に破棄されていれば
+    作り直す）。キーがないAPIのクライアントはNoneになる。計画処理にはこのオブジェクトを明示的に渡す。
+    """
+
+    def __init__(self, maps_key=None, gemini_key=None):
+        self._maps_key = maps_key or None
+        self._gemini_key = gemini_key or None
+
+    @property
+    def gmaps(self):
+        """Google Mapsクライアント（キーがなければNone）"""
+        return _shared_gmaps_client(self._maps_key) if self._maps_key else None
+
+    @property
+    def gemini(self):
+        """Geminiモデル（キーがなければNone）"""
+        return _shared_gemini_model(self._gemini_key) if self._gemini_key else None
+
+    @property
+    def gmaps_key_hash(self):
+        return _key_hash('google_maps', self._maps_key) if self._maps_key else None
+
+    @property
+    def gemini_key_hash(self):
+        return _key_hash('gemini', self._gemini_key) if self._gemini_key else None
+
+    def __repr__(self):
+        # キーを表示しない
+        return f"ApiClients(gmaps={self._maps_key is not None}, gemini={self._gemini_key is not None})"
+
+def _chunks(items, size):
+    """リストを最大size件ずつに分割"""
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+def _plan_matrix_tiles(needed_columns_by_row):
+    """取得が必要な(行, 列)を、1リクエストの要素数上限に収まるタイル(行リスト, 列リスト)に分割"""
+    maps_config = API_CONFIG["google_maps"]
+    max_dimension = maps_config["max_dimension"]
+    max_elements = maps_config["max_elements_per_request"]
+
+    # 同じ列集合を必要とする行をまとめて、無駄な要素を要求しないようにする
+    row_groups = {}
+    for row, columns in needed_columns_by_row.items():
+        if columns:
+            row_groups.setdefault(tuple(columns), []).append(row)
+
+    tiles = []
+    for columns, rows in row_groups.items():
+        cols_per_tile = min(len(columns), max_dimension, max_elements)
+        rows_per_tile = max(1, min(max_dimension, max_elements // cols_per_tile))
+        for row_chunk in _chunks(rows, rows_per_tile):
+            for col_chunk in _chunks(list(columns), cols_per_tile):
+                tiles.append((row_chunk, col_chunk))
+    return tiles
+
+def _unique_addresses(addresses):
+    """正規化した住所が同じ地点をまとめ、(重複を除いた住所, 元の位置ごとの重複除去後の位置) を返す
+
+    重複を除いた住所には、各地点で最初に現れた表記を使う。
+    """
+    unique = []
+    position_by_key = {}
+    positions = []
+    for address in addresses:
+        key = normalize_address(address)
+        if key not in position_by_key:
+            position_by_key[key] = len(unique)
+            unique.append(address)
+        positions.append(position_by_key[key])
+    return unique, np.array(positions, dtype=np.intp)
+
+def get_distance_cache():
+    """移動時間キャッシュの取得（プロセス内の全セッションで共有）"""
+    return registry.get_or_create(
+        'distance_cache', CACHE_CONFIG["path"],
+        lambda: DistanceCache(
+            CACHE_CONFIG["path"],
+            ttl_seconds=CACHE_CONFIG["ttl_days"] * 24 * 3600,
+            max_entries=CACHE_CONFIG["max_entries"]
+        ),
+        on_evict=lambda cache: cache.close()
+    )
+
+def get_geocode_cache():
+    """住所→緯度経度キャッシュの取得（プロセス内の全セッションで共有）"""
+    return registry.get_or_create(
+        'geocode_cache', CACHE_CONFIG["path"],
+        lambda: GeocodeCache(
+            CACHE_CONFIG["path"],
+            ttl_seconds=CACHE_CONFIG["geocode_ttl_days"] * 24 * 3600,
+            max_entries=CACHE_CONFIG["geocode_max_entries"]
+        ),
+        on_evict=lambda cache: cache.close()
+    )
+
+def get_response_cache():
+    """AI応答キャッシュの取得（プロセス内の全セッションで共有）"""
+    return registry.get_or_create(
+        'response_cache', CACHE_CONFIG["path"],
+        lambda: ResponseCache(
+            CACHE_CONFIG["path"],
+            ttl_seconds=CACHE_CONFIG["response_ttl_days"] * 24 * 3600,
+            max_entries=CACHE_CONFIG["response_max_entries"]
+        ),
+        on_evict=lambda cache: cache.close()
+    )
+
+def geocode_addresses(clients, addresses, on_wait=None):
+    """住所の緯度経度を取得（キャッシュ未登録の住所のみジオコーディング）
+
+    ((緯度, 経度)の配列（見つからない住所はNaN）, APIに問い合わせた件数) を返す。
+    """
+    maps_config = API_CONFIG["google_maps"]
+    cache = get_geocode_cache()
+    found = cache.lookup(addresses)
+    missing = list({normalize_address(a): a for a in addresses if normalize_address(a) not in found}.values())
+    
+    if missing:
+        results = async_api.run(
+            async_api.geocode_many(clients.gmaps, missing, language=maps_config["language"], region=maps_config["region"]),
+            on_wait=on_wait
+        )
+        cache.store(zip(missing, results))
+        for address, result in zip(missing, results):
+            if result:
+                location = result[0]['geometry']['location']
+                found[normalize_address(address)] = (location['lat'], location['lng'])
     
+    coordinates = np.array(
+        [found.get(normalize_address(a), (np.nan, np.nan)) for a in addresses], dtype=np.float64
+    ).reshape(len(addresses), 2)
+    return coordinates, len(missing)
+
+def _request_points(addresses, coordinates):
+    """Distance Matrixに渡す地点（緯度経度があれば「緯度,経度」、なければ住所）"""
+    return [
+        address if np.isnan(point).any() else f"{point[0]:.7f},{point[1]:.7f}"
+        for address, point in zip(addresses, coordinates)
+    ]
+
+def get_shared_usage(*api_keys):
+    """同じAPIキーの組で共有する月別API使用量（セッションリフレッシュ後も保持）"""
+    return registry.get_or_create('api_usage', api_keys, dict)
+
+def has_shared_clients(gemini_key, maps_key):
+    """両方のAPIクライアントが共有済みで、キーが無効と判定されていないかを確認"""
+    for provider, kind, api_key in (('gemini', 'gemini_model', gemini_key), ('google_maps', 'gmaps_client', maps_key)):
+        if not registry.contains(kind, api_key):
+            return False
+        validation = get_key_validation(provider, api_key)
+        if validation and validation['status'] == 'invalid':
+            return False
+    return True
+
+class _MatrixStatusError(Exception):
+    """Distance Matrix APIがタイルに対してOK以外のステータスを返した"""
+
+def _location_addresses(locations):
+    """地点リストから住所のリストを取得（不足があればエラーのレスポンスを返す）"""
     if not locations or len(locations) < 2:
-        return {'status': 'ERROR', 'message': '最低2つの地点が必要です。'}
+        return None, {'status': 'ERROR', 'message': '最低2つの地点が必要です。'}
     
     addresses = [loc["住所"] for loc in locations if loc.get("住所")]
     if len(addresses) != len(locations):
-        return {'status': 'ERROR', 'message': '全ての地点に住所が設定されている必要があります。'}
+        return None, {'status': 'ERROR', 'message': '全ての地点に住所が設定されている必要があります。'}
+    return addresses, None
+
+def _locate(clients, unique_addresses, diagnostics, on_wait=None):
+    """重複を除いた住所の緯度経度と、APIに問い合わせた件数を取得
+
+    ジオコーディングできない場合は、キャッシュ済みの緯度経度のみを使う。
+    """
+    coordinates = np.full((len(unique_addresses), 2), np.nan)
+    geocode_requests = 0
+    if not API_CONFIG["google_maps"]["use_coordinates"]:
+        return coordinates, geocode_requests
     
-    departure_timestamp = int(start_time.timestamp())
+    if clients.gmaps:
+        try:
+            return geocode_addresses(clients, unique_addresses, on_wait=on_wait)
+        except googlemaps.exceptions.ApiError as e:
+            if e.status == 'REQUEST_DENIED':
+                raise
+            _diagnose(diagnostics, 'warning', f"ジオコーディングに失敗したため、キャッシュ済みの位置のみを使います: {e}")
+    
+    found = get_geocode_cache().lookup(unique_addresses)
+    coordinates = np.array(
+        [found.get(normalize_address(a), (np.nan, np.nan)) for a in unique_addresses], dtype=np.float64
+    ).reshape(len(unique_addresses), 2)
+    return coordinates, geocode_requests
+
+def _fetch_elements(clients, addresses, request_points, columns_by_row, start_time, use_tolls, on_wait=None, on_progress=None):
+    """columns_by_row {行: [列]} の要素をキャッシュ優先で取得し、({(行, 列): element}, APIに要求した要素数) を返す
 
+    キャッシュ未登録の組のみをタイルに分割して並列取得する。行・列はaddresses・request_pointsの位置。
+    """
     api_args = {
-        "origins": addresses,
-        "destinations": addresses,
         "mode": "driving",
-        "departure_time": departure_timestamp,
+        "departure_time": int(start_time.timestamp()),
         "language": "ja",
         "units": "metric"
     }
-
     if not use_tolls:
         api_args["avoid"] = "tolls"
+    avoid_tolls = not use_tolls
+    bucket = departure_bucket(start_time)
+    
+    # キャッシュ済みの組を先に埋める
+    cache = get_distance_cache()
+    cached = cache.lookup(
+        [(addresses[i], addresses[j]) for i, columns in columns_by_row.items() for j in columns], avoid_tolls, bucket
+    )
+    elements = {}
+    needed_columns_by_row = {}
+    for i, columns in columns_by_row.items():
+        needed_columns_by_row[i] = []
+        for j in columns:
+            element = cached.get((normalize_address(addresses[i]), normalize_address(addresses[j])))
+            if element is None:
+                needed_columns_by_row[i].append(j)
+            else:
+                elements[(i, j)] = element
+    tiles = _plan_matrix_tiles(needed_columns_by_row)
+    requested_elements = sum(len(tile_rows) * len(tile_cols) for tile_rows, tile_cols in tiles)
+    if on_progress:
+        on_progress(0, len(tiles))
+    
+    if tiles:
+        tile_requests = [
+            ([request_points[i] for i in tile_rows], [request_points[j] for j in tile_cols])
+            for tile_rows, tile_cols in tiles
+        ]
+        tile_responses = async_api.run(
+            async_api.fetch_matrix_tiles(clients.gmaps, api_args, tile_requests, on_tile_done=on_progress), on_wait=on_wait
+        )
+        
+        # レスポンスの検証とタイルの結合
+        fetched = []
+        for (tile_rows, tile_cols), tile_response in zip(tiles, tile_responses):
+            if tile_response.get('status') != 'OK':
+                raise _MatrixStatusError(tile_response.get("status", "UNKNOWN_ERROR"))
+            for i, row in zip(tile_rows, tile_response.get('rows', [])):
+                for j, element in zip(tile_cols, row.get('elements', [])):
+                    elements[(i, j)] = element
+                    fetched.append((addresses[i], addresses[j], element))
+        cache.store(fetched, avoid_tolls, bucket)
+        # 実際の取得に成功したキーは検証済みとして扱う
+        _record_key_validation(clients.gmaps_key_hash, 'valid')
+    
+    return elements, requested_elements
+
+def _matrix_error(clients, e, diagnostics):
+    """距離取得中の例外をエラーのレスポンスに変換"""
+    if isinstance(e, _MatrixStatusError):
+        return {'status': 'API_ERROR', 'message': f'Google Maps API エラー: {e}', 'diagnostics': diagnostics}
+    if isinstance(e, googlemaps.exceptions.ApiError) and e.status == 'REQUEST_DENIED':
+        _record_key_validation(clients.gmaps_key_hash, 'invalid', str(e))
+    error_info = traceback.format_exc()
+    _diagnose(diagnostics, 'error', f"Distance Matrix API呼び出しエラー: {str(e)}")
+    return {'status': 'API_ERROR', 'message': str(e), 'traceback': error_info, 'diagnostics': diagnostics}
+
+def get_distance_matrix(clients, locations, start_time, use_tolls, on_wait=None, on_progress=None, select_legs=None):
+    """距離マトリックスの取得（キャッシュ未登録の組のみをタイルに分割して並列取得）
+
+    clientsはセッションのApiClients（以下のAPI呼び出し関数でも同じ）。
+    同じ住所（全角・半角や空白の違いを除く）の地点は1回だけ取得し、元の地点の並びに展開する
+    （同じ地点同士は移動時間・距離0）。住所はキャッシュ付きでジオコーディングし、緯度経度で問い合わせる
+    （見つからない住所は住所のまま。緯度経度はmatrix.coordinatesに格納）。
+    結果はレスポンスの'matrix'にTravelMatrixとして格納する。ルートが見つからない組は'route_failures'に、
+    警告・エラーは'diagnostics'に格納する。
+    on_waitは取得待ちの間に定期的に呼ばれる（例外を送出すると取得をキャンセル）。
+    on_progressはタイルの取得状況 (取得済みタイル数, 全タイル数) で呼ばれる。
+    select_legsを指定した場合は、select_legs(地点ごとの緯度経度)が返すマスクの区間のみを取得し、
+    残りの区間は緯度経度からの推定値で埋める（matrix.estimatedで判定できる）。
+    """
+    if not clients.gmaps:
+        return {'status': 'ERROR', 'message': 'Google Mapsクライアントが初期化されていません。'}
+    
+    addresses, error = _location_addresses(locations)
+    if error:
+        return error
+    
+    diagnostics = []
+    try:
+        unique_addresses, positions = _unique_addresses(addresses)
+        coordinates, geocode_requests = _locate(clients, unique_addresses, diagnostics, on_wait=on_wait)
+        for address, point in zip(unique_addresses, coordinates):
+            if API_CONFIG["google_maps"]["use_coordinates"] and np.isnan(point).any():
+                _diagnose(diagnostics, 'warning', f"警告: {address} の位置が見つからないため、住所のまま距離を取得します")
+        
+        size = len(unique_addresses)
+        if select_legs is None:
+            columns_by_row = {i: list(range(size)) for i in range(size)}
+            matrix = TravelMatrix.empty(size, unique_addresses)
+            matrix.coordinates = coordinates
+        else:
+            # 元の地点の並びで選ばれた区間を、重複を除いた地点の区間に変換
+            selected = np.zeros((size, size), dtype=bool)
+            rows, cols = np.nonzero(select_legs(coordinates[positions]))
+            selected[positions[rows], positions[cols]] = True
+            np.fill_diagonal(selected, False)
+            columns_by_row = {i: np.flatnonzero(selected[i]).tolist() for i in range(size) if selected[i].any()}
+            matrix = get_travel_estimator().estimate_matrix(coordinates, unique_addresses)
+            _diagnose(
+                diagnostics, 'info',
+                f"候補の{int(selected.sum())}区間のみGoogle Mapsで取得し、残り{size * (size - 1) - int(selected.sum())}区間は推定値を使います"
+            )
+        
+        elements, requested_elements = _fetch_elements(
+            clients, unique_addresses, _request_points(unique_addresses, coordinates), columns_by_row,
+            start_time, use_tolls, on_wait=on_wait, on_progress=on_progress
+        )
+        for (i, j), element in elements.items():
+            matrix.set_element(i, j, element)
+        
+        # 各要素の検証（同じ地点同士は除く）
+        route_failures = [
+            {'origin': unique_addresses[i], 'destination': unique_addresses[j]}
+            for i, j in matrix.failed_pairs() if i != j
+        ]
+        for failure in route_failures:
+            _diagnose(diagnostics, 'warning', f"警告: {failure['origin']} → {failure['destination']} のルートが見つかりません")
+        
+        return {
+            'status': 'OK',
+            'origin_addresses': addresses,
+            'destination_addresses': addresses,
+            'matrix': matrix.expand(positions, addresses),
+            'route_failures': route_failures,
+            'diagnostics': diagnostics,
+            'cache_stats': {
+                'hits': sum(len(columns) for columns in columns_by_row.values()) - requested_elements,
+                'misses': requested_elements,
+                'duplicates': len(addresses) - size,
+                'geocode_requests': geocode_requests
+            }
+        }
+        
+    except Exception as e:
+        return _matrix_error(clients, e, diagnostics)
+
+def extend_distance_matrix(clients, matrix, locations, start_time, use_tolls, on_wait=None, on_progress=None,
+                           select_legs=None, estimate_only=False):
+    """前回のマトリックスを今回の地点の並びに組み替え、前回にない住所を含む行・列の要素だけを取得する
+
+    前回の住所同士の要素はそのまま使う（前回と同じ出発日時・有料道路の設定で取得したものであること）。
+    estimate_onlyの場合は新しい要素を緯度経度からの推定値で埋め、select_legsを指定した場合は
+    新しい要素のうちselect_legs(地点ごとの緯度経度)が返すマスクの区間のみを取得して残りを推定値で埋める。
+    レスポンスの形式はget_distance_matrixと同じで、'added'には前回にない住所の数を格納する。
+    """
+    if not clients.gmaps and not estimate_only:
+        return {'status': 'ERROR', 'message': 'Google Mapsクライアントが初期化されていません。'}
     
+    addresses, error = _location_addresses(locations)
+    if error:
+        return error
+    
+    diagnostics = []
     try:
-        response = gmaps_client.distance_matrix(**api_args)
+        unique_addresses, positions = _unique_addresses(addresses)
+        size = len(unique_addresses)
+        previous_positions = {}
+        for index, address in enumerate(matrix.addresses):
+            previous_positions.setdefault(normalize_address(address), index)
+        previous = np.array([previous_positions.get(normalize_address(a), -1) for a in unique_addresses], dtype=np.intp)
+        known = np.flatnonzero(previous >= 0)
+        added = np.flatnonzero(previous < 0)
+        
+        # 前回の地点の位置は再利用し、追加された住所のみジオコーディングする
+        coordinates = np.full((size, 2), np.nan)
+        if matrix.coordinates is not None:
+            coordinates[known] = matrix.coordinates[previous[known]]
+        geocode_requests = 0
+        if len(added):
+            located, geocode_requests = _locate(clients, [unique_addresses[i] for i in added], diagnostics, on_wait=on_wait)
+            coordinates[added] = located
+        
+        if estimate_only or select_legs is not None:
+            extended = get_travel_estimator().estimate_matrix(coordinates, unique_addresses)
+        else:
+            extended = TravelMatrix.empty(size, unique_addresses)
+            extended.coordinates = coordinates
+        reused, source = np.ix_(known, known), np.ix_(previous[known], previous[known])
+        extended.seconds[reused] = matrix.seconds[source]
+        extended.meters[reused] = matrix.meters[source]
+        extended.status[reused] = matrix.status[source]
+        
+        # 追加された住所の行・列のみが取得対象
+        selected = np.zeros((size, size), dtype=bool)
+        selected[added, :] = True
+        selected[:, added] = True
+        if select_legs is not None:
+            mask = np.zeros((size, size), dtype=bool)
+            rows, cols = np.nonzero(select_legs(coordinates[positions]))
+            mask[positions[rows], positions[cols]] = True
+            selected &= mask
+        np.fill_diagonal(selected, False)
         
-        # レスポンスの検証
-        if response.get('status') != 'OK':
-            return {
-                'status': 'API_ERROR', 
-                'message': f'Google Maps API エラー: {response.get("status", "UNKNOWN_ERROR")}'
+        elements, requested_elements, columns_by_row = {}, 0, {}
+        if estimate_only:
+            for i in added:
+                if np.isnan(coordinates[i]).any():
+                    _diagnose(diagnostics, 'warning', f"警告: {unique_addresses[i]} の位置が不明なため、移動時間を推定できません")
+        else:
+            columns_by_row = {i: np.flatnonzero(selected[i]).tolist() for i in range(size) if selected[i].any()}
+            if columns_by_row:
+                elements, requested_elements = _fetch_elements(
+                    clients, unique_addresses, _request_points(unique_addresses, coordinates), columns_by_row,
+                    start_time, use_tolls, on_wait=on_wait, on_progress=on_progress
+                )
+            for (i, j), element in elements.items():
+                extended.set_element(i, j, element)
+        
+        route_failures = [
+            {'origin': unique_addresses[i], 'destination': unique_addresses[j]}
+            for i, j in extended.failed_pairs() if i != j and (previous[i] < 0 or previous[j] < 0)
+        ] if not estimate_only else []
+        for failure in route_failures:
+            _diagnose(diagnostics, 'warning', f"警告: {failure['origin']} → {failure['destination']} のルートが見つかりません")
+        _diagnose(
+            diagnostics, 'info',
+            f"前回の{len(known)}地点間の距離・移動時間を再利用し、追加された{len(added)}地点の区間のみ"
+            f"{'推定' if estimate_only else '取得'}しました"
+        )
+        
+        return {
+            'status': 'OK',
+            'origin_addresses': addresses,
+            'destination_addresses': addresses,
+            'matrix': extended.expand(positions, addresses),
+            'route_failures': route_failures,
+            'diagnostics': diagnostics,
+            'added': len(added),
+            'cache_stats': {
+                'hits': sum(len(columns) for columns in columns_by_row.values()) - requested_elements,
+                'misses': requested_elements,
+                'duplicates': len(addresses) - size,
+                'geocode_requests': geocode_requests
             }
+        }
+    
+    except Exception as e:
+        return _matrix_error(clients, e, diagnostics)
+
+_estimator_state = {'estimator': None, 'fitted_at': 0.0}
+_estimator_lock = threading.Lock()
+
+def get_travel_estimator():
+    """キャッシュ済みの実測値で補正した移動時間の推定器を取得（一定時間ごとに補正し直す）"""
+    with _estimator_lock:
+        if time.time() - _estimator_state['fitted_at'] < ESTIMATOR_CONFIG["calibration_ttl_minutes"] * 60:
+            return _estimator_state['estimator']
+        
+        samples = get_distance_cache().sample_elements(ESTIMATOR_CONFIG["max_samples"])
+        found = get_geocode_cache().lookup({address for o, d, _ in samples for address in (o, d)})
+        rows = [
+            (found[o], found[d], element['distance']['value'], element['duration']['value'])
+            for o, d, element in samples if o in found and d in found
+        ]
+        if rows:
+            origins, destinations, meters, seconds = zip(*rows)
+            estimator = TravelEstimator.calibrate(great_circle_pairs(origins, destinations), meters, seconds)
+        else:
+            estimator = TravelEstimator.default()
+        _estimator_state.update(estimator=estimator, fitted_at=time.time())
+        return estimator
+
+def get_estimated_matrix(clients, locations, on_wait=None):
+    """緯度経度から距離マトリックスを推定（Distance Matrix APIを使わない）
+
+    位置はキャッシュ優先で取得し、Mapsクライアントがない場合はキャッシュ済みの位置のみを使う。
+    推定値の要素はmatrix.estimatedで判定できる。レスポンスの形式はget_distance_matrixと同じ。
+    """
+    addresses, error = _location_addresses(locations)
+    if error:
+        return error
+    
+    diagnostics = []
+    try:
+        unique_addresses, positions = _unique_addresses(addresses)
+        coordinates, geocode_requests = _locate(clients, unique_addresses, diagnostics, on_wait=on_wait)
+        for address, point in zip(unique_addresses, coordinates):
+            if np.isnan(point).any():
+                _diagnose(diagnostics, 'warning', f"警告: {address} の位置が不明なため、移動時間を推定できません")
+        
+        estimator = get_travel_estimator()
+        _diagnose(diagnostics, 'info', f"距離・移動時間は推定値です（{estimator.describe()}）")
+        matrix = estimator.estimate_matrix(coordinates, unique_addresses)
+        return {
+            'status': 'OK',
+            'origin_addresses': addresses,
+            'destination_addresses': addresses,
+            'matrix': matrix.expand(positions, addresses),
+            'route_failures': [],
+            'diagnostics': diagnostics,
+            'cache_stats': {
+                'hits': 0,
+                'misses': 0,
+                'duplicates': len(addresses) - len(unique_addresses),
+                'geocode_requests': geocode_requests
+            }
+        }
+    
+    except Exception as e:
+        return _matrix_error(clients, e, diagnostics)
+
+def refine_matrix(clients, matrix, legs, start_time, use_tolls, on_wait=None, on_progress=None):
+    """推定値の要素のうちlegs [(出発地の位置, 目的地の位置)] だけを実測値に置き換える
+
+    同じ住所の組は1回だけ取得する。'matrix'には置き換え後のコピー、'refined'には置き換えた要素数を格納する。
+    """
+    if not clients.gmaps:
+        return {'status': 'ERROR', 'message': 'Google Mapsクライアントが初期化されていません。'}
+    
+    diagnostics = []
+    try:
+        estimated = matrix.estimated
+        legs = [(i, j) for i, j in legs if i != j and estimated[i, j]]
+        unique_addresses, positions = _unique_addresses(matrix.addresses)
+        columns_by_row = {}
+        for i, j in legs:
+            columns = columns_by_row.setdefault(positions[i], [])
+            if positions[j] not in columns and positions[j] != positions[i]:
+                columns.append(positions[j])
         
-        # 各要素の検証
-        for i, row in enumerate(response.get('rows', [])):
-            for j, element in enumerate(row.get('elements', [])):
-                if element.get('status') not in ['OK', 'ZERO_RESULTS']:
-                    st.warning(f"警告: {addresses[i]} → {addresses[j]} のルートが見つかりません")
+        coordinates = np.full((len(unique_addresses), 2), np.nan)
+        if matrix.coordinates is not None:
+            coordinates[positions] = matrix.coordinates
+        elements, requested_elements = _fetch_elements(
+            clients, unique_addresses, _request_points(unique_addresses, coordinates),
+            {i: sorted(columns) for i, columns in columns_by_row.items()},
+            start_time, use_tolls, on_wait=on_wait, on_progress=on_progress
+        )
         
-        return response
+        refined = matrix.copy()
+        failed = set()
+        for i, j in legs:
+            element = elements.get((positions[i], positions[j]))
+            refined.set_element(i, j, element)
+            if not element or element.get('status') != 'OK':
+                failed.add((positions[i], positions[j]))
+        for i, j in sorted(failed):
+            _diagnose(diagnostics, 'warning', f"警告: {unique_addresses[i]} → {unique_addresses[j]} のルートが見つかりません")
+        return {
+            'status': 'OK',
+            'matrix': refined,
+            'refined': len(legs),
+            'diagnostics': diagnostics,
+            'cache_stats': {
+                'hits': sum(len(columns) for columns in columns_by_row.values()) - requested_elements,
+                'misses': requested_elements
+            }
+        }
+    
+    except Exception as e:
+        return _matrix_error(clients, e, diagnostics)
+
+# 生成結果に影響するGeminiの設定（AI応答キャッシュのキーにも使う）
+_GENERATION_KEYS = ("model_name", "temperature", "max_output_tokens", "top_p", "top_k")
+
+def _route_generation_config(temperature=None):
+    """ルート計画用の生成パラメータ（temperatureを指定した場合はその値を使う）"""
+    config = API_CONFIG["gemini"]
+    return genai.types.GenerationConfig(
+        temperature=config["temperature"] if temperature is None else temperature,
+        max_output_tokens=config["max_output_tokens"],
+        top_p=config["top_p"],
+        top_k=config["top_k"]
+    )
+
+def _response_key(clients, prompt, temperature=None):
+    """AI応答キャッシュのキー（正規化したプロンプトと生成パラメータ）"""
+    params = {key: API_CONFIG["gemini"][key] for key in _GENERATION_KEYS}
+    params["model"] = getattr(clients.gemini, "model_name", None)
+    if temperature is not None:
+        params["temperature"] = temperature
+    return response_key(prompt, params)
+
+def discard_cached_response(clients, prompt, temperature=None):
+    """キャッシュ済みのAI応答を削除（解析できなかった応答を再計算で再び返さないため）
+
+    temperatureを指定して生成した応答は、同じtemperatureを渡して削除する。
+    """
+    get_response_cache().discard(_response_key(clients, prompt, temperature))
+
+def _iter_stream_text(response):
+    """ストリーミング応答からテキストのチャンクを順に取り出す"""
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # テキストを含まないチャンク（終了理由のみ等）は読み飛ばす
+            continue
+        if text:
+            yield text
+
+def _iter_and_store(stream, key):
+    """受信テキストをそのまま返し、最後まで受信できた場合のみ全文をキャッシュに保存する"""
+    parts = []
+    for text in stream:
+        parts.append(text)
+        yield text
+    get_response_cache().store(key, "".join(parts))
+
+def _check_prompt_length(prompt, diagnostics):
+    """プロンプトが上限の文字数を超えていれば警告する（途中で切ると出力形式の指示が失われるため、切り詰めずに送る）"""
+    limit = VALIDATION_CONFIG["max_prompt_length"]
+    if len(prompt) > limit:
+        _diagnose(diagnostics, 'warning', f"プロンプトが上限の{limit}文字を超えています（{len(prompt)}文字）。応答に時間がかかる場合があります。")
+
+def stream_ai_route_plan(clients, prompt, use_cache=True):
+    """AIルートプランをストリーミングで取得（'stream'に受信テキストのイテレータを返す）
+
+    use_cacheが有効なら、同じプロンプト・生成パラメータのキャッシュ済み応答を返す（'cached'がTrue）。
+    """
+    model = clients.gemini
+    if not model:
+        return {'status': 'ERROR', 'message': 'Geminiモデルが初期化されていません。'}
+    
+    if not prompt or len(prompt.strip()) == 0:
+        return {'status': 'ERROR', 'message': 'プロンプトが空です。'}
+    
+    diagnostics = []
+    try:
+        key = _response_key(clients, prompt)
+        cached = get_response_cache().lookup(key) if use_cache else None
+        if cached is not None:
+            return {'status': 'OK', 'stream': iter([cached]), 'cached': True, 'diagnostics': diagnostics}
+        
+        _check_prompt_length(prompt, diagnostics)
+        response = model.generate_content(
+            prompt,
+            generation_config=_route_generation_config(),
+            stream=True
+        )
+        stream = _iter_stream_text(response)
+        if use_cache:
+            stream = _iter_and_store(stream, key)
+        return {'status': 'OK', 'stream': stream, 'cached': False, 'diagnostics': diagnostics}
         
     except Exception as e:
         error_info = traceback.format_exc()
-        st.error(f"Distance Matrix API呼び出しエラー: {str(e)}")
-        return {'status': 'API_ERROR', 'message': str(e), 'traceback': error_info}
+        _diagnose(diagnostics, 'error', f"Gemini API呼び出しエラー: {str(e)}")
+        return {'status': 'API_ERROR', 'message': str(e), 'traceback': error_info, 'diagnostics': diagnostics}
+
+def get_ai_route_plan(clients, prompt, on_wait=None, use_cache=True):
+    """AIルートプランの取得（on_waitは応答待ちの間に定期的に呼ばれる）
+
+    use_cacheが有効なら、同じプロンプト・生成パラメータのキャッシュ済み応答を返す（'cached'がTrue）。
+    """
+    return async_api.run(generate_ai_route_plan(clients, prompt, use_cache=use_cache), on_wait=on_wait)
 
-def get_ai_route_plan(prompt):
-    """AIルートプランの取得"""
-    if not gemini_model:
+async def generate_ai_route_plan(clients, prompt, use_cache=True, temperature=None):
+    """AIルートプランの取得（コルーチン。複数の計画案を並列に依頼する場合に使う）
+
+    temperatureを指定した場合は、API_CONFIG["gemini"]の値の代わりに使う（キャッシュのキーにも含める）。
+    """
+    model = clients.gemini
+    if not model:
         return {'status': 'ERROR', 'message': 'Geminiモデルが初期化されていません。'}
     
     if not prompt or len(prompt.strip()) == 0:
         return {'status': 'ERROR', 'message': 'プロンプトが空です。'}
     
+    diagnostics = []
     try:
-        # プロンプトの長さ制限チェック（約30,000文字）
-        if len(prompt) > 30000:
-            st.warning("プロンプトが長すぎます。簡略化して送信します。")
-            prompt = prompt[:30000] + "..."
-        
-        response = gemini_model.generate_content(
-            prompt, 
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.2,
-                max_output_tokens=4096,
-                top_p=0.8,
-                top_k=40
-            )
-        )
+        key = _response_key(clients, prompt, temperature)
+        cached = get_response_cache().lookup(key) if use_cache else None
+        if cached is not None:
+            return {'status': 'OK', 'data': cached, 'cached': True, 'diagnostics': diagnostics}
+        
+        _check_prompt_length(prompt, diagnostics)
+        response = await async_api.generate_content(model, prompt, _route_generation_config(temperature))
         
         if not response.text:
-            return {'status': 'API_ERROR', 'message': 'Gemini APIから空の応答が返されました。'}
+            return {'status': 'API_ERROR', 'message': 'Gemini APIから空の応答が返されました。', 'diagnostics': diagnostics}
         
-        return {'status': 'OK', 'data': response.text}
+        _record_key_validation(clients.gemini_key_hash, 'valid')
+        if use_cache:
+            get_response_cache().store(key, response.text)
+        return {'status': 'OK', 'data': response.text, 'cached': False, 'diagnostics': diagnostics}
         
     except Exception as e:
         error_info = traceback.format_exc()
-        st.error(f"Gemini API呼び出しエラー: {str(e)}")
-        return {'status': 'API_ERROR', 'message': str(e), 'traceback': error_info}
+        _diagnose(diagnostics, 'error', f"Gemini API呼び出しエラー: {str(e)}")
+        return {'status': 'API_ERROR', 'message': str(e), 'traceback': error_info, 'diagnostics': diagnostics}
 
-def validate_api_keys():
+def validate_api_keys(clients):
     """APIキーの有効性を検証"""
     results = {
-        'gmaps': gmaps_client is not None,
-        'gemini': gemini_model is not None
+        'gmaps': clients.gmaps is not None,
+        'gemini': clients.gemini is not None
     }
     return results
 
-def get_api_status():
+def get_api_status(clients):
     """API接続状況を取得"""
+    gmaps_client = clients.gmaps
+    gemini_model = clients.gemini
     status = {
         'google_maps': {
             'initialized': gmaps_client is not None,
@@ -1,10 +1,8 @@
 import streamlit as st
 import pandas as pd
-import json
 import csv
-import io
-import re
 from datetime import datetime, timedelta
+import time
 import traceback
 import webbrowser
 import urllib.parse
@@ -13,9 +11,14 @@ from textwrap import dedent
 # 既存モジュールのインポート
 try:
     import api_handler
-    from constants import DEBUG
+    import plan_jobs
+    import route_planner
+    from constants import DEBUG, JOB_CONFIG, MATRIX_PROVIDERS, PLAN_VALIDATION_CONFIG, ROUTE_ENGINES
+    from location_table import LOCATION_COLUMNS, MissingColumnsError, normalize_locations, read_locations_csv
+    from prompt_builder import analyze_vehicle_requirements, generate_prompt_preview
+    from route_planner import normalize_ai_items
 except ImportError:
-    st.error("必要なモジュール (api_handler.py, constants.py) が見つかりません。")
+    st.error("必要なモジュール (api_handler.py, plan_jobs.py, route_planner.py, route_solver.py, plan_validator.py, stream_parser.py, prompt_builder.py, location_table.py, constants.py) が見つかりません。")
     st.stop()
 
 # ページ設定
@@ -34,6 +37,9 @@ def initialize_session_state():
     # セッション状態の初期化（改良版：月別API使用量対応）
     if 'api_initialized' not in st.session_state:
         st.session_state.api_initialized = False
+    if 'api_clients' not in st.session_state:
+        # このセッションのAPIキーで使うクライアント（他のセッションのキーの影響を受けない）
+        st.session_state.api_clients = None
     if 'optimization_results' not in st.session_state:
         st.session_state.optimization_results = None
     if 'input_data' not in st.session_state:
@@ -61,7 +67,7 @@ def setup_api_keys():
         st.sidebar.warning("⚠️ 長時間経過。接続エラーの可能性があります。")
         if st.sidebar.button("🔄 セッションリフレッシュ"):
             for key in list(st.session_state.keys()):
-                if key not in ['api_initialized', 'vehicles']:
+                if key not in ['api_initialized', 'api_clients', 'vehicles']:
                     del st.session_state[key]
             st.session_state.last_activity = datetime.now()
             st.rerun()
@@ -71,18 +77,36 @@ def setup_api_keys():
 
     gemini_key = st.sidebar.text_input("Gemini APIキー", value=gemini_key_secret, type="password")
     maps_key = st.sidebar.text_input("Google Maps APIキー", value=maps_key_secret, type="password")
+    
+    if gemini_key and maps_key:
+        # 同じサーバーで適用済みのキーは共有クライアントを使い、ボタンを押さずにすぐ使えるようにする
+        if not st.session_state.api_initialized and api_handler.has_shared_clients(gemini_key, maps_key):
+            diagnostics = []
+            st.session_state.api_initialized = (
+                api_handler.initialize_gemini(gemini_key, diagnostics=diagnostics)
+                and api_handler.initialize_gmaps(maps_key, diagnostics=diagnostics)
+            )
+            if st.session_state.api_initialized:
+                st.session_state.api_clients = api_handler.ApiClients(maps_key, gemini_key)
+            show_diagnostics(diagnostics)
+        # 月別使用量は同じキーを使う全セッションで共有（セッションリフレッシュ後も保持）
+        st.session_state.api_usage_monthly = api_handler.get_shared_usage(gemini_key, maps_key)
 
     if st.sidebar.button("APIキーを適用", use_container_width=True):
         if gemini_key and maps_key:
             with st.spinner("APIを初期化中..."):
-                gemini_success = api_handler.initialize_gemini(gemini_key)
-                maps_success = api_handler.initialize_gmaps(maps_key)
+                diagnostics = []
+                gemini_success = api_handler.initialize_gemini(gemini_key, diagnostics=diagnostics)
+                maps_success = api_handler.initialize_gmaps(maps_key, diagnostics=diagnostics)
+                show_diagnostics(diagnostics)
                 if gemini_success and maps_success:
                     st.session_state.api_initialized = True
+                    st.session_state.api_clients = api_handler.ApiClients(maps_key, gemini_key)
                     st.success("✅ API初期化完了")
                     st.rerun()
                 else:
                     st.session_state.api_initialized = False
+                    st.session_state.api_clients = None
                     st.error("❌ API初期化失敗")
         else:
             st.warning("両方のAPIキーを入力してください。")
@@ -90,14 +114,25 @@ def setup_api_keys():
     if st.session_state.api_initialized:
         st.sidebar.success("✅ API使用可能")
         
+        # バックグラウンドで実行中・失敗したキー検証の表示
+        for label, provider, api_key in (("Gemini", "gemini", gemini_key), ("Google Maps", "google_maps", maps_key)):
+            validation = api_handler.get_key_validation(provider, api_key)
+            if validation and validation['status'] == 'pending':
+                st.sidebar.caption(f"⏳ {label} APIキーを確認中...")
+            elif validation and validation['status'] == 'invalid':
+                st.sidebar.error(f"❌ {label} APIキーの検証に失敗しました: {validation['message']}")
+                st.session_state.api_initialized = False
+        
         # 月別使用量管理
         current_month = datetime.now().strftime("%Y-%m")
         if current_month not in st.session_state.api_usage_monthly:
-            st.session_state.api_usage_monthly[current_month] = {"gemini": 0, "maps": 0}
+            st.session_state.api_usage_monthly[current_month] = {"gemini": 0, "gemini_cache_hits": 0, "maps": 0, "maps_cache_hits": 0}
         
         usage = st.session_state.api_usage_monthly[current_month]
         st.sidebar.metric(f"Gemini API使用 ({current_month})", f"{usage['gemini']}回")
         st.sidebar.metric(f"Maps API使用 ({current_month})", f"{usage['maps']}回")
+        st.sidebar.metric(f"Mapsキャッシュヒット ({current_month})", f"{usage.get('maps_cache_hits', 0)}件")
+        st.sidebar.metric(f"AI応答キャッシュヒット ({current_month})", f"{usage.get('gemini_cache_hits', 0)}回")
         
         # 累計表示
         total_gemini = sum([monthly["gemini"] for monthly in st.session_state.api_usage_monthly.values()])
@@ -165,17 +200,25 @@ def generate_sample_data():
     ]
     return pd.DataFrame(sample_data)
 
+def get_location_table(input_df):
+    # 配送先データの正規化（同じDataFrameに対しては再実行時も結果を再利用）
+    cached = st.session_state.get('location_table')
+    if cached is None or cached[0] is not input_df:
+        cached = (input_df, normalize_locations(input_df))
+        st.session_state.location_table = cached
+    return cached[1]
+
 def data_input_section():
     # データ入力セクション（エラーハンドリング強化版）
     st.header("2. 配送先の入力")
-    REQUIRED_COLUMNS = ["始点", "終着", "地点", "地点コード", "住所", "希望到着", "希望出発", "積み込み重量", "積み込み容量", "荷下ろし重量", "荷下ろし容量", "備考"]
+    REQUIRED_COLUMNS = LOCATION_COLUMNS
     
     # メトリクス表示を復活
     if 'input_data' in st.session_state and not st.session_state.input_data.empty:
         try:
             input_df = st.session_state.input_data
-            start_count = sum(1 for _, row in input_df.iterrows() if str(row.get("始点", "")).strip() == "1")
-            end_count = sum(1 for _, row in input_df.iterrows() if str(row.get("終着", "")).strip() == "2")
+            table = get_location_table(input_df)
+            start_count, end_count = table.start_count, table.end_count
             
             col1, col2, col3 = st.columns(3)
             with col1: 
@@ -210,31 +253,35 @@ def data_input_section():
     
     with tab2:
         uploaded_file = st.file_uploader("配送先データファイル", type=['csv'])
+        # 読み込み済みのファイルは再実行のたびに読み直さない
+        upload_key = None
         if uploaded_file is not None:
+            upload_key = (getattr(uploaded_file, 'file_id', None), uploaded_file.name, uploaded_file.size)
+        if upload_key is not None and st.session_state.get('uploaded_file_key') != upload_key:
             try:
-                # CSV読み込み（エンコーディング自動判定）
-                try:
-                    df = pd.read_csv(uploaded_file, encoding='utf-8-sig')
-                except UnicodeDecodeError:
-                    try:
-                        df = pd.read_csv(uploaded_file, encoding='shift_jis')
-                    except UnicodeDecodeError:
-                        df = pd.read_csv(uploaded_file, encoding='utf-8')
-                
-                # 必須列の存在チェック
-                missing_columns = set(REQUIRED_COLUMNS) - set(df.columns)
-                if missing_columns:
-                    st.error(f"❌ 必須列が不足: {', '.join(missing_columns)}")
-                    st.info("💡 必要な列名一覧:")
-                    for col in REQUIRED_COLUMNS:
-                        st.write(f"• {col}")
-                    return st.session_state.input_data
-                
-                st.session_state.input_data = df[REQUIRED_COLUMNS]
-                st.success(f"✅ {len(df)}件のデータを読み込みました")
-                st.rerun()
+                # CSV読み込み（先頭で文字コードを判定し、必須列のみをチャンク単位で読み込む）
+                progress_bar = st.progress(0.0, text="📥 ファイルを読み込み中...")
+                df = read_locations_csv(
+                    uploaded_file, REQUIRED_COLUMNS,
+                    on_progress=lambda ratio: progress_bar.progress(ratio, text=f"📥 ファイルを読み込み中... {ratio:.0%}")
+                )
+                progress_bar.empty()
+            except MissingColumnsError as e:
+                progress_bar.empty()
+                st.error(f"❌ 必須列が不足: {', '.join(e.missing)}")
+                st.info("💡 必要な列名一覧:")
+                for col in REQUIRED_COLUMNS:
+                    st.write(f"• {col}")
+                return st.session_state.input_data
             except Exception as e:
+                progress_bar.empty()
                 st.error(f"❌ ファイル読み込みエラー: {e}")
+                return st.session_state.input_data
+            
+            st.session_state.input_data = df
+            st.session_state.uploaded_file_key = upload_key
+            st.success(f"✅ {len(df)}件のデータを読み込みました")
+            st.rerun()
     
     return st.session_state.input_data
 
@@ -250,7 +297,8 @@ def optimization_settings():
             ("おまかせ最適化(推奨)", "mode1"), 
             ("最短距離を優先", "mode2"), 
             ("時間指定を厳守", "mode3"), 
-            ("カスタムプロンプト", "mode4")
+            ("カスタムプロンプト", "mode4"),
+            ("ハイブリッド(ローカル計算＋AI要約)", "mode5")
         ]
         selected_option = st.selectbox(
             "最適化目標", 
@@ -259,7 +307,40 @@ def optimization_settings():
         )
         optimization_mode = selected_option[1]
         
+        if optimization_mode == "mode5":
+            # ハイブリッドはルートをローカルで計算し、AIはサマリーのみ作成する
+            route_engine = "local"
+            st.caption("ルートはローカルソルバーで計算し、AIはサマリーと注意点のみを作成します。")
+        else:
+            route_engine = st.radio(
+                "計画エンジン",
+                list(ROUTE_ENGINES.keys()),
+                format_func=lambda x: ROUTE_ENGINES[x],
+                horizontal=True,
+                help="ローカルソルバーはAIを使わず、数秒以内に毎回同じ計画を作成します。"
+                     "複数案はAIとローカルソルバーの案を並列に作成し、移動時間・遅れ・台数で比較して最良の案を採用します"
+                     "（AIを複数回呼び出します）"
+            )
+        
+        matrix_provider = st.selectbox(
+            "距離・移動時間",
+            list(MATRIX_PROVIDERS.keys()),
+            format_func=lambda x: MATRIX_PROVIDERS[x],
+            help="推定は緯度経度と過去の実測値から計算し、Distance Matrix APIを使いません。推定値の区間の補正はローカルソルバー使用時のみ有効です"
+        )
         use_tolls = st.checkbox("有料道路を使用", value=True)
+        stream_response = st.checkbox(
+            "AIの応答を受信しながら表示", value=True,
+            help="サマリーと車両ごとの計画を、AIの生成完了を待たずに順次表示します（複数案では無効）"
+        )
+        auto_revise = st.checkbox(
+            "AIの計画を検証し、問題があれば修正を依頼", value=True,
+            help="移動時間・希望時刻・積載・労働条件と照合し、問題のある車両の計画のみをAIに作り直してもらいます（問題がある場合のみAPIを追加で1回呼び出します）"
+        )
+        use_response_cache = st.checkbox(
+            "同じ条件のAI応答を再利用", value=True,
+            help="入力と条件が前回と同じ場合は、保存済みのAI応答を使いGemini APIを呼び出しません。別の提案が欲しい場合はオフにしてください"
+        )
     
     with col2:
         st.subheader("労働条件設定")
@@ -289,7 +370,12 @@ def optimization_settings():
     
     return {
         "mode": optimization_mode, 
+        "route_engine": route_engine,
+        "matrix_provider": matrix_provider,
         "use_tolls": use_tolls, 
+        "stream_response": stream_response,
+        "use_response_cache": use_response_cache,
+        "auto_revise": auto_revise,
         "continuous_limit": continuous_limit, 
         "continuous_hours": continuous_hours, 
         "rest_minutes": rest_minutes, 
@@ -298,522 +384,107 @@ def optimization_settings():
         "custom_prompt": custom_prompt
     }
 
-def analyze_vehicle_requirements(input_data):
-    """時間制約から必要車両数を自動判断"""
-    from datetime import datetime
-    import pandas as pd
-    
-    time_slots = []
-    for loc in input_data:
-        arrival_str = loc.get('希望到着', '')
-        departure_str = loc.get('希望出発', '')
-        
-        if arrival_str and departure_str:
-            try:
-                arrival_time = pd.to_datetime(arrival_str)
-                departure_time = pd.to_datetime(departure_str)
-                time_slots.append({
-                    'location': loc.get('地点', ''),
-                    'arrival': arrival_time,
-                    'departure': departure_time,
-                    'location_code': loc.get('地点コード', '')
-                })
-            except:
-                continue
-    
-    # 時間重複を検出
-    conflicts = []
-    for i, slot1 in enumerate(time_slots):
-        for j, slot2 in enumerate(time_slots[i+1:], i+1):
-            # 時間重複の判定
-            if (slot1['arrival'] < slot2['departure'] and slot2['arrival'] < slot1['departure']):
-                conflicts.append((slot1, slot2))
-    
-    min_vehicles_needed = 1
-    if conflicts:
-        # 単純化：重複がある場合は最低2台必要
-        min_vehicles_needed = len(conflicts) + 1
-    
-    return min_vehicles_needed, conflicts
-
-def get_available_vehicles_for_ai(selected_vehicles, all_vehicles, min_required):
-    """AI用に利用可能車両を準備（修正版：所属情報を除外）"""
-    # 選択された車両
-    selected_count = len(selected_vehicles)
-    
-    # 不足している場合は追加で利用可能車両を含める
-    if selected_count < min_required:
-        available_vehicles = [v for v in all_vehicles if v.get("車両ステータス") == "稼働中"]
-        # 選択済み車両の車両IDを取得
-        selected_ids = set(selected_vehicles['車両ID'].tolist())
-        
-        # 追加で利用可能な車両を含める
-        additional_vehicles = []
-        for vehicle in available_vehicles:
-            if vehicle['車両ID'] not in selected_ids:
-                additional_vehicles.append(vehicle)
-                if len(selected_vehicles) + len(additional_vehicles) >= min_required:
-                    break
-        
-        # 選択済み + 追加車両を結合
-        all_available = pd.concat([
-            selected_vehicles,
-            pd.DataFrame(additional_vehicles)
-        ], ignore_index=True)
-        
-        # 所属、選択、メモ欄を除外してAIに送信
-        return all_available.drop(columns=['選択', 'メモ欄', '所属'], errors='ignore')
-    
-    # 所属、選択、メモ欄を除外してAIに送信
-    return selected_vehicles.drop(columns=['選択', 'メモ欄', '所属'], errors='ignore')
-
-def generate_prompt_preview(selected_vehicles, all_vehicles, input_data, settings):
-    # プレビュー用プロンプトを生成（修正版：所属情報を除外）
-    prompt_parts = []
-    
-    # 必要車両数の自動判断
-    min_required, conflicts = analyze_vehicle_requirements(input_data)
-    vehicles_for_ai = get_available_vehicles_for_ai(selected_vehicles, all_vehicles, min_required)
-    
-    # 片道輸送の明確化を最優先で配置
-    transport_method_clarification = """## 🎯 最重要・輸送方式の明確化
-これは片道輸送です。始点から終着点への一方向移動のみを行い、往復・巡回・帰還は一切行いません。
-終着地で業務を完了し、始点に戻る必要はありません。
-
-## 🚚 交通手段について
-移動には自動車(トラック・バン等の道路輸送)を使用してください。必要に応じて船舶(フェリー)との併用も可能です。
-ただし、航空便、貨物列車、宅配便等の利用はできません。
-
-"""
-    
-    if settings["mode"] == "mode4":
-        prompt_parts.append(f"""# 役割
-あなたは、物流業界で豊富な経験を持つ配車計画の専門家です。
-
-{transport_method_clarification}
-
-# 最重要・お客様からの特別なご要望
-以下のご指示を、他のどのような条件よりも優先して実行してください。
-
-{settings["custom_prompt"]}
-""")
-    else:
-        prompt_parts.append(f"""# 役割
-あなたは、物流業界で豊富な経験を持つ配車計画の専門家です。
-
-{transport_method_clarification}
-
-# 文脈・状況について""")
-        
-        # 複数車両必要性の自動判断結果を含める
-        if min_required > 1:
-            prompt_parts.append(f"時間制約の分析により、最低{min_required}台の車両が必要です。")
-            if conflicts:
-                prompt_parts.append("以下の時間重複が検出されました：")
-                for conflict in conflicts:
-                    prompt_parts.append(f"- {conflict[0]['location']}と{conflict[1]['location']}が同時間帯に重複")
-        
-        prompt_parts.append(f"利用可能な{len(vehicles_for_ai)}台の車両から最適な配車計画を立ててください。")
-        
-        if settings["use_tolls"]:
-            prompt_parts.append("移動の際は、有料道路も利用して構いません。")
+def show_diagnostics(diagnostics):
+    # api_handler・route_plannerが返した警告・エラーをまとめて表示
+    for diagnostic in diagnostics:
+        if diagnostic.get('level') == 'error':
+            st.error(diagnostic['message'])
+        elif diagnostic.get('level') == 'info':
+            st.info(diagnostic['message'])
         else:
-            prompt_parts.append("なお、移動時は有料道路を避けるルートでお願いします。")
-        
-        # 労働条件を自然な文章で追加
-        if settings["continuous_limit"] or settings["daily_limit"]:
-            prompt_parts.append("\n\nドライバーの労働環境にも十分配慮していただき、")
-            labor_conditions = []
-            if settings["continuous_limit"]:
-                labor_conditions.append(f"連続運転時間は{settings['continuous_hours']}時間以内")
-            if settings["daily_limit"]:
-                labor_conditions.append(f"1日の全体拘束時間は{settings['daily_hours']}時間以内")
-            prompt_parts.append("、".join(labor_conditions) + "となるよう計画していただけますでしょうか。")
-        
-        prompt_parts.append("\n\n# 今回の計画で最も重視していただきたいポイント")
-        if settings["mode"] == "mode1":
-            prompt_parts.append("全体の移動時間をできる限り短縮することを最優先にお考えください。")
-        elif settings["mode"] == "mode2":
-            prompt_parts.append("総走行距離を最小限に抑えることを最優先にお考えください。")
-        elif settings["mode"] == "mode3":
-            prompt_parts.append("各訪問先の希望到着・出発時刻をできる限り厳守することを最優先にお考えください。")
-
-    prompt_parts.append("\n\n# 制約・条件")
-    prompt_parts.append("## 働き方に関する重要規則")
-    prompt_parts.append("### フェリー特例")
-    prompt_parts.append("以下の規則を厳密に遵守してください。")
-    prompt_parts.append("- フェリー乗船時間は、原則として、休息期間として取り扱います。")
-    prompt_parts.append("- フェリー乗船時間が8時間を超える場合には、原則としてフェリー下船時刻から次の勤務が開始される（勤務日がリセットされる）ものとします。この場合、計画が複数日にまたがっても構いません。")
-    prompt_parts.append("- **重要**: フェリー乗船中の休憩時間は、具体的な開始時刻と終了時刻を明記してください。")
-    prompt_parts.append("- **例**: 11:00乗船、翌日06:00下船の場合 → 23:00-06:00を「フェリー乗船中休息」として明記")
-    prompt_parts.append("- **重要**: フェリー乗船中の休憩時間は、具体的な開始時刻と終了時刻を明記してください。")
-    prompt_parts.append("- **例**: 11:00乗船、翌日06:00下船の場合 → 23:00-06:00を「フェリー乗船中休息」として明記")
-    
-    prompt_parts.append("\n### ⚠️ 重要：実在する交通インフラのみ使用")
-    prompt_parts.append("**絶対に架空の港や航路を作らないでください。**")
-    prompt_parts.append("実在するフェリー航路のみ：")
-    prompt_parts.append("- 本州↔北海道: 大間港↔函館港（1時間30分）、青森港↔函館港（3時間40分）、八戸港↔苫小牧港（8時間）")
-    prompt_parts.append("- 本州↔九州: 別府港↔八幡浜港、新門司港↔大阪南港")
-    prompt_parts.append("- 本州↔四国: 高松港↔宇野港、小豆島航路")
-    prompt_parts.append("**重要**: 東京↔札幌の直通フェリーは存在しません。北海道への移動は陸路で本州フェリー港まで移動後、フェリーで北海道の港へ、その後陸路で目的地という経路になります。")
-    prompt_parts.append("**札幌港、東京港などの架空の港は絶対に使用しないでください。**")
-    
-    prompt_parts.append("\n### ⚠️ 重要：実在する交通インフラのみ使用")
-    prompt_parts.append("**絶対に架空の港や航路を作らないでください。**")
-    prompt_parts.append("実在するフェリー航路のみ：")
-    prompt_parts.append("- 本州↔北海道: 大間港↔函館港（1時間30分）、青森港↔函館港（3時間40分）、八戸港↔苫小牧港（8時間）")
-    prompt_parts.append("- 本州↔九州: 別府港↔八幡浜港、新門司港↔大阪南港")
-    prompt_parts.append("- 本州↔四国: 高松港↔宇野港、小豆島航路")
-    prompt_parts.append("**重要**: 東京↔札幌の直通フェリーは存在しません。北海道への移動は陸路で本州フェリー港まで移動後、フェリーで北海道の港へ、その後陸路で目的地という経路になります。")
-    prompt_parts.append("**札幌港、東京港などの架空の港は絶対に使用しないでください。**")
-
-    # 重要：複数車両使用の指示を明確化
-    prompt_parts.append("\n## 🚛 車両使用に関する最重要な指示")
-    prompt_parts.append("- **同時刻に複数地点での作業が必要な場合は、必ず異なる車両に割り当ててください**")
-    prompt_parts.append("- **1台の車両が同時に2箇所にいることは物理的に不可能です**")
-    prompt_parts.append("- **時間制約により複数車両が必要な場合は、積極的に複数車両を使用してください**")
-    prompt_parts.append("- **物理的に不可能なスケジュールの場合は、警告をサマリーに含めてください**")
-
-    prompt_parts.append("\n## 利用可能な車両情報")
-    prompt_parts.append(vehicles_for_ai.to_markdown(index=False))
-
-    prompt_parts.append("\n## 訪問地点の詳細情報")
-    prompt_parts.append("| 始点 | 終着 | 地点 | 地点コード | 住所 | 希望到着 | 希望出発 | 積込kg | 積込m3 | 荷卸kg | 荷卸m3 |")
-    prompt_parts.append("|:--|:--|:--|:--|:--|:--|:--|:--|:--|:--|:--|")
-    
-    for loc in input_data:
-        # 備考欄を除外したテーブル生成（プレビュー版でも同様）
-        row_str = f"| {loc.get('始点', '')} | {loc.get('終着', '')} | {loc.get('地点', '')} | {loc.get('地点コード', '')} | {loc.get('住所', '')} | {loc.get('希望到着', '')} | {loc.get('希望出発', '')} | {loc.get('積み込み重量', 0)} | {loc.get('積み込み容量', 0)} | {loc.get('荷下ろし重量', 0)} | {loc.get('荷下ろし容量', 0)} |"
-        prompt_parts.append(row_str)
-
-    prompt_parts.append("\n## 地点間の移動時間と距離について")
-    prompt_parts.append("※実際の実行時には、Google Maps APIから取得したリアルタイムの交通情報を含む詳細データが追加されます。")
-
-    prompt_parts.append("""
-# タスク
-上記の全ての条件を満たす、最適な片道輸送計画を作成してください。
-
-# 重要な計画要件
-1. **始点拠点への到着**: 始点拠点（出発地）にも到着時刻を設定してください（荷物の引き取り作業のため）
-2. **適切な休憩**: 連続運転時間制限やフェリー特例に応じて、必要な休憩や休息期間を計画に含めてください
-3. **全拠点の訪問**: 始点から各経由地を通って終着点まで、すべての拠点を効率的に巡回してください
-4. **終着点の扱い**: 終着点（`終着`フラグが2の地点）の扱いは、入力データに従ってください
-5. **⚠️ 最重要：時間制約の厳守**: 同時刻に複数地点での作業が必要な場合は、必ず複数車両を使用してください
-
-# 出力形式についてのお願い
-1. まず最初に、計画全体の要点を簡潔にまとめたサマリーコメントを日本語で記述してください。
-   - **重要**: 複数車両が必要な理由がある場合は、その旨と根拠をサマリーに必ず含めてください
-   - **重要**: 物理的に不可能な時間指定がある場合は、警告をサマリーに必ず含めてください
-   - **重要**: フェリー特例を適用した場合（例：乗船時間を休息期間とした、勤務をリセットした等）は、その旨と法的根拠をサマリーに必ず含めてください
-2. 次に、必ず改行して区切り線`---`を一行だけ出力してください。
-3. 最後に、運行計画の詳細をJSONオブジェクトのリストとして出力してください。
-4. **最重要:** JSONの各オブジェクトには、**必ず** `d`, `proposed_time`, `desired_time`, `time_difference`, `status`, `location_id`, `name_code`, `location_name`, `remarks` のキーを**すべて含めてください**。値がない場合は空文字 `""` を入れること。
-5. `status` キーの値は、必ず「出発」「到着」「移動」「滞在」「休憩」「フェリー乗船」「フェリー移動」「フェリー下船」「フェリー乗船中休息」のいずれかを使用すること。
-6. **始点拠点には「到着」ステータスを必ず含める**こと（荷物引き取りのため）
-7. **必要に応じて「休憩」やフェリー関連のステータスを適切に配置**すること。
-
-```json
-[
-    {
-        "d": "トラック1",
-        "proposed_time": "YYYY/MM/DD HH:MM",
-        "desired_time": "YYYY/MM/DD HH:MM", 
-        "time_difference": "HH:MM",
-        "status": "到着",
-        "location_id": "",
-        "name_code": "地点コード",
-        "location_name": "地点名",
-        "remarks": "始点拠点への到着（荷物引き取り）"
-    }
-]
-```""")
-    
-    return "\n".join(prompt_parts)
+            st.warning(diagnostic['message'])
 
-def calculate_route(vehicles, input_data, settings):
-    # ルート計算の実行（修正版：所属情報を除外）
-    numeric_columns = ["積み込み重量", "積み込み容量", "荷下ろし重量", "荷下ろし容量"]
-    locations = []
-    
-    for row in input_data:
-        loc = {}
-        for key, value in row.items():
-            # 備考欄は人間用のため、AIには送信しない
-            if key == '備考':
-                continue
-            if key in numeric_columns:
-                try: 
-                    loc[key] = float(value) if pd.notna(value) and value != '' else 0.0
-                except (ValueError, TypeError): 
-                    loc[key] = 0.0
-            else: 
-                loc[key] = str(value) if pd.notna(value) else ""
-        locations.append(loc)
-    
-    # 始点・終着の存在チェック
-    start_locations = [loc for loc in locations if loc.get("始点") == '1']
-    end_locations = [loc for loc in locations if loc.get("終着") == '2']
-    
-    if not start_locations: 
-        raise ValueError("始点フラグ(1)が設定されていません")
-    if not end_locations:
-        raise ValueError("終着フラグ(2)が設定されていません")
-    
-    start_location = start_locations[0]
-    try: 
-        departure_dt = pd.to_datetime(start_location.get("希望出発", "")).to_pydatetime()
-    except (ValueError, TypeError): 
-        departure_dt = datetime.now() + timedelta(hours=1)
-
-    with st.spinner("🗺️ 地点間の距離と時間を計算中..."):
-        matrix = api_handler.get_distance_matrix(locations, departure_dt, settings["use_tolls"])
-        
-        # API使用量の計算
-        current_month = datetime.now().strftime("%Y-%m")
-        if current_month not in st.session_state.api_usage_monthly:
-            st.session_state.api_usage_monthly[current_month] = {"gemini": 0, "maps": 0}
-        
-        maps_calls = len(locations) * len(locations)
-        st.session_state.api_usage_monthly[current_month]["maps"] += maps_calls
-        
-    if not matrix or matrix.get('status') != 'OK': 
-        raise Exception(f"Google Maps API エラー: {matrix.get('message', '不明なエラー')}")
-
-    # 車両マスタから全車両情報を取得
-    all_vehicles = st.session_state.vehicles
-    
-    # 改良されたプロンプト生成（所属情報除外版）
-    prompt = generate_prompt(vehicles, all_vehicles, locations, matrix, settings)
-
-    with st.spinner("🤖 AIが最適なルートを思考中..."):
-        ai_response = api_handler.get_ai_route_plan(prompt)
-        current_month = datetime.now().strftime("%Y-%m")
-        if current_month in st.session_state.api_usage_monthly:
-            st.session_state.api_usage_monthly[current_month]["gemini"] += 1
-            
-    if not ai_response or ai_response.get('status') != 'OK': 
-        raise Exception(f"Gemini API エラー: {ai_response.get('message', '不明なエラー')}")
-
-    processed_results, summary_text = process_ai_response(ai_response, locations)
-    return processed_results, summary_text, prompt
-
-def generate_prompt(selected_vehicles, all_vehicles, locations, matrix, settings):
-    # AI実行用プロンプト生成（修正版：所属情報を除外）
-    prompt_parts = []
-    
-    # 必要車両数の自動判断
-    input_data_for_analysis = []
-    for loc in locations:
-        input_data_for_analysis.append({
-            '地点': loc.get('地点', ''),
-            '地点コード': loc.get('地点コード', ''),
-            '希望到着': loc.get('希望到着', ''),
-            '希望出発': loc.get('希望出発', '')
-        })
-    
-    min_required, conflicts = analyze_vehicle_requirements(input_data_for_analysis)
-    vehicles_for_ai = get_available_vehicles_for_ai(selected_vehicles, all_vehicles, min_required)
-    
-    # 片道輸送の明確化と車両設定
-    transport_method_clarification = """## 🎯 最重要・輸送方式の明確化
-これは片道輸送です。始点から終着点への一方向移動のみを行い、往復・巡回・帰還は一切行いません。
-終着地で業務を完了し、始点に戻る必要はありません。
-
-## 🚚 交通手段について
-移動には自動車(トラック・バン等の道路輸送)を使用してください。必要に応じて船舶(フェリー)との併用も可能です。
-ただし、航空便、貨物列車、宅配便等の利用はできません。
-
-"""
-
-    if settings["mode"] == "mode4":
-        prompt_parts.append(f"""# 役割
-あなたは、物流業界で豊富な経験を持つ配車計画の専門家です。
-
-{transport_method_clarification}
-
-# 最重要・お客様からの特別なご要望
-以下のご指示を、他のどのような条件よりも優先して実行してください。
-
-{settings["custom_prompt"]}
-""")
+def current_job():
+    # 現在のルート計算ジョブ（ジョブIDはURLにも保存し、再接続後の新しいセッションでも参照する）
+    job_id = st.session_state.get("plan_job_id") or st.query_params.get("job")
+    if not job_id:
+        return None
+    job = plan_jobs.job_queue.get(job_id)
+    if job is None:
+        # サーバーの再起動や保持期間切れで結果が残っていない
+        clear_current_job()
+    return job
+
+def clear_current_job():
+    st.session_state.plan_job_id = None
+    if "job" in st.query_params:
+        del st.query_params["job"]
+
+def start_route_job(vehicles, table, settings, previous=None):
+    # ルート計算をバックグラウンドのジョブとして開始（画面の再実行や接続断でも計算は中断されない）
+    # previous（前回の結果）を指定した場合は、入力の変更分だけを前回の計画に反映する
+    if previous is not None:
+        job_id = plan_jobs.job_queue.submit(
+            route_planner.replan_route, st.session_state.api_clients, previous, vehicles, st.session_state.vehicles,
+            table, settings
+        )
     else:
-        prompt_parts.append(f"""# 役割
-あなたは、物流業界で豊富な経験を持つ配車計画の専門家です。
-
-{transport_method_clarification}
-
-# 文脈・状況について""")
-        
-        # 複数車両必要性の自動判断結果を含める
-        if min_required > 1:
-            prompt_parts.append(f"⚠️ 重要：時間制約の分析により、最低{min_required}台の車両が必要です。")
-            if conflicts:
-                prompt_parts.append("以下の時間重複が検出されました：")
-                for conflict in conflicts:
-                    prompt_parts.append(f"- {conflict[0]['location']}({conflict[0]['arrival'].strftime('%H:%M')}-{conflict[0]['departure'].strftime('%H:%M')})と{conflict[1]['location']}({conflict[1]['arrival'].strftime('%H:%M')}-{conflict[1]['departure'].strftime('%H:%M')})が重複")
-        
-        prompt_parts.append(f"利用可能な{len(vehicles_for_ai)}台の車両から最適な配車計画を立ててください。")
-        
-        if settings["use_tolls"]:
-            prompt_parts.append("移動の際は、有料道路も利用して構いません。")
-        else:
-            prompt_parts.append("なお、移動時は有料道路を避けるルートでお願いします。")
-        
-        if settings["continuous_limit"] or settings["daily_limit"]:
-            prompt_parts.append("\n\nドライバーの労働環境にも十分配慮していただき、")
-            labor_conditions = []
-            if settings["continuous_limit"]:
-                labor_conditions.append(f"連続運転時間は{settings['continuous_hours']}時間以内")
-            if settings["daily_limit"]:
-                labor_conditions.append(f"1日の全体拘束時間は{settings['daily_hours']}時間以内")
-            prompt_parts.append("、".join(labor_conditions) + "となるよう計画していただけますでしょうか。")
-        
-        # 最適化目標を自然な文章で明確化
-        prompt_parts.append("\n\n# 今回の計画で最も重視していただきたいポイント")
-        if settings["mode"] == "mode1":
-            prompt_parts.append("全体の移動時間をできる限り短縮することを最優先にお考えください。")
-        elif settings["mode"] == "mode2":
-            prompt_parts.append("総走行距離を最小限に抑えることを最優先にお考えください。")
-        elif settings["mode"] == "mode3":
-            prompt_parts.append("各訪問先の希望到着・出発時刻をできる限り厳守することを最優先にお考えください。")
-    
-    # 重要：複数車両使用の指示を明確化
-    prompt_parts.append("\n## 🚛 車両使用に関する重要な指示")
-    prompt_parts.append("- 時間制約により複数車両が必要な場合は、積極的に複数車両を使用してください")
-    prompt_parts.append("- 同時刻に複数地点での作業が必要な場合は、必ず異なる車両に割り当ててください")
-    prompt_parts.append("- 物理的に不可能なスケジュールの場合は、実現可能な代替案を提示してください")
-    
-    prompt_parts.append("\n## 利用可能な車両情報")
-    prompt_parts.append(vehicles_for_ai.to_markdown(index=False))
-    
-    prompt_parts.append("\n## 訪問地点の詳細情報")
-    prompt_parts.append("| 始点 | 終着 | 地点 | 地点コード | 住所 | 希望到着 | 希望出発 | 積込kg | 積込m3 | 荷卸kg | 荷卸m3 |")
-    prompt_parts.append("|:--|:--|:--|:--|:--|:--|:--|:--|:--|:--|:--|")
-    
-    for loc in locations:
-        # 備考欄を除外したテーブル生成
-        row_str = f"| {loc.get('始点', '')} | {loc.get('終着', '')} | {loc.get('地点', '')} | {loc.get('地点コード', '')} | {loc.get('住所', '')} | {loc.get('希望到着', '')} | {loc.get('希望出発', '')} | {loc.get('積み込み重量', 0)} | {loc.get('積み込み容量', 0)} | {loc.get('荷下ろし重量', 0)} | {loc.get('荷下ろし容量', 0)} |"
-        prompt_parts.append(row_str)
-    
-    prompt_parts.append("\n## 地点間の移動時間と距離の詳細データ")
-    for i, origin in enumerate(locations):
-        prompt_parts.append(f"### {origin.get('地点', '')} からの移動時間・距離:")
-        for j, dest in enumerate(locations):
-            if i == j: 
-                continue
-            element = matrix['rows'][i]['elements'][j]
-            if element['status'] == 'OK': 
-                prompt_parts.append(f"- {dest.get('地点', '')} まで: {element['duration']['text']} ({element['distance']['text']})")
-
-    prompt_parts.append("""
-# タスク
-上記の全ての条件を満たす、最適な片道輸送計画を作成してください。
-
-# 重要な計画要件
-1. **始点拠点への到着**: 始点拠点（出発地）にも到着時刻を設定してください（荷物の引き取り作業のため）
-2. **適切な休憩**: 連続運転時間制限やフェリー特例に応じて、必要な休憩や休息期間を計画に含めてください
-3. **全拠点の訪問**: 始点から各経由地を通って終着点まで、すべての拠点を効率的に巡回してください
-4. **終着点の扱い**: 終着点（`終着`フラグが2の地点）の扱いは、入力データに従ってください
-5. **⚠️ 最重要：時間制約の厳守**: 同時刻に複数地点での作業が必要な場合は、必ず複数車両を使用してください
-
-# 出力形式についてのお願い
-1. まず最初に、計画全体の要点を簡潔にまとめたサマリーコメントを日本語で記述してください。
-   - **重要**: 複数車両が必要な理由がある場合は、その旨と根拠をサマリーに必ず含めてください
-   - **重要**: 物理的に不可能な時間指定がある場合は、警告をサマリーに必ず含めてください
-   - **重要**: フェリー特例を適用した場合（例：乗船時間を休息期間とした、勤務をリセットした等）は、その旨と法的根拠をサマリーに必ず含めてください
-2. 次に、必ず改行して区切り線`---`を一行だけ出力してください。
-3. 最後に、運行計画の詳細をJSONオブジェクトのリストとして出力してください。
-4. **最重要:** JSONの各オブジェクトには、**必ず** `d`, `proposed_time`, `desired_time`, `time_difference`, `status`, `location_id`, `name_code`, `location_name`, `remarks` のキーを**すべて含めてください**。値がない場合は空文字 `""` を入れること。
-5. `status` キーの値は、必ず「出発」「到着」「移動」「滞在」「休憩」「フェリー乗船」「フェリー移動」「フェリー下船」のいずれかを使用すること。
-6. **始点拠点には「到着」ステータスを必ず含める**こと（荷物引き取りのため）
-7. **必要に応じて「休憩」やフェリー関連のステータスを適切に配置**すること。
-
-```json
-[
-    {
-        "d": "トラック1",
-        "proposed_time": "YYYY/MM/DD HH:MM",
-        "desired_time": "YYYY/MM/DD HH:MM", 
-        "time_difference": "HH:MM",
-        "status": "到着",
-        "location_id": "",
-        "name_code": "地点コード",
-        "location_name": "地点名",
-        "remarks": "始点拠点への到着（荷物引き取り）"
-    }
-]
-```""")
-    
-    return "\n".join(prompt_parts)
-
-def process_ai_response(ai_response, locations):
-    # AI応答の処理（CSV出力バグ修正版）
-    raw_data = ai_response.get('data', '')
-    summary_text, _, json_part = raw_data.partition('---')
-    summary_text = summary_text.strip()
-    json_part = json_part.strip()
-
-    try:
-        json_str_match = re.search(r'```json\n(.*?)\n```', json_part, re.DOTALL)
-        json_str = json_str_match.group(1) if json_str_match else json_part
-        
-        if not (json_str and json_str.strip().startswith('[')):
-            return [], f"AI応答のJSON解析エラー: JSONデータが見つかりません。\n\n{raw_data}"
-
-        data = json.loads(json_str)
-        while isinstance(data, list) and len(data) == 1 and isinstance(data[0], list): 
-            data = data[0]
-
-    except json.JSONDecodeError as e:
-        st.error(f"AI応答のJSON解析エラー: {e}")
-        return [], f"AI応答のJSON解析に失敗しました。AIの出力形式が不正な可能性があります。\n\n---受信データ---\n{raw_data}"
-
-    if not isinstance(data, list): 
-        return [], f"AI応答データがリスト形式ではありません"
-
-    address_map = {loc.get("地点コード"): loc.get("住所") for loc in locations if loc.get("地点コード")}
-    processed_data = []
-
-    for i, item in enumerate(data):
-        if not isinstance(item, dict): 
-            continue
-
-        # 移動ステータスの場合、次の到着ステータスを探して時間範囲を生成する
-        status = item.get('status', '')
-        proposed_time_str = item.get('proposed_time', '')
-
-        if status in ['移動', 'フェリー移動'] and proposed_time_str:
-            start_time = proposed_time_str
-            end_time = ""
-            # 次の到着イベントを探す
-            for next_item in data[i+1:]:
-                if next_item.get('status', '') in ['到着', 'フェリー乗船', 'フェリー下船']:
-                    end_time = next_item.get('proposed_time', '')
-                    break
-
-            if end_time:
-                # 提案時間を「開始時間 - 終了時間」の形式に更新
-                item['proposed_time'] = f"{start_time} - {end_time}"
-
-        # データの正規化（CSV出力対応）
-        processed_item = {
-            "車両": str(item.get('d', 'トラック1')).strip(), 
-            "提案時間": str(item.get('proposed_time', '')).strip(), 
-            "希望時間": str(item.get('desired_time', '')).strip(), 
-            "時間差": str(item.get('time_difference', '')).strip(), 
-            "ステータス": str(item.get('status', '')).strip(), 
-            "地点ID": str(item.get('location_id', '')).strip(), 
-            "地点コード": str(item.get('name_code', '')).strip(), 
-            "地点名": str(item.get('location_name', '')).strip(), 
-            "住所": str(address_map.get(item.get('name_code', ''), '')).strip(), 
-            "備考": str(item.get('remarks', '')).strip()
+        job_id = plan_jobs.job_queue.submit(
+            route_planner.plan_route, st.session_state.api_clients, vehicles, st.session_state.vehicles, table,
+            settings
+        )
+    st.session_state.plan_job_id = job_id
+    st.session_state.optimization_results = None
+    st.query_params["job"] = job_id
+
+def record_job_usage(job):
+    # 完了したジョブのAPI使用量を月別使用量に加算（キャッシュから取得した組は課金対象外）
+    usage = job.claim_usage()
+    if not usage:
+        return
+    current_month = datetime.now().strftime("%Y-%m")
+    monthly_usage = st.session_state.api_usage_monthly.setdefault(current_month, {"gemini": 0, "gemini_cache_hits": 0, "maps": 0, "maps_cache_hits": 0})
+    for key, count in usage.items():
+        monthly_usage[key] = monthly_usage.get(key, 0) + count
+
+def display_job_progress(snapshot, locations):
+    # 実行中のジョブの段階・進捗と、ストリーミングで受信済みのサマリー・車両別計画を表示
+    st.progress(snapshot["progress"])
+    detail = f" - {snapshot['detail']}" if snapshot["detail"] else ""
+    st.text(f"{snapshot['stage']}{detail}（{snapshot['elapsed']:.0f}秒経過）")
+    st.caption("💡 計算はサーバー側で続行されます。接続が切れた場合も、このページを再読み込みすると結果を表示できます。")
+    
+    if snapshot["summary"] is not None:
+        st.subheader("📝 AI分析サマリー（受信中）")
+        st.info(snapshot["summary"])
+    if snapshot["items"]:
+        df_partial = pd.DataFrame(normalize_ai_items(snapshot["items"], locations))
+        if not df_partial.empty:
+            # 最後の車両は受信途中のため、確定した車両のみ表示
+            vehicles = df_partial["車両"].unique()
+            for vehicle in vehicles[:-1]:
+                display_vehicle_plan(df_partial[df_partial["車両"] == vehicle], vehicle)
+
+def route_job_section(table):
+    # ルート計算ジョブの進捗表示と、完了したジョブの結果の取り込み（実行中ならTrueを返す）
+    job = current_job()
+    if job is None:
+        return False
+    
+    snapshot = job.snapshot()
+    if not job.finished:
+        display_job_progress(snapshot, table.records if table is not None else [])
+        return True
+    
+    if snapshot["status"] == "error":
+        st.error(f"❌ エラーが発生しました: {snapshot['error']}")
+        if DEBUG:
+            st.error(snapshot["traceback"])
+        return False
+    
+    if st.session_state.get("loaded_job_id") != snapshot["job_id"]:
+        result = snapshot["result"]
+        st.session_state.optimization_results = {
+            "results": result["results"], "summary": result["summary"], "prompt": result["prompt"],
+            "violations": result.get("violations", []), "basis": result.get("basis"),
+            "processing_time": snapshot["elapsed"]
         }
-        
-        # 空のデータや重複データをスキップ
-        if processed_item["車両"] and processed_item["ステータス"]:
-            processed_data.append(processed_item)
-
-    return processed_data, summary_text
+        st.session_state.loaded_job_id = snapshot["job_id"]
+        st.session_state.last_activity = datetime.now()
+        record_job_usage(job)
+        show_diagnostics(result["diagnostics"])
+        st.success(f"✅ 提案完了！ (処理時間: {snapshot['elapsed']:.1f}秒)")
+    return False
 
 def calculate_time_totals(vehicle_data):
     # 各トラックの実際の所要時間を計算（復活版）
@@ -907,6 +578,22 @@ def generate_map_link(vehicle_data, vehicle_name):
     except Exception as e:
         st.error(f"マップリンク生成エラー: {str(e)}")
 
+def display_vehicle_plan(vehicle_data, vehicle):
+    # 1台分の運行計画を表示
+    with st.expander(f"🚚 {vehicle} の運行計画", expanded=True):
+        # 時間合計の計算と表示
+        proposed_total, desired_total, time_diff = calculate_time_totals(vehicle_data)
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.markdown(f"📈 **提案時間合計**: {proposed_total}")
+        with col2:
+            st.markdown(f"📅 **希望時間合計**: {desired_total}")
+        with col3:
+            st.markdown(f"⏰ **所要時間差**: {time_diff}")
+        
+        st.dataframe(vehicle_data.drop('車両', axis=1), use_container_width=True, hide_index=True)
+        generate_map_link(vehicle_data, vehicle)
+
 def display_results(results_data, summary_text):
     # 結果表示セクション（復活版）
     if not results_data: 
@@ -919,53 +606,16 @@ def display_results(results_data, summary_text):
     vehicles = df_results['車両'].unique()
     
     for vehicle in vehicles:
-        with st.expander(f"🚚 {vehicle} の運行計画", expanded=True):
-            vehicle_data = df_results[df_results['車両'] == vehicle]
-            
-            # 時間合計の計算と表示
-            proposed_total, desired_total, time_diff = calculate_time_totals(vehicle_data)
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.markdown(f"📈 **提案時間合計**: {proposed_total}")
-            with col2:
-                st.markdown(f"📅 **希望時間合計**: {desired_total}")
-            with col3:
-                st.markdown(f"⏰ **所要時間差**: {time_diff}")
-            
-            st.dataframe(vehicle_data.drop('車両', axis=1), use_container_width=True, hide_index=True)
-            generate_map_link(vehicle_data, vehicle)
+        display_vehicle_plan(df_results[df_results['車両'] == vehicle], vehicle)
     
     # CSV出力の修正
     try:
-        # データの整理と検証
-        df_export = df_results.copy()
-        
-        # 時間データの正規化
-        df_export['提案時間'] = df_export['提案時間'].astype(str)
-        df_export['希望時間'] = df_export['希望時間'].astype(str)
-        df_export['時間差'] = df_export['時間差'].astype(str)
-        
-        # NaN値の処理
-        df_export = df_export.fillna('')
-        
-        # 英語ヘッダーでの出力(Excel互換性向上)
-        df_export.columns = [
-            'Vehicle', 'Proposed_Time', 'Desired_Time', 'Time_Difference', 
-            'Status', 'Location_ID', 'Location_Code', 'Location_Name', 
-            'Address', 'Remarks'
-        ]
-        
-        # CSV生成（エンコーディング修正）
-        csv_buffer = io.StringIO()
-        df_export.to_csv(csv_buffer, index=False, encoding='utf-8')
-        csv_data = csv_buffer.getvalue()
-        
-        # BOM付きUTF-8で出力（Excel対応）
-        csv_bytes = '\ufeff' + csv_data
+        # 英語ヘッダー・BOM付きUTF-8で出力（Excel対応）
+        csv_bytes = route_planner.export_csv_bytes(results_data)
         
         st.download_button(
             "📥 結果をCSVでダウンロード", 
-            csv_bytes.encode('utf-8'),
+            csv_bytes,
             f"route_plan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv", 
             "text/csv",
             help="ExcelやGoogleスプレッドシートで開けます"
@@ -982,6 +632,21 @@ def display_results(results_data, summary_text):
             st.write("データサンプル:", df_results.head(3))
             st.write("エラー詳細:", traceback.format_exc())
 
+def display_violations(violations):
+    # AIの計画の検証で見つかった問題の一覧（行番号は結果の表の何行目か）
+    if not violations:
+        return
+    errors = sum(1 for violation in violations if violation["level"] == "error")
+    with st.expander(f"🔎 計画の検証結果（問題 {errors}件 / 注意 {len(violations) - errors}件）", expanded=errors > 0):
+        st.dataframe(pd.DataFrame([
+            {
+                "重要度": "問題" if violation["level"] == "error" else "注意",
+                "行": None if violation["row"] is None else violation["row"] + 1,
+                "内容": violation["message"],
+            }
+            for violation in violations[:PLAN_VALIDATION_CONFIG["max_reported_violations"]]
+        ]), hide_index=True, use_container_width=True)
+
 def main():
     # メインアプリケーション（修正版：拠点→所属変更）
     # st.title("けっくるてぽこ - 物流サポートエージェント")
@@ -1003,18 +668,24 @@ def main():
     st.markdown("---")
     
     # 始点・終着チェック
+    table = None
     if input_df is not None and not input_df.empty:
-        start_count = sum(1 for _, row in input_df.iterrows() if str(row.get("始点", "")).strip() == "1")
-        end_count = sum(1 for _, row in input_df.iterrows() if str(row.get("終着", "")).strip() == "2")
-        if start_count == 0:
+        table = get_location_table(input_df)
+        if table.invalid_flag_rows:
+            rows = "、".join(str(i + 1) for i in table.invalid_flag_rows[:10])
+            st.warning(f"⚠️ 始点・終着フラグに不正な値がある行は無視されます（{rows}行目）")
+        if table.start_count == 0:
             st.error("❌ 始点フラグ(1)を設定してください")
             return
-        if end_count == 0:
+        if table.end_count == 0:
             st.error("❌ 終着フラグ(2)を設定してください")
             return
     
+    settings = None
+    vehicles_for_ai = None
     if (selected_vehicles is not None and not selected_vehicles.empty) and (input_df is not None and not input_df.empty):
         settings = optimization_settings()
+        vehicles_for_ai = selected_vehicles.drop(columns=['選択', 'メモ欄'], errors='ignore')
         st.markdown("---")
         
         # プロンプト事前確認機能（車両選択ロジック改善版）
@@ -1022,15 +693,15 @@ def main():
             st.info("💡 ここに表示されるのは、AIへの指示の骨子です。\n実際の送信時には、これに加えて各地点間の距離と時間の詳細データが追加されます。")
             
             # 必要車両数の自動判断を表示
-            min_required, conflicts = analyze_vehicle_requirements(input_df.to_dict('records'))
+            min_required, conflicts = analyze_vehicle_requirements(table)
             if min_required > 1:
                 st.warning(f"⚠️ 時間制約により最低{min_required}台の車両が必要です")
                 if conflicts:
                     st.error("検出された時間重複：")
-                    for conflict in conflicts:
-                        st.write(f"- {conflict[0]['location']}と{conflict[1]['location']}が同時間帯に重複")
+                    for window in conflicts:
+                        st.write(f"- {window['start'].strftime('%H:%M')}-{window['end'].strftime('%H:%M')}: {'、'.join(window['locations'])}が同時間帯に重複")
             
-            preview_prompt = generate_prompt_preview(selected_vehicles.drop(columns=['選択']), st.session_state.vehicles, input_df.to_dict('records'), settings)
+            preview_prompt = generate_prompt_preview(selected_vehicles.drop(columns=['選択']), st.session_state.vehicles, table, settings)
             st.text_area(
                 label="生成されるプロンプトのプレビュー",
                 value=preview_prompt,
@@ -1040,59 +711,47 @@ def main():
 
         col_btn1, col_btn2, col_btn3 = st.columns([1,2,1])
         with col_btn2:
-            if st.button("🚀 ルート提案を実行", type="primary", use_container_width=True):
+            job = current_job()
+            job_active = job is not None and not job.finished
+            if st.button("🚀 ルート提案を実行", type="primary", use_container_width=True, disabled=job_active):
                 # アクティビティ時刻を更新
                 st.session_state.last_activity = datetime.now()
-                
-                vehicles_for_ai = selected_vehicles.drop(columns=['選択', 'メモ欄'], errors='ignore')
-                try:
-                    # プログレスバーで進行状況を表示
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    status_text.text("🔄 処理を開始しています...")
-                    progress_bar.progress(20)
-                    
-                    start_time = pd.Timestamp.now()
-                    results, summary, prompt = calculate_route(vehicles_for_ai, input_df.to_dict('records'), settings)
-                    end_time = pd.Timestamp.now()
-                    
-                    progress_bar.progress(100)
-                    status_text.text("✅ 処理完了！")
-                    
-                    st.session_state.optimization_results = {
-                        "results": results, "summary": summary, "prompt": prompt,
-                        "processing_time": (end_time - start_time).total_seconds()
-                    }
-                    st.session_state.last_activity = datetime.now()
-                    
-                    # プログレスバーをクリア
-                    progress_bar.empty()
-                    status_text.empty()
-                    
-                    st.success(f"✅ 提案完了！ (処理時間: {st.session_state.optimization_results['processing_time']:.1f}秒)")
-                except Exception as e:
-                    st.error(f"❌ エラーが発生しました: {str(e)}")
-                    st.error("💡 接続エラーの場合は、ページをリロードしてください。")
-                    if DEBUG: 
-                        st.error(traceback.format_exc())
-        
-        # 1画面構成：結果を同一画面内に表示
-        if "optimization_results" in st.session_state and st.session_state.optimization_results:
-            st.markdown("---")
-            display_results(st.session_state.optimization_results["results"], st.session_state.optimization_results["summary"])
-            
-            with st.expander("🔍 実際にAIに送信したプロンプトを確認する"):
-                st.text_area("送信済みプロンプト", value=st.session_state.optimization_results["prompt"], height=300, key="debug_prompt_display")
-            
-            # 新しい計画ボタン
-            col_reset1, col_reset2, col_reset3 = st.columns([1,2,1])
-            with col_reset2:
-                if st.button("🔄 条件を変更して再計算", use_container_width=True):
-                    st.session_state.optimization_results = None
-                    st.rerun()
+                start_route_job(vehicles_for_ai, table, settings)
     else:
         st.info("👆 ステップ1とステップ2で、車両と配送先データを入力してください。")
+    
+    # ルート計算はバックグラウンドで実行し、進捗を定期的に再表示する
+    # （入力データがない再接続後のセッションでも、ジョブIDから結果を表示できる）
+    job_running = route_job_section(table)
+    
+    # 1画面構成：結果を同一画面内に表示
+    if not job_running and st.session_state.optimization_results:
+        st.markdown("---")
+        display_results(st.session_state.optimization_results["results"], st.session_state.optimization_results["summary"])
+        display_violations(st.session_state.optimization_results.get("violations", []))
+        
+        with st.expander("🔍 実際にAIに送信したプロンプトを確認する"):
+            st.text_area("送信済みプロンプト", value=st.session_state.optimization_results["prompt"], height=300, key="debug_prompt_display")
+        
+        # 新しい計画ボタン
+        col_reset1, col_reset2, col_reset3 = st.columns([1,2,1])
+        with col_reset2:
+            if st.button(
+                "🔄 条件を変更して再計算", use_container_width=True,
+                help="配送先の一部だけを変更した場合は、前回の計画に変更分を反映します（追加された地点の距離のみ取得し、AIは呼び出しません）。"
+                     "計画条件・車両・出発日時を変更した場合や変更が多い場合は、全体を計画し直します"
+            ):
+                if settings is not None:
+                    st.session_state.last_activity = datetime.now()
+                    start_route_job(vehicles_for_ai, table, settings, previous=st.session_state.optimization_results)
+                else:
+                    st.session_state.optimization_results = None
+                    clear_current_job()
+                st.rerun()
+    
+    if job_running:
+        time.sleep(JOB_CONFIG["poll_interval_seconds"])
+        st.rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,190 @@
+# --- async_api.py (非同期API実行レイヤー) ---
+
+import asyncio
+import concurrent.futures
+import functools
+import random
+import threading
+
+import googlemaps.exceptions
+
+from constants import API_CONFIG
+
+# バックグラウンドのイベントループ（プロセスで1つ）
+_loop = None
+_loop_lock = threading.Lock()
+_executor = None
+_semaphores = {}
+
+def _get_loop():
+    """専用スレッドで動くイベントループを取得（初回呼び出し時に起動）"""
+    global _loop, _executor
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            worker_count = API_CONFIG["google_maps"]["max_workers"] + API_CONFIG["gemini"]["max_concurrency"]
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="api-worker")
+            _loop.set_default_executor(_executor)
+            thread = threading.Thread(target=_loop.run_forever, name="api-event-loop", daemon=True)
+            thread.start()
+        return _loop
+
+def _provider_semaphore(provider):
+    """APIプロバイダごとの同時実行数を制限するセマフォ（イベントループ内で作成）"""
+    if provider not in _semaphores:
+        limit = API_CONFIG[provider]["max_workers"] if provider == "google_maps" else API_CONFIG[provider]["max_concurrency"]
+        _semaphores[provider] = asyncio.Semaphore(limit)
+    return _semaphores[provider]
+
+def run(coro, on_wait=None, poll_interval=0.2):
+    """コルーチンをバックグラウンドのループで実行し、完了まで待つ（同期呼び出し用）
+
+    on_waitは待機中に定期的に呼ばれる。on_waitが例外を送出した場合（Streamlitの再実行など）は
+    実行中の処理をキャンセルしてから例外を伝える。
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, _get_loop())
+    try:
+        while True:
+            try:
+                return future.result(timeout=poll_interval)
+            except concurrent.futures.TimeoutError:
+                if on_wait:
+                    on_wait()
+    finally:
+        if not future.done():
+            future.cancel()
+
+def create_in_loop(factory):
+    """factory()をバックグラウンドのループ内で呼び出して結果を返す（ループに結び付く非同期クライアントの作成用）"""
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is not None and running is _loop:
+        # ループ内から呼ばれた場合は、完了を待つとループが止まるためその場で作成する
+        return factory()
+
+    async def create():
+        return factory()
+    return run(create())
+
+async def _call_blocking(provider, func, *args, **kwargs):
+    """同期APIクライアントの呼び出しを、プロバイダの同時実行数の範囲でスレッド実行"""
+    async with _provider_semaphore(provider):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+def _is_retryable_error(error):
+    """再試行で回復が見込めるエラーかを判定"""
+    if isinstance(error, (googlemaps.exceptions.Timeout,
+                          googlemaps.exceptions.TransportError,
+                          googlemaps.exceptions.HTTPError,
+                          googlemaps.exceptions._OverQueryLimit)):
+        return True
+    if isinstance(error, googlemaps.exceptions.ApiError):
+        return error.status in ('OVER_QUERY_LIMIT', 'UNKNOWN_ERROR')
+    return False
+
+async def _backoff(attempt):
+    backoff = API_CONFIG["google_maps"]["retry_backoff_seconds"]
+    await asyncio.sleep(backoff * (2 ** attempt) + random.uniform(0, backoff))
+
+async def fetch_matrix_tile(client, api_args, origins, destinations):
+    """1タイル分のDistance Matrixを取得（レート制限時は指数バックオフで再試行）"""
+    max_retries = API_CONFIG["google_maps"]["max_retries"]
+    for attempt in range(max_retries + 1):
+        try:
+            response = await _call_blocking(
+                "google_maps", client.distance_matrix,
+                origins=origins, destinations=destinations, **api_args
+            )
+        except Exception as e:
+            if not _is_retryable_error(e) or attempt >= max_retries:
+                raise
+            await _backoff(attempt)
+            continue
+        if response.get('status') in ('OVER_QUERY_LIMIT', 'UNKNOWN_ERROR') and attempt < max_retries:
+            await _backoff(attempt)
+            continue
+        return response
+
+async def fetch_matrix_tiles(client, api_args, tile_requests, on_tile_done=None):
+    """複数タイル [(出発地リスト, 目的地リスト)] を並列取得し、同じ順序で返す
+
+    on_tile_doneはタイルが1件取得できるたびに (取得済み件数, 全件数) で呼ばれる。
+    """
+    done = 0
+
+    async def fetch(origins, destinations):
+        nonlocal done
+        response = await fetch_matrix_tile(client, api_args, origins, destinations)
+        done += 1
+        if on_tile_done:
+            on_tile_done(done, len(tile_requests))
+        return response
+
+    return await asyncio.gather(*[
+        fetch(origins, destinations)
+        for origins, destinations in tile_requests
+    ])
+
+async def geocode(client, address, **kwargs):
+    """1住所のジオコーディング（一時的なエラーは指数バックオフで再試行）"""
+    max_retries = API_CONFIG["google_maps"]["max_retries"]
+    for attempt in range(max_retries + 1):
+        try:
+            return await _call_blocking("google_maps", client.geocode, address, **kwargs)
+        except Exception as e:
+            if not _is_retryable_error(e) or attempt >= max_retries:
+                raise
+            await _backoff(attempt)
+
+async def geocode_many(client, addresses, **kwargs):
+    """複数住所のジオコーディングを並列実行"""
+    return await asyncio.gather(*[
+        geocode(client, address, **kwargs)
+        for address in addresses
+    ])
+
+async def generate_content(model, prompt, generation_config):
+    """Geminiの生成呼び出し（非同期APIがあればそれを使用）"""
+    async with _provider_semaphore("gemini"):
+        if hasattr(model, "generate_content_async"):
+            return await model.generate_content_async(prompt, generation_config=generation_config)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(model.generate_content, prompt, generation_config=generation_config)
+        )
+
+async def race(coros, timeout=None, is_good=None, on_done=None):
+    """名前付きのコルーチン {名前: コルーチン} を並列実行し、完了した順に結果を集める
+
+    is_good(名前, 結果)がTrueを返した時点、またはtimeout秒が経過した時点で、実行中のものをキャンセルする。
+    on_doneは1件完了するたびに (名前, 結果) で呼ばれる。例外は結果として返す。
+    戻り値は (完了した順の [(名前, 結果)], キャンセルした名前のリスト)。
+    スレッドで実行中の同期呼び出しは中断できないため、キャンセル後も完了までスレッドを占有する（結果は捨てる）。
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout is not None else None
+    tasks = {asyncio.ensure_future(coro): name for name, coro in coros.items()}
+    pending = set(tasks)
+    finished = []
+    try:
+        while pending:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            good = False
+            for task in done:
+                result = task.exception() or task.result()
+                finished.append((tasks[task], result))
+                if on_done:
+                    on_done(tasks[task], result)
+                good = good or (is_good is not None and not isinstance(result, Exception) and is_good(tasks[task], result))
+            if good:
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+    return finished, [tasks[task] for task in pending]
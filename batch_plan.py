@@ -0,0 +1,194 @@
+# --- batch_plan.py (配車計画のバッチ実行) ---
+"""Streamlitを使わずに、複数の配車計画ジョブをまとめて実行する
+
+    python batch_plan.py jobs.jsonl --output-dir batch_output --workers 4
+
+ジョブ定義はJSONL（1行1ジョブ）またはCSV（1行1ジョブ）で指定する。
+- job_id: 出力ファイル名に使うID（省略時は行番号）
+- locations / locations_csv: 配送先データ（辞書のリスト、またはCSVファイルのパス）
+- vehicles / vehicles_csv: 車両マスタ（辞書のリスト、またはCSVファイルのパス）。
+  「選択」列があればTrueの車両を選択車両とし、なければ全車両を選択車両とする
+- settings: 計画条件（JSONLのみ。CSVではmode・route_engineなどの列で指定）。
+  未指定の項目はDEFAULT_SETTINGSを使う
+
+APIキーは環境変数 GEMINI_API_KEY / MAPS_API_KEY から読み込む。
+結果は画面のCSV出力と同じ列でジョブごとに <output-dir>/<job_id>.csv に書き出す。
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+
+import api_handler
+import route_planner
+from constants import BATCH_CONFIG
+from location_table import LOCATION_COLUMNS, normalize_locations, read_locations_csv
+
+# CSVのジョブ定義で、設定以外に使う列
+_JOB_COLUMNS = ("job_id", "locations_csv", "vehicles_csv")
+
+#======================================================================
+# ジョブ定義の読み込み
+#======================================================================
+
+def _coerce_setting(value, default):
+    """CSVの文字列をデフォルト値と同じ型に変換"""
+    if isinstance(default, bool):
+        return str(value).strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(float(value))
+    return value
+
+def load_jobs(path):
+    """ジョブ定義ファイル（.jsonl / .csv）を読み込む。ファイルのパスは定義ファイルからの相対パスとして解決する"""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    defaults = route_planner.default_settings()
+    jobs = []
+
+    if path.lower().endswith(".csv"):
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                settings = {
+                    key: _coerce_setting(value, defaults.get(key, ""))
+                    for key, value in row.items() if key not in _JOB_COLUMNS and value not in (None, "")
+                }
+                jobs.append({**{key: row[key] for key in _JOB_COLUMNS if row.get(key)}, "settings": settings})
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    jobs.append(json.loads(line))
+
+    for number, job in enumerate(jobs, start=1):
+        job.setdefault("job_id", f"job{number:04d}")
+        for key in ("locations_csv", "vehicles_csv"):
+            if job.get(key):
+                job[key] = os.path.join(base_dir, job[key])
+    return jobs
+
+def _load_locations(job):
+    if job.get("locations_csv"):
+        with open(job["locations_csv"], "rb") as f:
+            return read_locations_csv(f, LOCATION_COLUMNS)
+    return pd.DataFrame(job.get("locations", []))
+
+def _load_vehicles(job):
+    """(選択車両のDataFrame, 車両マスタのリスト) を返す"""
+    if job.get("vehicles_csv"):
+        master = pd.read_csv(job["vehicles_csv"], encoding="utf-8-sig")
+    else:
+        master = pd.DataFrame(job.get("vehicles", []))
+    if master.empty:
+        raise ValueError("車両が指定されていません")
+
+    selected = master
+    if "選択" in master.columns:
+        selected = master[master["選択"].astype(str).str.strip().str.lower().isin(("1", "true", "yes"))]
+    selected = selected.drop(columns=["選択", "メモ欄"], errors="ignore").reset_index(drop=True)
+    return selected, master.to_dict("records")
+
+#======================================================================
+# ジョブの実行（ワーカープロセス）
+#======================================================================
+
+# ワーカープロセスのAPIクライアント（_init_workerで設定）
+_worker_clients = api_handler.ApiClients()
+
+def _init_worker(gemini_key, maps_key):
+    """ワーカープロセスごとにAPIキーを検証してクライアントを用意（失敗理由はapi_handlerのロガーに出力される）"""
+    global _worker_clients
+    logging.basicConfig(level=logging.WARNING, format="%(processName)s %(levelname)s %(message)s")
+    _worker_clients = api_handler.ApiClients(
+        maps_key if maps_key and api_handler.initialize_gmaps(maps_key) else None,
+        gemini_key if gemini_key and api_handler.initialize_gemini(gemini_key) else None
+    )
+
+def run_job(job, output_dir):
+    """1ジョブを計画し、結果のCSVを書き出す。例外は結果の'status'/'message'として返す"""
+    started = time.time()
+    job_id = str(job["job_id"])
+    try:
+        table = normalize_locations(_load_locations(job))
+        vehicles, all_vehicles = _load_vehicles(job)
+        settings = {**route_planner.default_settings(), **job.get("settings", {}), "stream_response": False}
+
+        plan = route_planner.plan_route(_worker_clients, vehicles, all_vehicles, table, settings)
+
+        output_path = os.path.join(output_dir, re.sub(r"[^\w.-]", "_", job_id) + ".csv")
+        with open(output_path, "wb") as f:
+            f.write(route_planner.export_csv_bytes(plan["results"]))
+        return {
+            "job_id": job_id, "status": "OK", "output": output_path, "rows": len(plan["results"]),
+            "summary": plan["summary"], "diagnostics": plan["diagnostics"], "usage": plan["usage"],
+            "seconds": round(time.time() - started, 2)
+        }
+    except Exception as e:
+        return {"job_id": job_id, "status": "ERROR", "message": str(e), "seconds": round(time.time() - started, 2)}
+
+#======================================================================
+# エントリポイント
+#======================================================================
+
+def run_batch(jobs, output_dir, max_workers, gemini_key, maps_key, on_result=None):
+    """ジョブをプロセスプールで並列実行し、(結果のリスト, 経過秒数) を返す"""
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.time()
+    outcomes = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max(1, min(max_workers, len(jobs))),
+        initializer=_init_worker, initargs=(gemini_key, maps_key)
+    ) as pool:
+        futures = [pool.submit(run_job, job, output_dir) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            outcome = future.result()
+            outcomes.append(outcome)
+            if on_result:
+                on_result(outcome)
+    return outcomes, time.time() - started
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="配車計画ジョブをStreamlitを使わずにまとめて実行する")
+    parser.add_argument("jobs", help="ジョブ定義ファイル（.jsonl または .csv）")
+    parser.add_argument("--output-dir", default=BATCH_CONFIG["output_dir"], help="結果CSVの出力先")
+    parser.add_argument("--workers", type=int, default=BATCH_CONFIG["max_workers"], help="同時に実行するジョブ数の上限")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.jobs)
+    if not jobs:
+        print("ジョブがありません。")
+        return 1
+
+    def report(outcome):
+        if outcome["status"] == "OK":
+            print(f"✅ {outcome['job_id']}: {outcome['rows']}行 → {outcome['output']} ({outcome['seconds']}秒)")
+            icons = {"error": "❌", "warning": "⚠️", "info": "ℹ️"}
+            for diagnostic in outcome["diagnostics"]:
+                print(f"   {icons.get(diagnostic['level'], '⚠️')} {diagnostic['message']}")
+        else:
+            print(f"❌ {outcome['job_id']}: {outcome['message']} ({outcome['seconds']}秒)")
+
+    outcomes, elapsed = run_batch(
+        jobs, args.output_dir, args.workers,
+        os.environ.get("GEMINI_API_KEY", ""), os.environ.get("MAPS_API_KEY", ""),
+        on_result=report
+    )
+
+    with open(os.path.join(args.output_dir, "batch_summary.jsonl"), "w", encoding="utf-8") as f:
+        for outcome in outcomes:
+            f.write(json.dumps(outcome, ensure_ascii=False) + "\n")
+
+    failed = sum(1 for outcome in outcomes if outcome["status"] != "OK")
+    jobs_per_minute = len(outcomes) / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"完了: {len(outcomes) - failed}件 / 失敗: {failed}件 / {elapsed:.1f}秒 ({jobs_per_minute:.1f} jobs/minute)")
+    return 0 if failed == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+# --- benchmarks/bench_prompt_size.py (移動データの形式ごとのプロンプト長) ---
+"""合成した配送先データで、地点間の移動データの形式ごとの文字数と、予算に応じて選ばれる形式を表示する
+
+    python benchmarks/bench_prompt_size.py [地点数...]
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import PROMPT_CONFIG, VALIDATION_CONFIG
+from location_table import normalize_locations
+from prompt_builder import generate_prompt, plan_travel_section
+from route_planner import default_settings, time_window_compatibility
+from travel_estimator import TravelEstimator
+
+def synthetic_inputs(count, seed=0):
+    """東京周辺にcount地点を配置した配送先データ・推定マトリックス・訪問可否のマスクを作成"""
+    rng = np.random.default_rng(seed)
+    table = normalize_locations([
+        {
+            "始点": "1" if i == 0 else "",
+            "終着": "2" if i == count - 1 else "",
+            "地点": f"東京配送センター{i}",
+            "地点コード": f"C{i:04d}",
+            "住所": f"東京都千代田区丸の内{i}丁目",
+            "希望到着": "2026/10/18 15:00" if i == 5 else "",
+            "希望出発": "2026/10/18 08:00" if i in (0, 6) else "",
+        }
+        for i in range(count)
+    ])
+    coords = np.column_stack([35.6 + rng.uniform(-0.3, 0.3, count), 139.7 + rng.uniform(-0.4, 0.4, count)])
+    matrix = TravelEstimator.default().estimate_matrix(coords)
+    return table, matrix, time_window_compatibility(table)
+
+def encodings():
+    """比較する形式 (表示名, travel_encoding, nearest_counts)"""
+    options = [("sentences", "sentences", None), ("table", "table", None)]
+    return options + [(f"nearest{count}", "nearest", [count]) for count in PROMPT_CONFIG["nearest_counts"]]
+
+def main(counts):
+    vehicles = pd.DataFrame([
+        {"車両ID": f"T{i:02d}", "車両名": f"トラック{i}", "最大積載量": 2000, "車両ステータス": "稼働中"} for i in range(3)
+    ])
+    settings = default_settings()
+    saved = dict(PROMPT_CONFIG)
+    labels = [label for label, _, _ in encodings()]
+    print(f"予算: プロンプト全体で{VALIDATION_CONFIG['max_prompt_length']}文字")
+    print(f"{'地点数':>6} " + " ".join(f"{label:>10}" for label in labels) + f" {'全体':>8}  選択")
+    try:
+        for count in counts:
+            table, matrix, candidates = synthetic_inputs(count)
+            names = table.names.tolist()
+            sections = {}
+            for label, encoding, nearest_counts in encodings():
+                PROMPT_CONFIG["travel_encoding"] = encoding
+                if nearest_counts:
+                    PROMPT_CONFIG["nearest_counts"] = nearest_counts
+                sections[label], _, _ = plan_travel_section(names, matrix, table, candidates, float("inf"))
+                PROMPT_CONFIG.update(saved)
+
+            prompt = generate_prompt(vehicles, vehicles.to_dict('records'), table, matrix, settings, candidates=candidates)
+            # sentencesはautoの候補ではないため、詳しい順に最初に含まれる形式が選ばれた形式
+            chosen = next((label for label in labels[1:] if sections[label] in prompt), "?")
+            if len(prompt) > VALIDATION_CONFIG["max_prompt_length"]:
+                chosen += "（どの形式も収まらず最短の形式）"
+            print(f"{count:>6} " + " ".join(f"{len(sections[label]):>10}" for label in labels) + f" {len(prompt):>8}  {chosen}")
+    finally:
+        PROMPT_CONFIG.update(saved)
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [25, 100, 300])
@@ -0,0 +1,49 @@
+# --- benchmarks/bench_vehicle_requirements.py (必要車両数の算出時間) ---
+"""合成した配送先データで、必要車両数の区間スイープにかかる時間を計測する
+
+    python benchmarks/bench_vehicle_requirements.py [地点数...]
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from location_table import normalize_locations
+from prompt_builder import _analyze_vehicle_requirements
+
+BASE = datetime(2026, 10, 18, 6, 0)
+REPEAT = 5
+
+def synthetic_table(count, seed=0):
+    """6時から18時の間に、30分〜3時間の時間帯を持つ地点をcount件作成"""
+    rng = np.random.default_rng(seed)
+    arrivals = rng.integers(0, 12 * 60, count)
+    stays = rng.integers(30, 180, count)
+    return normalize_locations([
+        {
+            "地点": f"地点{i}",
+            "住所": f"addr-{i}",
+            "希望到着": (BASE + timedelta(minutes=int(arrive))).strftime("%Y/%m/%d %H:%M"),
+            "希望出発": (BASE + timedelta(minutes=int(arrive + stay))).strftime("%Y/%m/%d %H:%M"),
+        }
+        for i, (arrive, stay) in enumerate(zip(arrivals, stays))
+    ])
+
+def main(counts):
+    print(f"{'地点数':>8} {'必要車両数':>10} {'最速(ms)':>10} {'平均(ms)':>10}")
+    for count in counts:
+        table = synthetic_table(count)
+        elapsed = []
+        for _ in range(REPEAT):
+            started = time.perf_counter()
+            min_required, _ = _analyze_vehicle_requirements(table, 5)
+            elapsed.append((time.perf_counter() - started) * 1000)
+        print(f"{count:>8} {min_required:>10} {min(elapsed):>10.1f} {sum(elapsed) / len(elapsed):>10.1f}")
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000])
@@ -13,20 +13,153 @@ APP_CONFIG = {
 
 # API設定
 API_CONFIG = {
+    # APIキー適用時の接続テストをバックグラウンドで行い、成功したキーは一定時間再検証しない
+    "lazy_key_validation": True,
+    "key_validation_ttl_hours": 24,
     "gemini": {
         "model_name": "gemini-1.5-flash",
         "temperature": 0.2,
         "max_output_tokens": 4096,
         "top_p": 0.8,
-        "top_k": 40
+        "top_k": 40,
+        # Gemini呼び出しの同時実行数
+        "max_concurrency": 4
     },
     "google_maps": {
         "language": "ja",
         "units": "metric",
-        "mode": "driving"
+        "mode": "driving",
+        # Distance Matrix APIの1リクエストあたりの上限
+        "max_elements_per_request": 100,
+        "max_dimension": 25,
+        # Distance Matrixの出発地・目的地に、ジオコーディングした緯度経度を使う
+        "use_coordinates": True,
+        "region": "jp",
+        # タイル・ジオコーディングの同時実行数
+        "max_workers": 8,
+        "max_retries": 3,
+        "retry_backoff_seconds": 1.0
     }
 }
 
+# キャッシュ設定
+CACHE_CONFIG = {
+    "path": ".cache/logistics_cache.sqlite3",
+    "ttl_days": 30,
+    "max_entries": 200000,
+    # 出発時刻のバケット幅（時間）
+    "bucket_hours": 2,
+    # 住所→緯度経度のキャッシュ（住所の位置はほとんど変わらないため長めに保持）
+    "geocode_ttl_days": 365,
+    "geocode_max_entries": 50000,
+    # AI応答のキャッシュ（同じプロンプト・生成パラメータの再計算で応答を再利用）
+    "response_ttl_days": 7,
+    "response_max_entries": 500
+}
+
+# 移動時間の推定設定（緯度経度の大圏距離 × 迂回係数 ÷ 平均速度）
+ESTIMATOR_CONFIG = {
+    # 距離帯の境界（大圏距離, km）。係数・速度は帯ごとに持つ
+    "band_edges_km": [2, 10, 50],
+    "default_detour_factors": [1.4, 1.3, 1.25, 1.2],
+    "default_speeds_kmh": [18, 28, 45, 70],
+    # キャッシュ済みの実測値で補正する（帯ごとの実測がこれ未満なら既定値）
+    "min_samples": 20,
+    "max_samples": 20000,
+    "calibration_ttl_minutes": 30,
+    # Google Maps APIで取得できない場合（キー未設定・上限超過など）は推定値で計画を続ける
+    "fallback_on_error": True,
+    # 推定値で計画した後、使われた区間だけ実測値に置き換えて再計画する回数の上限
+    "refine_rounds": 2,
+    # 近傍のみ取得する場合に、各地点から実測値を取得する近い地点の数
+    "neighbor_count": 8
+}
+
+# 共有リソース設定（APIクライアント・キャッシュをセッション間で共有）
+REGISTRY_CONFIG = {
+    "max_entries": 32,
+    "idle_ttl_hours": 12
+}
+
+# ローカルソルバー設定
+SOLVER_CONFIG = {
+    "time_limit_seconds": 1.0,
+    # 局所探索で考慮する近傍地点数
+    "neighbor_count": 12,
+    # 構築時に詳細評価する挿入位置の数（車両ごと）
+    "insertion_candidates": 4,
+    # 希望時刻が片方しかない地点の作業時間
+    "default_service_minutes": 15,
+    # 車両を1台追加する際のコスト（分換算）
+    "vehicle_fixed_cost_minutes": 30,
+    # 拘束時間超過・積載超過のペナルティ係数
+    "overtime_weight": 10,
+    "capacity_weight": 1000000,
+    "mode_weights": {
+        "mode1": {"use_distance": False, "lateness": 2},
+        "mode2": {"use_distance": True, "lateness": 1},
+        "mode3": {"use_distance": False, "lateness": 20},
+        "mode4": {"use_distance": False, "lateness": 2}
+    }
+}
+
+# 差分再計算の設定（結果の表示後に一部の地点だけを変更した場合、前回の計画を修正する）
+REPLAN_CONFIG = {
+    # 追加・削除・条件変更された地点がこの割合を超える場合は、全体を計画し直す
+    "max_changed_ratio": 0.3,
+    # 変更箇所の周辺を改善する局所探索の制限時間（秒）
+    "repair_time_limit_seconds": 0.5,
+}
+
+# 運行計画の検証設定（AIの計画を移動時間マトリックス・希望時刻・積載・労働条件と照合）
+PLAN_VALIDATION_CONFIG = {
+    # 計画上の移動時間が所要時間をこの割合より下回れば違反とする（渋滞予測・推定値の誤差を許容）
+    "travel_time_tolerance": 0.15,
+    # 分単位の丸めなどを許容する余裕
+    "slack_minutes": 5,
+    # 希望時刻からの遅れをこの時間まで許容する
+    "lateness_tolerance_minutes": 15,
+    # フェリー乗船がこの時間以上なら下船時から拘束時間を数え直す（フェリー特例）
+    "ferry_reset_hours": 8,
+    # 違反があった場合にAIへ修正を依頼する回数の上限
+    "revise_rounds": 1,
+    # 修正依頼・画面表示に含める違反の上限件数
+    "max_reported_violations": 30
+}
+
+# 複数の計画案を並列に作成して最良案を選ぶ設定（計画エンジン"multi"）
+CANDIDATE_CONFIG = {
+    # AIへの依頼の種類（modeを省略した場合は画面で選んだ最適化目標。カスタムプロンプトは常にそのまま）
+    "ai_variants": [
+        {"temperature": 0.2},
+        {"temperature": 0.7},
+        {"temperature": 0.4, "mode": "mode3"}
+    ],
+    # ローカルソルバーの種類（seedがNoneなら決定的な構築法）
+    "solver_variants": [
+        {"seed": None},
+        {"seed": 1},
+        {"seed": 2, "mode": "mode2"}
+    ],
+    # 全体の制限時間（経過した時点で完了済みの案から選ぶ）
+    "time_budget_seconds": 90,
+    # ローカルソルバーの最良案に対してこの割合以内の、違反のないAIの案が届いたら残りを打ち切る
+    "good_enough_margin": 0.05,
+    # 検証で見つかった違反1件あたりのペナルティ（分換算）
+    "error_penalty_minutes": 600
+}
+
+# プロンプト生成設定
+PROMPT_CONFIG = {
+    "section_cache_size": 64,
+    # 地点間の移動データの送り方
+    # "auto": 文字数の上限(VALIDATION_CONFIG["max_prompt_length"])に収まる最も詳しい形式を選ぶ
+    # "table": 全区間の表 / "nearest": 近い地点への区間のみ / "sentences": 区間ごとの文章（従来形式）
+    "travel_encoding": "auto",
+    # 表が上限に収まらない場合に試す、各地点から送る近い地点の数（多い順）
+    "nearest_counts": [12, 8, 5, 3]
+}
+
 # UI設定
 UI_CONFIG = {
     "page_icon": "🤖",
@@ -38,7 +171,7 @@ UI_CONFIG = {
 # データ検証設定
 VALIDATION_CONFIG = {
     "min_locations": 2,
-    "max_locations": 25,
+    "max_locations": 300,
     "max_prompt_length": 30000,
     "required_columns": [
         "地点", "地点コード", "住所", 
@@ -46,6 +179,27 @@ VALIDATION_CONFIG = {
     ]
 }
 
+# CSVアップロード設定
+UPLOAD_CONFIG = {
+    "chunk_rows": 50000,
+    "sniff_bytes": 65536,
+    "encodings": ["utf-8-sig", "cp932"]
+}
+
+# バッチ実行設定
+BATCH_CONFIG = {
+    "max_workers": 4,
+    "output_dir": "batch_output"
+}
+
+# 画面からのルート計算のバックグラウンド実行設定
+JOB_CONFIG = {
+    "max_workers": 2,              # 同時に実行する計画の上限（超えた分は待機）
+    "max_jobs": 100,               # 保持するジョブの上限（完了済みの古いものから破棄）
+    "result_ttl_hours": 6,         # 完了したジョブの結果を保持する時間
+    "poll_interval_seconds": 1.0   # 実行中の進捗表示の更新間隔
+}
+
 # エラーメッセージ
 ERROR_MESSAGES = {
     "api_key_missing": "APIキーが設定されていません",
@@ -69,8 +223,13 @@ SUCCESS_MESSAGES = {
 # デフォルト設定値
 DEFAULT_SETTINGS = {
     "optimization_mode": "mode1",
+    "route_engine": "ai",
+    "matrix_provider": "google_maps",
     "allow_multiple_trucks": False,
     "use_tolls": True,
+    "stream_response": True,
+    "use_response_cache": True,
+    "auto_revise": True,
     "continuous_limit": True,
     "continuous_hours": 4,
     "rest_minutes": 30,
@@ -83,7 +242,23 @@ OPTIMIZATION_MODES = {
     "mode1": "おまかせ最適化(推奨)",
     "mode2": "最短距離を優先", 
     "mode3": "時間指定を厳守",
-    "mode4": "カスタムプロンプト"
+    "mode4": "カスタムプロンプト",
+    "mode5": "ハイブリッド(ローカル計算＋AI要約)"
+}
+
+# 計画エンジン定義
+ROUTE_ENGINES = {
+    "ai": "AI(Gemini)で計画",
+    "local": "ローカルソルバーで計画",
+    "multi": "複数案を並列に作成して最良案を選択"
+}
+
+# 距離・移動時間の取得方法
+MATRIX_PROVIDERS = {
+    "google_maps": "Google Mapsで取得",
+    "estimate": "緯度経度から推定（API不要）",
+    "estimate_refine": "推定で計画し、使う区間のみGoogle Mapsで補正",
+    "sparse": "近い地点間の区間のみGoogle Mapsで取得（他は推定）"
 }
 
 # ステータス定義
@@ -0,0 +1,139 @@
+# --- distance_cache.py (地点間移動時間の永続キャッシュ) ---
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from constants import CACHE_CONFIG
+
+# 日本語の文字の前後の空白（「千代田区　丸の内」など）は住所の区切りとして意味を持たない
+_SPACE_AROUND_WIDE = re.compile(r' ?([^\x00-\x7f]) ?')
+
+def normalize_address(address):
+    """キャッシュキー・重複判定用に住所を正規化（全角英数字・記号を半角に揃え、空白をまとめる）"""
+    text = " ".join(unicodedata.normalize("NFKC", str(address)).split())
+    return _SPACE_AROUND_WIDE.sub(r'\1', text)
+
+def departure_bucket(departure_time):
+    """出発時刻を曜日区分と時間帯のバケットに変換"""
+    bucket_hours = CACHE_CONFIG["bucket_hours"]
+    day_type = "weekend" if departure_time.weekday() >= 5 else "weekday"
+    bucket_start = (departure_time.hour // bucket_hours) * bucket_hours
+    return f"{day_type}-{bucket_start:02d}"
+
+class DistanceCache:
+    """(出発地, 目的地, 有料道路回避, 時間帯)ごとのDistance Matrix要素をSQLiteに保存する"""
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS travel_pairs (
+                origin TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                avoid_tolls INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                element TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (origin, destination, avoid_tolls, bucket)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_travel_pairs_last_used ON travel_pairs (last_used)")
+        self._conn.commit()
+
+    def lookup(self, pairs, avoid_tolls, bucket):
+        """キャッシュ済みの要素を {(出発地, 目的地): element} で返す"""
+        now = time.time()
+        found = {}
+        wanted = {}
+        for o, d in pairs:
+            wanted.setdefault(normalize_address(o), set()).add(normalize_address(d))
+
+        with self._lock:
+            for origin, destinations in wanted.items():
+                rows = self._conn.execute(
+                    "SELECT destination, element, created_at FROM travel_pairs "
+                    "WHERE origin = ? AND avoid_tolls = ? AND bucket = ?",
+                    (origin, int(avoid_tolls), bucket)
+                ).fetchall()
+                for destination, element, created_at in rows:
+                    if destination in destinations and now - created_at <= self.ttl_seconds:
+                        found[(origin, destination)] = json.loads(element)
+            if found:
+                self._conn.executemany(
+                    "UPDATE travel_pairs SET last_used = ? "
+                    "WHERE origin = ? AND destination = ? AND avoid_tolls = ? AND bucket = ?",
+                    [(now, o, d, int(avoid_tolls), bucket) for o, d in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += sum(len(d) for d in wanted.values()) - len(found)
+
+        return found
+
+    def store(self, entries, avoid_tolls, bucket):
+        """取得した要素 [(出発地, 目的地, element)] を保存（OKの要素のみ）"""
+        now = time.time()
+        rows = [
+            (normalize_address(o), normalize_address(d), int(avoid_tolls), bucket, json.dumps(element, ensure_ascii=False), now, now)
+            for o, d, element in entries
+            if element and element.get('status') == 'OK'
+        ]
+        if not rows:
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO travel_pairs "
+                "(origin, destination, avoid_tolls, bucket, element, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def sample_elements(self, limit):
+        """最近使われた実測要素（同一地点同士を除く）を [(出発地, 目的地, element)] で返す（推定の補正用）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT origin, destination, element FROM travel_pairs "
+                "WHERE origin != destination ORDER BY last_used DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [(origin, destination, json.loads(element)) for origin, destination, element in rows]
+
+    def _evict(self, now):
+        """期限切れ要素の削除と、件数上限を超えた分のLRU削除"""
+        self._conn.execute("DELETE FROM travel_pairs WHERE created_at < ?", (now - self.ttl_seconds,))
+        count = self._conn.execute("SELECT COUNT(*) FROM travel_pairs").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM travel_pairs WHERE rowid IN "
+                "(SELECT rowid FROM travel_pairs ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def get_stats(self):
+        """ヒット・ミス件数を取得"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM travel_pairs").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def close(self):
+        """データベース接続を閉じる"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,114 @@
+# --- geocode_cache.py (住所→緯度経度の永続キャッシュ) ---
+
+import os
+import sqlite3
+import threading
+import time
+
+from distance_cache import normalize_address
+
+class GeocodeCache:
+    """正規化した住所ごとのジオコーディング結果（緯度・経度）をSQLiteに保存する"""
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS geocodes (
+                address TEXT PRIMARY KEY,
+                lat REAL NOT NULL,
+                lng REAL NOT NULL,
+                formatted_address TEXT NOT NULL,
+                location_type TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_geocodes_last_used ON geocodes (last_used)")
+        self._conn.commit()
+
+    def lookup(self, addresses):
+        """キャッシュ済みの住所を {正規化した住所: (緯度, 経度)} で返す"""
+        now = time.time()
+        wanted = {normalize_address(address) for address in addresses}
+        found = {}
+
+        with self._lock:
+            keys = list(wanted)
+            # SQLiteのパラメータ数上限に収まるよう分割して検索
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT address, lat, lng, created_at FROM geocodes WHERE address IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for address, lat, lng, created_at in rows:
+                    if now - created_at <= self.ttl_seconds:
+                        found[address] = (lat, lng)
+            if found:
+                self._conn.executemany(
+                    "UPDATE geocodes SET last_used = ? WHERE address = ?",
+                    [(now, address) for address in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(wanted) - len(found)
+
+        return found
+
+    def store(self, entries):
+        """ジオコーディング結果 [(住所, APIの結果リスト)] のうち、結果があるものを保存"""
+        now = time.time()
+        rows = []
+        for address, results in entries:
+            if not results:
+                continue
+            location = results[0]['geometry']['location']
+            rows.append((
+                normalize_address(address), location['lat'], location['lng'],
+                results[0].get('formatted_address', ''), results[0]['geometry'].get('location_type', ''),
+                now, now
+            ))
+        if not rows:
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO geocodes "
+                "(address, lat, lng, formatted_address, location_type, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        """期限切れ住所の削除と、件数上限を超えた分のLRU削除"""
+        self._conn.execute("DELETE FROM geocodes WHERE created_at < ?", (now - self.ttl_seconds,))
+        count = self._conn.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM geocodes WHERE rowid IN "
+                "(SELECT rowid FROM geocodes ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def get_stats(self):
+        """ヒット・ミス件数を取得"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM geocodes").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def close(self):
+        """データベース接続を閉じる"""
+        with self._lock:
+            self._conn.close()
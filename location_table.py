@@ -0,0 +1,240 @@
+# --- location_table.py (配送先データの正規化) ---
+
+import codecs
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from constants import UPLOAD_CONFIG
+
+# 配送先データの列
+LOCATION_COLUMNS = ["始点", "終着", "地点", "地点コード", "住所", "希望到着", "希望出発", "積み込み重量", "積み込み容量", "荷下ろし重量", "荷下ろし容量", "備考"]
+
+NUMERIC_COLUMNS = ["積み込み重量", "積み込み容量", "荷下ろし重量", "荷下ろし容量"]
+
+# 備考欄は人間用のため、AIやソルバーには渡さない
+EXCLUDED_COLUMNS = ["備考"]
+
+def parse_datetime_column(values):
+    """日時文字列の列をまとめてdatetime64に変換（書式が混在する行のみ個別に解析）"""
+    text = values.fillna('').astype(str).str.strip()
+    parsed = pd.to_datetime(text.where(text != ''), errors='coerce')
+    retry = parsed.isna() & (text != '')
+    if retry.any():
+        parsed[retry] = [pd.to_datetime(value, errors='coerce') for value in text[retry]]
+    return parsed
+
+def _flag_mask(values, flag):
+    """始点・終着フラグの列から、指定値が設定された行のマスクを作成（1.0などの数値表記も許容）"""
+    text = values.fillna('').astype(str).str.strip()
+    numeric = pd.to_numeric(text, errors='coerce')
+    mask = (text == str(flag)) | (numeric == flag)
+    invalid = ~mask & (text != '')
+    return mask.to_numpy(), invalid.to_numpy()
+
+class LocationTable:
+    """配送先データを列単位で正規化した結果
+
+    数値列はfloat、その他の列は文字列に揃え、始点・終着フラグはブールのマスク、
+    希望到着・希望出発はdatetime64として保持する。以降の処理はrecordsで地点ごとの辞書を参照する。
+    """
+
+    def __init__(self, frame):
+        frame = frame.reset_index(drop=True)
+        columns = {}
+        for column in frame.columns:
+            if column in NUMERIC_COLUMNS:
+                columns[column] = pd.to_numeric(frame[column], errors='coerce').fillna(0.0).astype(float)
+            else:
+                values = frame[column]
+                columns[column] = values.where(values.notna(), '').astype(str)
+        normalized = pd.DataFrame(columns, index=frame.index)
+
+        empty = pd.Series('', index=frame.index)
+        self.is_start, invalid_start = _flag_mask(normalized.get("始点", empty), 1)
+        self.is_end, invalid_end = _flag_mask(normalized.get("終着", empty), 2)
+        self.invalid_flag_rows = np.flatnonzero(invalid_start | invalid_end).tolist()
+        if "始点" in normalized:
+            normalized["始点"] = np.where(self.is_start, '1', '')
+        if "終着" in normalized:
+            normalized["終着"] = np.where(self.is_end, '2', '')
+
+        self.frame = normalized
+        self.arrival = parse_datetime_column(normalized.get("希望到着", empty))
+        self.departure = parse_datetime_column(normalized.get("希望出発", empty))
+        self._records = None
+        self._fingerprint = None
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def start_count(self):
+        return int(self.is_start.sum())
+
+    @property
+    def end_count(self):
+        return int(self.is_end.sum())
+
+    @property
+    def names(self):
+        return self.frame["地点"].to_numpy() if "地点" in self.frame else np.full(len(self), '', dtype=object)
+
+    @property
+    def records(self):
+        """地点ごとの辞書のリスト（備考欄を除外、初回参照時に1回だけ作成）"""
+        if self._records is None:
+            frame = self.frame.drop(columns=EXCLUDED_COLUMNS, errors='ignore')
+            columns = [frame[column].tolist() for column in frame.columns]
+            names = list(frame.columns)
+            self._records = [dict(zip(names, values)) for values in zip(*columns)]
+        return self._records
+
+    def fingerprint(self):
+        """正規化後の内容の指紋（キャッシュキー用）"""
+        if self._fingerprint is None:
+            values = pd.util.hash_pandas_object(self.frame, index=False).to_numpy().tobytes()
+            self._fingerprint = hashlib.sha1("|".join(map(str, self.frame.columns)).encode("utf-8") + values).hexdigest()
+        return self._fingerprint
+
+    def first_departure(self):
+        """最初の始点の希望出発日時（未設定・解析不能ならNone）"""
+        start_indices = np.flatnonzero(self.is_start)
+        if len(start_indices) == 0:
+            return None
+        departure = self.departure.iloc[start_indices[0]]
+        return None if pd.isna(departure) else departure.to_pydatetime()
+
+def diff_locations(previous, current):
+    """前回と今回の地点の辞書のリストを比較し、今回の各地点が前回のどの地点にあたるかを返す
+
+    地点コード（空なら地点名）と住所が同じ地点を同じ地点とみなす（同じ組が複数あれば出現順に対応させる）。
+    戻り値は {'unchanged': {今回の位置: 前回の位置}, 'changed': {今回の位置: 前回の位置}（希望時刻・重量などが変わった地点）,
+    'added': [今回の位置], 'removed': [前回の位置]}。
+    """
+    def key(record):
+        name = str(record.get("地点コード", "")).strip() or str(record.get("地点", "")).strip()
+        return name, str(record.get("住所", "")).strip()
+
+    previous_by_key = {}
+    for index, record in enumerate(previous):
+        previous_by_key.setdefault(key(record), []).append(index)
+
+    unchanged, changed, added = {}, {}, []
+    for index, record in enumerate(current):
+        candidates = previous_by_key.get(key(record))
+        if not candidates:
+            added.append(index)
+            continue
+        old_index = candidates.pop(0)
+        if previous[old_index] == record:
+            unchanged[index] = old_index
+        else:
+            changed[index] = old_index
+    removed = sorted(index for indices in previous_by_key.values() for index in indices)
+    return {'unchanged': unchanged, 'changed': changed, 'added': added, 'removed': removed}
+
+def normalize_locations(data):
+    """DataFrameまたは辞書のリストからLocationTableを作成"""
+    frame = data if isinstance(data, pd.DataFrame) else pd.DataFrame(list(data))
+    return LocationTable(frame)
+
+#======================================================================
+# CSVの読み込み
+#======================================================================
+
+class MissingColumnsError(ValueError):
+    """CSVのヘッダーに必須列が不足している"""
+
+    def __init__(self, missing):
+        super().__init__(f"必須列が不足: {', '.join(missing)}")
+        self.missing = missing
+
+def sniff_encoding(prefix):
+    """ファイル先頭のバイト列から文字コードを判定（候補のうち最初に復号できたもの）"""
+    for encoding in UPLOAD_CONFIG["encodings"]:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            # 先頭部分のみのため、末尾で途切れたマルチバイト文字は許容する
+            decoder.decode(prefix, final=False)
+        except UnicodeDecodeError:
+            continue
+        return encoding
+    return None
+
+def _file_size(file):
+    size = getattr(file, 'size', None)
+    if size is None:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+    return size
+
+def _read_chunks(file, encoding, required_columns, total_size, on_progress, strict_numeric=True):
+    """ヘッダーを検証してから、必須列のみを列ごとの型を指定してチャンク単位で読み込む
+
+    strict_numericでは数値列をパーサーで直接floatとして読み込む。数値に変換できない値があれば
+    ValueErrorとなるため、呼び出し側は文字列として読み込み直す。
+    """
+    file.seek(0)
+    header = pd.read_csv(file, encoding=encoding, nrows=0).columns
+    missing = [column for column in required_columns if column not in header]
+    if missing:
+        raise MissingColumnsError(missing)
+
+    numeric_columns = [column for column in required_columns if column in NUMERIC_COLUMNS]
+    dtypes = {column: str for column in required_columns}
+    if strict_numeric:
+        dtypes.update({column: 'float64' for column in numeric_columns})
+
+    file.seek(0)
+    reader = pd.read_csv(
+        file, encoding=encoding, usecols=required_columns, dtype=dtypes,
+        keep_default_na=False, na_values={column: [''] for column in numeric_columns},
+        chunksize=UPLOAD_CONFIG["chunk_rows"]
+    )
+    chunks = []
+    for chunk in reader:
+        for column in numeric_columns:
+            if strict_numeric:
+                chunk[column] = chunk[column].fillna(0.0)
+            else:
+                chunk[column] = pd.to_numeric(chunk[column], errors='coerce').fillna(0.0)
+        chunks.append(chunk[list(required_columns)])
+        if on_progress and total_size:
+            on_progress(min(file.tell() / total_size, 1.0))
+
+    if not chunks:
+        return pd.DataFrame(columns=list(required_columns))
+    return pd.concat(chunks, ignore_index=True)
+
+def _read_with_encoding(file, encoding, required_columns, total_size, on_progress):
+    try:
+        return _read_chunks(file, encoding, required_columns, total_size, on_progress)
+    except (MissingColumnsError, UnicodeDecodeError):
+        raise
+    except ValueError:
+        # 数値列に数値以外の値がある場合は、文字列として読み込んでから変換する
+        return _read_chunks(file, encoding, required_columns, total_size, on_progress, strict_numeric=False)
+
+def read_locations_csv(file, required_columns, on_progress=None):
+    """配送先CSVから必須列のみを読み込む
+
+    文字コードはファイル先頭のみで判定し、本体は1回だけチャンク単位で読み込む。
+    必須列が不足している場合はMissingColumnsErrorを送出する。on_progressには0〜1の進捗率を渡す。
+    """
+    total_size = _file_size(file)
+    file.seek(0)
+    encoding = sniff_encoding(file.read(UPLOAD_CONFIG["sniff_bytes"]))
+    if encoding is None:
+        raise ValueError("文字コードを判定できません（UTF-8またはShift_JISで保存してください）")
+
+    # 先頭以降に判定と異なるバイト列があった場合のみ、残りの候補で読み直す
+    candidates = [encoding] + [e for e in UPLOAD_CONFIG["encodings"] if e != encoding]
+    for candidate in candidates:
+        try:
+            return _read_with_encoding(file, candidate, required_columns, total_size, on_progress)
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("文字コードを判定できません（UTF-8またはShift_JISで保存してください）")
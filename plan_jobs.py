@@ -0,0 +1,157 @@
+# --- plan_jobs.py (ルート計算のバックグラウンド実行) ---
+
+import concurrent.futures
+import threading
+import time
+import traceback
+import uuid
+
+from constants import JOB_CONFIG
+
+class PlanJob:
+    """バックグラウンドで実行する計画1件の状態
+
+    ワーカースレッドはreport()・stream()で進捗を書き込み、画面側はsnapshot()で
+    その時点の状態のコピーを参照する。
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.status = 'queued'  # queued / running / done / error
+        self.stage = "⏳ 実行待ち"
+        self.progress = 0.0
+        self.detail = ""
+        self.summary = None
+        self.items = []
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._usage_claimed = False
+        self._lock = threading.Lock()
+
+    def report(self, stage, progress, detail=""):
+        """段階の表示名・全体の進捗率(0〜1)・詳細を更新（進捗率は戻さない）"""
+        with self._lock:
+            self.stage = stage
+            self.progress = max(self.progress, min(progress, 1.0))
+            self.detail = detail
+
+    def stream(self, kind, value):
+        """AI応答のストリーミング解析イベントを受け取る"""
+        with self._lock:
+            if kind == 'summary':
+                self.summary = value
+            elif kind == 'item':
+                self.items.append(value)
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'error')
+
+    def snapshot(self):
+        """画面表示用に現在の状態をコピーして返す"""
+        with self._lock:
+            end = self.finished_at or time.time()
+            return {
+                'job_id': self.job_id,
+                'status': self.status,
+                'stage': self.stage,
+                'progress': self.progress,
+                'detail': self.detail,
+                'summary': self.summary,
+                'items': list(self.items),
+                'result': self.result,
+                'error': self.error,
+                'traceback': self.traceback,
+                'elapsed': end - (self.started_at or end),
+            }
+
+    def claim_usage(self):
+        """完了したジョブのAPI使用量を1回だけ返す（再接続後の二重集計を防ぐ）"""
+        with self._lock:
+            if self.status != 'done' or self._usage_claimed:
+                return None
+            self._usage_claimed = True
+            return self.result.get('usage')
+
+class JobQueue:
+    """計画ジョブをスレッドプールで実行し、ジョブIDで結果を保持する
+
+    ジョブはプロセス内で共有するため、Streamlitの再実行や再接続で新しいセッションになっても
+    同じジョブIDで進捗と結果を参照できる。
+    """
+
+    def __init__(self, max_workers, max_jobs, result_ttl_seconds):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.result_ttl_seconds = result_ttl_seconds
+        self._jobs = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """func(*args, on_progress=..., on_stream=..., **kwargs) をバックグラウンドで実行し、ジョブIDを返す"""
+        job = PlanJob(uuid.uuid4().hex)
+        with self._lock:
+            self._evict(time.time())
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="plan-job"
+                )
+            self._jobs[job.job_id] = job
+            self._executor.submit(self._run, job, func, args, kwargs)
+        return job.job_id
+
+    def get(self, job_id):
+        """ジョブを取得（存在しない・破棄済みならNone）"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, func, args, kwargs):
+        with job._lock:
+            job.status = 'running'
+            job.started_at = time.time()
+        try:
+            result = func(*args, on_progress=job.report, on_stream=job.stream, **kwargs)
+        except Exception as e:
+            with job._lock:
+                job.error = str(e)
+                job.traceback = traceback.format_exc()
+                job.status = 'error'
+                job.finished_at = time.time()
+            return
+        with job._lock:
+            job.result = result
+            job.progress = 1.0
+            job.status = 'done'
+            job.finished_at = time.time()
+
+    def _evict(self, now):
+        """保持期間を過ぎた完了ジョブと、件数上限を超えた分の古い完了ジョブを破棄"""
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished),
+            key=lambda job: job.finished_at
+        )
+        excess = len(self._jobs) - self.max_jobs + 1
+        for job in finished:
+            if now - job.finished_at > self.result_ttl_seconds or excess > 0:
+                del self._jobs[job.job_id]
+                excess -= 1
+
+    def get_stats(self):
+        """状態ごとのジョブ件数"""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+# プロセスで1つのジョブキュー
+job_queue = JobQueue(
+    max_workers=JOB_CONFIG["max_workers"],
+    max_jobs=JOB_CONFIG["max_jobs"],
+    result_ttl_seconds=JOB_CONFIG["result_ttl_hours"] * 3600
+)
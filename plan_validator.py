@@ -0,0 +1,348 @@
+# --- plan_validator.py (運行計画の検証) ---
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from constants import CANDIDATE_CONFIG, PLAN_VALIDATION_CONFIG, SOLVER_CONFIG
+
+# 違反の重要度（errorは物理的・法的に実行できない計画、warningは希望時刻からの遅れなど）
+VIOLATION_KINDS = {
+    'time_format': ('error', "提案時間を解釈できません"),
+    'time_order': ('error', "時刻が前のイベントより前に戻っています"),
+    'unknown_location': ('error', "地点を特定できません"),
+    'unreachable': ('error', "ルートが見つからない区間を移動しています"),
+    'travel_too_fast': ('error', "移動時間が地点間の所要時間より短すぎます"),
+    'continuous_driving': ('error', "連続運転時間の上限を超えています"),
+    'daily_duty': ('error', "1日の拘束時間の上限を超えています"),
+    'capacity': ('error', "積載上限を超えています"),
+    'missing_stop': ('error', "訪問されていない地点があります"),
+    'late_arrival': ('warning', "希望到着時刻に遅れています"),
+    'late_departure': ('warning', "希望出発時刻に遅れています"),
+    'duplicate_visit': ('warning', "同じ地点に複数回到着しています"),
+    'too_many_vehicles': ('warning', "利用可能な台数より多くの車両を使っています"),
+}
+
+_TIME_FORMAT = "%Y/%m/%d %H:%M"
+
+def _parse_time(text):
+    """「YYYY/MM/DD HH:MM」形式を優先し、それ以外の表記はpandasで解釈する（解釈できなければNone）"""
+    text = text.strip()
+    if not text:
+        return None
+    try:
+        return datetime.strptime(text, _TIME_FORMAT)
+    except ValueError:
+        pass
+    parsed = pd.to_datetime(text, errors='coerce')
+    return None if pd.isna(parsed) else parsed.to_pydatetime()
+
+def _parse_event_time(text):
+    """提案時間（時刻、または「開始 - 終了」の範囲）を (開始, 終了) に変換
+
+    normalize_ai_itemsは移動の範囲に次の到着時刻を付け足すため、「開始 - 終了 - 次の到着」の場合は
+    AIが出力した終了時刻を使う。
+    """
+    parts = str(text).split(" - ")
+    start = _parse_time(parts[0])
+    end = _parse_time(parts[1]) if len(parts) > 1 else start
+    return start, end
+
+def _to_datetime(value):
+    return None if pd.isna(value) else value.to_pydatetime()
+
+def location_lookup(table):
+    """結果の行から地点の位置を引く関数（地点コード → 地点名 → 訪問地点のNoの順に照合）"""
+    codes, names = {}, {}
+    for index, record in enumerate(table.records):
+        codes.setdefault(str(record.get("地点コード", "")).strip(), index)
+        names.setdefault(str(record.get("地点", "")).strip(), index)
+    codes.pop("", None)
+    names.pop("", None)
+    size = len(table)
+
+    def locate(row):
+        index = codes.get(row["地点コード"], names.get(row["地点名"]))
+        if index is None and row["地点ID"].isdigit() and 1 <= int(row["地点ID"]) <= size:
+            index = int(row["地点ID"]) - 1
+        return index
+
+    return locate
+
+def _vehicle_capacities(vehicles):
+    """車両名 → (最大積載重量, 最大積載容量)。AIが「トラックN」と呼んだ車両はN台目とみなす"""
+    if isinstance(vehicles, pd.DataFrame):
+        vehicles = vehicles.to_dict('records')
+    capacities = {}
+    for number, vehicle in enumerate(vehicles or [], start=1):
+        capacity = (
+            pd.to_numeric(vehicle.get("最大積載重量"), errors='coerce'),
+            pd.to_numeric(vehicle.get("最大積載容量"), errors='coerce'),
+        )
+        capacity = tuple(float(value) if value and not pd.isna(value) else float("inf") for value in capacity)
+        for key in (vehicle.get("車両ID"), vehicle.get("車種名"), f"トラック{number}"):
+            if key:
+                capacities.setdefault(str(key).strip(), capacity)
+    return capacities, len(vehicles or [])
+
+class _VehicleReplay:
+    """1台分の再生状態（現在地・その地点での最後の時刻・連続運転時間・拘束開始・積載・走行の集計）"""
+
+    def __init__(self):
+        self.position = None
+        self.last_time = None
+        self.latest = None
+        self.in_transit = False
+        self.breaks = 0.0
+        self.rests = 0
+        self.driven = 0.0
+        self.duty_start = None
+        self.duty_reported = False
+        self.ferry_boarded = None
+        self.total_drop = np.zeros(2)
+        self.load = np.zeros(2)
+        self.peak = np.zeros(2)
+        self.first_row = None
+        self.drive_seconds = 0.0
+        self.drive_meters = 0.0
+        self.lateness = 0.0
+
+class PlanValidator:
+    """運行計画の行（process_ai_responseの結果）を、移動時間マトリックス・希望時刻・積載・労働条件と照合する
+
+    行を先頭から1回走査し、車両ごとの状態を更新しながら違反を記録するため、計算量はイベント数に比例する。
+    """
+
+    def __init__(self, table, matrix, vehicles, settings):
+        self.table = table
+        self.seconds = matrix.seconds
+        self.meters = matrix.meters
+        self.reachable = matrix.reachable
+        self.arrival = [_to_datetime(value) for value in table.arrival]
+        self.departure = [_to_datetime(value) for value in table.departure]
+        records = table.records
+        depot_or_end = table.is_start | table.is_end
+        self.pickup = np.array([[float(r.get("積み込み重量", 0) or 0), float(r.get("積み込み容量", 0) or 0)] for r in records])
+        self.drop = np.array([[float(r.get("荷下ろし重量", 0) or 0), float(r.get("荷下ろし容量", 0) or 0)] for r in records])
+        # 始点・終着での積み降ろしは全車両で分担するため、ソルバーと同じく積載判定から除外する
+        self.pickup[depot_or_end] = 0
+        self.drop[depot_or_end] = 0
+        self.shared = depot_or_end
+        self.locate = location_lookup(table)
+        self.capacities, self.vehicle_count = _vehicle_capacities(vehicles)
+
+        config = PLAN_VALIDATION_CONFIG
+        self.travel_ratio = 1.0 - config["travel_time_tolerance"]
+        self.slack = config["slack_minutes"] * 60
+        self.lateness_tolerance = config["lateness_tolerance_minutes"] * 60
+        self.continuous_limit = None
+        self.rest_seconds = 0
+        if settings.get("continuous_limit") and settings.get("continuous_hours"):
+            self.continuous_limit = settings["continuous_hours"] * 3600
+            self.rest_seconds = settings.get("rest_minutes", 30) * 60
+        self.daily_limit = None
+        if settings.get("daily_limit") and settings.get("daily_hours"):
+            self.daily_limit = settings["daily_hours"] * 3600
+        self.ferry_reset_seconds = config["ferry_reset_hours"] * 3600
+
+    def validate(self, results):
+        """違反の一覧 [{'row', 'vehicle', 'kind', 'level', 'message'}] を返す（rowは結果の行番号、計画全体の違反はNone）"""
+        return self.evaluate(results)[0]
+
+    def evaluate(self, results):
+        """(違反の一覧, 指標) を返す
+
+        指標は {'drive_seconds', 'drive_meters', 'lateness_seconds', 'vehicles', 'errors'}
+        （走行時間・距離はマトリックスの値、遅れは希望到着・希望出発からの遅れの合計）。
+        """
+        violations = []
+        states = {}
+        visits = np.zeros(len(self.table), dtype=np.int64)
+
+        def add(kind, row, vehicle, detail=""):
+            level, text = VIOLATION_KINDS[kind]
+            violations.append({
+                'row': row, 'vehicle': vehicle, 'kind': kind, 'level': level,
+                'message': f"{vehicle + ': ' if vehicle else ''}{text}{'（' + detail + '）' if detail else ''}"
+            })
+
+        for row_index, row in enumerate(results):
+            vehicle = row["車両"]
+            state = states.get(vehicle)
+            if state is None:
+                state = states[vehicle] = _VehicleReplay()
+                state.first_row = row_index
+            start, end = _parse_event_time(row["提案時間"])
+            if start is None or end is None:
+                add('time_format', row_index, vehicle, row["提案時間"])
+                continue
+            if state.latest is not None and start < state.latest:
+                add('time_order', row_index, vehicle, row["提案時間"])
+            # 移動の終了時刻は次の到着時刻で補われ、途中の休憩と重なることがあるため開始時刻のみで判定する
+            latest = start if row["ステータス"] in ("移動", "フェリー移動") else end
+            state.latest = max(state.latest or latest, latest)
+            self._replay(state, row_index, row, start, end, visits, add)
+            if state.duty_start is None:
+                state.duty_start = start
+            if (self.daily_limit and not state.duty_reported
+                    and (end - state.duty_start).total_seconds() > self.daily_limit + self.slack):
+                state.duty_reported = True
+                add('daily_duty', row_index, vehicle, f"{self.daily_limit // 3600:.0f}時間")
+
+        for vehicle, state in states.items():
+            capacity = self.capacities.get(vehicle, (float("inf"), float("inf")))
+            peak = state.total_drop + np.maximum(state.peak, 0)
+            for amount, limit, unit in zip(peak, capacity, ("kg", "m3")):
+                if amount > limit:
+                    add('capacity', state.first_row, vehicle, f"最大{amount:g}{unit} / 上限{limit:g}{unit}")
+
+        for index in np.flatnonzero(visits == 0):
+            add('missing_stop', None, "", str(self.table.names[index]))
+        if self.vehicle_count and len(states) > self.vehicle_count:
+            add('too_many_vehicles', None, "", f"{len(states)}台 / {self.vehicle_count}台")
+        metrics = {
+            'drive_seconds': sum(state.drive_seconds for state in states.values()),
+            'drive_meters': sum(state.drive_meters for state in states.values()),
+            'lateness_seconds': sum(state.lateness for state in states.values()),
+            'vehicles': len(states),
+            'errors': count_errors(violations),
+        }
+        return violations, metrics
+
+    def _replay(self, state, row_index, row, start, end, visits, add):
+        """1イベント分の状態更新と違反判定"""
+        vehicle, status = row["車両"], row["ステータス"]
+
+        if status.startswith("フェリー"):
+            # フェリー区間は道路の移動時間と比較できないため、下船後の地点から判定し直す
+            if status == "フェリー乗船":
+                state.ferry_boarded = start
+            elif status == "フェリー下船":
+                if state.ferry_boarded is not None and (start - state.ferry_boarded).total_seconds() >= self.ferry_reset_seconds:
+                    state.duty_start = end
+                state.driven = 0.0
+                state.position = None
+            state.in_transit = True
+            state.last_time = end
+            return
+
+        if status in ("移動", "出発"):
+            if status == "出発":
+                self._check_departure(state, row_index, row, start, add)
+            elif not state.in_transit and state.last_time is not None:
+                # 出発の行がない場合は、最初の移動の開始を出発時刻とする
+                state.last_time = max(state.last_time, start)
+            state.in_transit = True
+            return
+
+        if status == "休憩":
+            duration = (end - start).total_seconds()
+            if state.in_transit:
+                state.breaks += duration
+                if self.rest_seconds and duration >= self.rest_seconds:
+                    state.rests += 1
+            else:
+                if self.rest_seconds and duration >= self.rest_seconds:
+                    state.driven = 0.0
+                state.last_time = end
+            return
+
+        if status != "到着":
+            # 滞在などは地点での時刻のみ進める
+            if not state.in_transit:
+                state.last_time = max(state.last_time or end, end)
+            return
+
+        index = self.locate(row)
+        if index is None:
+            add('unknown_location', row_index, vehicle, f"{row['地点コード']} {row['地点名']}".strip())
+            state.position, state.in_transit, state.last_time = None, False, end
+            state.breaks, state.rests = 0.0, 0
+            return
+
+        visits[index] += 1
+        if visits[index] > 1 and not self.shared[index]:
+            add('duplicate_visit', row_index, vehicle, row["地点名"])
+        self._check_leg(state, row_index, row, index, start, add)
+
+        if self.arrival[index] is not None:
+            late = (start - self.arrival[index]).total_seconds()
+            state.lateness += max(late, 0.0)
+            if late > self.lateness_tolerance:
+                add('late_arrival', row_index, vehicle, f"{row['地点名']} {late // 60:.0f}分")
+
+        state.total_drop += self.drop[index]
+        state.load += self.pickup[index] - self.drop[index]
+        state.peak = np.maximum(state.peak, state.load)
+        state.position, state.in_transit, state.last_time = index, False, end
+        state.breaks, state.rests = 0.0, 0
+
+    def _check_leg(self, state, row_index, row, index, arrival, add):
+        """直前の地点からの所要時間・連続運転時間を判定"""
+        vehicle, origin = row["車両"], state.position
+        if origin is None or origin == index or state.last_time is None:
+            return
+        if not self.reachable[origin, index]:
+            add('unreachable', row_index, vehicle, f"{self.table.names[origin]} → {row['地点名']}")
+            return
+
+        required = float(self.seconds[origin, index])
+        state.drive_seconds += required
+        state.drive_meters += float(self.meters[origin, index])
+        available = (arrival - state.last_time).total_seconds() - state.breaks
+        if available < required * self.travel_ratio - self.slack:
+            add('travel_too_fast', row_index, vehicle,
+                f"{self.table.names[origin]} → {row['地点名']} 計画{max(available, 0) // 60:.0f}分 / 所要{required // 60:.0f}分")
+
+        if not self.continuous_limit:
+            return
+        # 待ち時間が休憩時間以上あれば休憩とみなす（ソルバーと同じ扱い）
+        if available - required >= self.rest_seconds:
+            state.driven = 0.0
+        driven = state.driven + required - state.rests * self.continuous_limit
+        if driven > self.continuous_limit + self.slack:
+            add('continuous_driving', row_index, vehicle,
+                f"{row['地点名']}到着時点で{driven / 3600:.1f}時間 / 上限{self.continuous_limit // 3600:.0f}時間")
+            driven = 0.0
+        state.driven = max(driven, 0.0)
+
+    def _check_departure(self, state, row_index, row, start, add):
+        """地点での滞在時間による休憩と、希望出発時刻からの遅れを判定"""
+        if not state.in_transit and state.last_time is not None and self.rest_seconds:
+            if (start - state.last_time).total_seconds() >= self.rest_seconds:
+                state.driven = 0.0
+        if not state.in_transit:
+            state.last_time = max(state.last_time or start, start)
+        index = self.locate(row)
+        if index is not None and self.departure[index] is not None:
+            late = (start - self.departure[index]).total_seconds()
+            state.lateness += max(late, 0.0)
+            if late > self.lateness_tolerance:
+                add('late_departure', row_index, row["車両"], f"{row['地点名']} {late // 60:.0f}分")
+
+def validate_plan(results, table, matrix, vehicles, settings):
+    """運行計画の違反の一覧を返す（PlanValidator.validateの簡易呼び出し）"""
+    return PlanValidator(table, matrix, vehicles, settings).validate(results)
+
+def score_plan(metrics, settings):
+    """計画の指標をソルバーと同じ重みで1つの値にまとめる（小さいほど良い）
+
+    走行時間（mode2は距離）＋遅れ×遅れの重み＋使用台数×車両の固定費＋違反件数×違反のペナルティ。
+    """
+    weights = SOLVER_CONFIG["mode_weights"].get(settings.get("mode"), SOLVER_CONFIG["mode_weights"]["mode1"])
+    # 距離(m)はソルバーと同じく時速36kmで秒に換算する
+    travel = metrics['drive_meters'] / 10.0 if weights["use_distance"] else metrics['drive_seconds']
+    return (
+        travel
+        + weights["lateness"] * metrics['lateness_seconds']
+        + SOLVER_CONFIG["vehicle_fixed_cost_minutes"] * 60 * metrics['vehicles']
+        + CANDIDATE_CONFIG["error_penalty_minutes"] * 60 * metrics['errors']
+    )
+
+def count_errors(violations):
+    return sum(1 for violation in violations if violation['level'] == 'error')
+
+def flagged_vehicles(violations):
+    """違反（error）のある車両名（出現順）"""
+    return list(dict.fromkeys(v['vehicle'] for v in violations if v['level'] == 'error' and v['vehicle']))
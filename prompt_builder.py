@@ -0,0 +1,529 @@
+# --- prompt_builder.py (AI用プロンプトの組み立て) ---
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from constants import PLAN_VALIDATION_CONFIG, PROMPT_CONFIG, VALIDATION_CONFIG
+from travel_matrix import format_distance, format_duration
+
+#======================================================================
+# セクション単位のキャッシュ
+#======================================================================
+
+# (セクション名, 入力の指紋) → 組み立て済みの文字列
+_section_cache = OrderedDict()
+_section_cache_lock = threading.Lock()
+
+def _cached(name, fingerprint, build):
+    """入力の指紋が同じセクションは再利用し、変わったセクションだけを組み立て直す"""
+    key = (name, fingerprint)
+    with _section_cache_lock:
+        if key in _section_cache:
+            _section_cache.move_to_end(key)
+            return _section_cache[key]
+    value = build()
+    with _section_cache_lock:
+        _section_cache[key] = value
+        while len(_section_cache) > PROMPT_CONFIG["section_cache_size"]:
+            _section_cache.popitem(last=False)
+    return value
+
+def _fingerprint(*parts):
+    """任意の入力（JSON化できる値・指紋文字列）から指紋を作成"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def frame_fingerprint(frame):
+    """DataFrameの内容（列名・値）の指紋"""
+    try:
+        values = pd.util.hash_pandas_object(frame, index=False).values.tobytes()
+    except TypeError:
+        values = frame.to_json(force_ascii=False).encode("utf-8")
+    return hashlib.sha1("|".join(map(str, frame.columns)).encode("utf-8") + values).hexdigest()
+
+#======================================================================
+# 車両・時間制約の分析
+#======================================================================
+
+def analyze_vehicle_requirements(table, max_windows=5):
+    """時間制約から必要車両数を自動判断（区間スイープで同時滞在数の最大値を求める）"""
+    min_required, peak_windows = _cached(
+        'vehicle_requirements', (table.fingerprint(), max_windows),
+        lambda: _analyze_vehicle_requirements(table, max_windows)
+    )
+    return min_required, [dict(window) for window in peak_windows]
+
+def _analyze_vehicle_requirements(table, max_windows):
+    arrivals, departures = table.arrival, table.departure
+    valid = (arrivals.notna() & departures.notna() & (departures > arrivals)).to_numpy()
+    if not valid.any():
+        return 1, []
+    
+    arrival_values = arrivals.to_numpy()[valid]
+    departure_values = departures.to_numpy()[valid]
+    names = table.names[valid]
+    
+    # 到着(+1)と出発(-1)を時刻順に並べる。同時刻は出発を先に処理し、接するだけの区間は重複としない
+    times = np.concatenate([arrival_values, departure_values])
+    deltas = np.concatenate([np.ones(len(arrival_values), dtype=np.int64), -np.ones(len(departure_values), dtype=np.int64)])
+    order = np.lexsort((deltas, times))
+    times, occupancy = times[order], np.cumsum(deltas[order])
+    peak = int(occupancy.max())
+    
+    peak_windows = []
+    if peak > 1:
+        # 最大同時滞在数となる区間（隣接する区間は結合）
+        for k in np.flatnonzero(occupancy == peak):
+            start, end = times[k], times[k + 1]
+            if start == end:
+                continue
+            if peak_windows and peak_windows[-1]['end'] == start:
+                peak_windows[-1]['end'] = end
+            else:
+                peak_windows.append({'start': start, 'end': end})
+        for window in peak_windows[:max_windows]:
+            active = (arrival_values < window['end']) & (departure_values > window['start'])
+            window['start'] = pd.Timestamp(window['start'])
+            window['end'] = pd.Timestamp(window['end'])
+            window['count'] = peak
+            window['locations'] = names[active].tolist()
+    
+    return max(1, peak), peak_windows[:max_windows]
+
+def get_available_vehicles_for_ai(selected_vehicles, all_vehicles, min_required):
+    """AI用に利用可能車両を準備（修正版：所属情報を除外）"""
+    # 選択された車両
+    selected_count = len(selected_vehicles)
+    
+    # 不足している場合は追加で利用可能車両を含める
+    if selected_count < min_required:
+        available_vehicles = [v for v in all_vehicles if v.get("車両ステータス") == "稼働中"]
+        # 選択済み車両の車両IDを取得
+        selected_ids = set(selected_vehicles['車両ID'].tolist())
+        
+        # 追加で利用可能な車両を含める
+        additional_vehicles = []
+        for vehicle in available_vehicles:
+            if vehicle['車両ID'] not in selected_ids:
+                additional_vehicles.append(vehicle)
+                if len(selected_vehicles) + len(additional_vehicles) >= min_required:
+                    break
+        
+        # 選択済み + 追加車両を結合
+        all_available = pd.concat([
+            selected_vehicles,
+            pd.DataFrame(additional_vehicles)
+        ], ignore_index=True)
+        
+        # 所属、選択、メモ欄を除外してAIに送信
+        return all_available.drop(columns=['選択', 'メモ欄', '所属'], errors='ignore')
+    
+    # 所属、選択、メモ欄を除外してAIに送信
+    return selected_vehicles.drop(columns=['選択', 'メモ欄', '所属'], errors='ignore')
+
+
+#======================================================================
+# プロンプトのセクション
+#======================================================================
+
+# 片道輸送の明確化（冒頭の役割セクションに埋め込む）
+TRANSPORT_METHOD_CLARIFICATION = """## 🎯 最重要・輸送方式の明確化
+これは片道輸送です。始点から終着点への一方向移動のみを行い、往復・巡回・帰還は一切行いません。
+終着地で業務を完了し、始点に戻る必要はありません。
+
+## 🚚 交通手段について
+移動には自動車(トラック・バン等の道路輸送)を使用してください。必要に応じて船舶(フェリー)との併用も可能です。
+ただし、航空便、貨物列車、宅配便等の利用はできません。
+
+"""
+
+# 冒頭セクションが参照する設定項目
+HEADER_SETTING_KEYS = ("mode", "custom_prompt", "use_tolls", "continuous_limit", "continuous_hours", "daily_limit", "daily_hours")
+
+_INFRASTRUCTURE_RULES = [
+    "\n### ⚠️ 重要：実在する交通インフラのみ使用",
+    "**絶対に架空の港や航路を作らないでください。**",
+    "実在するフェリー航路のみ：",
+    "- 本州↔北海道: 大間港↔函館港（1時間30分）、青森港↔函館港（3時間40分）、八戸港↔苫小牧港（8時間）",
+    "- 本州↔九州: 別府港↔八幡浜港、新門司港↔大阪南港",
+    "- 本州↔四国: 高松港↔宇野港、小豆島航路",
+    "**重要**: 東京↔札幌の直通フェリーは存在しません。北海道への移動は陸路で本州フェリー港まで移動後、フェリーで北海道の港へ、その後陸路で目的地という経路になります。",
+    "**札幌港、東京港などの架空の港は絶対に使用しないでください。**",
+]
+
+_FERRY_EXAMPLE = [
+    "- **重要**: フェリー乗船中の休憩時間は、具体的な開始時刻と終了時刻を明記してください。",
+    "- **例**: 11:00乗船、翌日06:00下船の場合 → 23:00-06:00を「フェリー乗船中休息」として明記",
+]
+
+# プレビュー用の制約・条件（働き方の規則と実在する交通インフラ）
+PREVIEW_RULES_SECTION = "\n".join([
+    "\n\n# 制約・条件",
+    "## 働き方に関する重要規則",
+    "### フェリー特例",
+    "以下の規則を厳密に遵守してください。",
+    "- フェリー乗船時間は、原則として、休息期間として取り扱います。",
+    "- フェリー乗船時間が8時間を超える場合には、原則としてフェリー下船時刻から次の勤務が開始される（勤務日がリセットされる）ものとします。この場合、計画が複数日にまたがっても構いません。",
+    *_FERRY_EXAMPLE,
+    *_FERRY_EXAMPLE,
+    *_INFRASTRUCTURE_RULES,
+    *_INFRASTRUCTURE_RULES,
+    "\n## 🚛 車両使用に関する最重要な指示",
+    "- **同時刻に複数地点での作業が必要な場合は、必ず異なる車両に割り当ててください**",
+    "- **1台の車両が同時に2箇所にいることは物理的に不可能です**",
+    "- **時間制約により複数車両が必要な場合は、積極的に複数車両を使用してください**",
+    "- **物理的に不可能なスケジュールの場合は、警告をサマリーに含めてください**",
+])
+
+# 実行用の車両使用に関する指示
+EXECUTION_RULES_SECTION = "\n".join([
+    "\n## 🚛 車両使用に関する重要な指示",
+    "- 時間制約により複数車両が必要な場合は、積極的に複数車両を使用してください",
+    "- 同時刻に複数地点での作業が必要な場合は、必ず異なる車両に割り当ててください",
+    "- 物理的に不可能なスケジュールの場合は、実現可能な代替案を提示してください",
+])
+
+PREVIEW_MATRIX_SECTION = "\n".join([
+    "\n## 地点間の移動時間と距離について",
+    "※実際の実行時には、Google Maps APIから取得したリアルタイムの交通情報を含む詳細データが追加されます。",
+])
+
+_TASK_TEMPLATE = """
+# タスク
+上記の全ての条件を満たす、最適な片道輸送計画を作成してください。
+
+# 重要な計画要件
+1. **始点拠点への到着**: 始点拠点（出発地）にも到着時刻を設定してください（荷物の引き取り作業のため）
+2. **適切な休憩**: 連続運転時間制限やフェリー特例に応じて、必要な休憩や休息期間を計画に含めてください
+3. **全拠点の訪問**: 始点から各経由地を通って終着点まで、すべての拠点を効率的に巡回してください
+4. **終着点の扱い**: 終着点（`終着`フラグが2の地点）の扱いは、入力データに従ってください
+5. **⚠️ 最重要：時間制約の厳守**: 同時刻に複数地点での作業が必要な場合は、必ず複数車両を使用してください
+
+# 出力形式についてのお願い
+1. まず最初に、計画全体の要点を簡潔にまとめたサマリーコメントを日本語で記述してください。
+   - **重要**: 複数車両が必要な理由がある場合は、その旨と根拠をサマリーに必ず含めてください
+   - **重要**: 物理的に不可能な時間指定がある場合は、警告をサマリーに必ず含めてください
+   - **重要**: フェリー特例を適用した場合（例：乗船時間を休息期間とした、勤務をリセットした等）は、その旨と法的根拠をサマリーに必ず含めてください
+2. 次に、必ず改行して区切り線`---`を一行だけ出力してください。
+3. 最後に、運行計画の詳細をJSONオブジェクトのリストとして出力してください。
+4. **最重要:** JSONの各オブジェクトには、**必ず** `d`, `proposed_time`, `desired_time`, `time_difference`, `status`, `location_id`, `name_code`, `location_name`, `remarks` のキーを**すべて含めてください**。値がない場合は空文字 `""` を入れること。
+5. `status` キーの値は、必ず{statuses}のいずれかを使用すること。
+6. **始点拠点には「到着」ステータスを必ず含める**こと（荷物引き取りのため）
+7. **必要に応じて「休憩」やフェリー関連のステータスを適切に配置**すること。
+
+```json
+[
+    {{
+        "d": "トラック1",
+        "proposed_time": "YYYY/MM/DD HH:MM",
+        "desired_time": "YYYY/MM/DD HH:MM", 
+        "time_difference": "HH:MM",
+        "status": "到着",
+        "location_id": "",
+        "name_code": "地点コード",
+        "location_name": "地点名",
+        "remarks": "始点拠点への到着（荷物引き取り）"
+    }}
+]
+```"""
+
+_EXECUTION_STATUSES = ["出発", "到着", "移動", "滞在", "休憩", "フェリー乗船", "フェリー移動", "フェリー下船"]
+
+EXECUTION_TASK_SECTION = _TASK_TEMPLATE.format(statuses="".join(f"「{s}」" for s in _EXECUTION_STATUSES))
+PREVIEW_TASK_SECTION = _TASK_TEMPLATE.format(statuses="".join(f"「{s}」" for s in _EXECUTION_STATUSES + ["フェリー乗船中休息"]))
+
+def _header_section(preview, settings, min_required, conflicts, vehicle_count):
+    """役割・文脈・重視ポイントのセクション"""
+    prompt_parts = []
+    if settings["mode"] == "mode4":
+        prompt_parts.append(f"""# 役割
+あなたは、物流業界で豊富な経験を持つ配車計画の専門家です。
+
+{TRANSPORT_METHOD_CLARIFICATION}
+
+# 最重要・お客様からの特別なご要望
+以下のご指示を、他のどのような条件よりも優先して実行してください。
+
+{settings["custom_prompt"]}
+""")
+        return "\n".join(prompt_parts)
+
+    prompt_parts.append(f"""# 役割
+あなたは、物流業界で豊富な経験を持つ配車計画の専門家です。
+
+{TRANSPORT_METHOD_CLARIFICATION}
+
+# 文脈・状況について""")
+    
+    # 複数車両必要性の自動判断結果を含める
+    if min_required > 1:
+        if preview:
+            prompt_parts.append(f"時間制約の分析により、最低{min_required}台の車両が必要です。")
+            if conflicts:
+                prompt_parts.append("以下の時間重複が検出されました：")
+                for window in conflicts:
+                    prompt_parts.append(f"- {'、'.join(window['locations'])}が同時間帯に重複")
+        else:
+            prompt_parts.append(f"⚠️ 重要：時間制約の分析により、最低{min_required}台の車両が必要です。")
+            if conflicts:
+                prompt_parts.append("以下の時間帯に作業が集中しています：")
+                for window in conflicts:
+                    prompt_parts.append(f"- {window['start'].strftime('%H:%M')}-{window['end'].strftime('%H:%M')}: {'、'.join(window['locations'])}（{window['count']}箇所が同時刻）")
+    
+    prompt_parts.append(f"利用可能な{vehicle_count}台の車両から最適な配車計画を立ててください。")
+    
+    if settings["use_tolls"]:
+        prompt_parts.append("移動の際は、有料道路も利用して構いません。")
+    else:
+        prompt_parts.append("なお、移動時は有料道路を避けるルートでお願いします。")
+    
+    # 労働条件を自然な文章で追加
+    if settings["continuous_limit"] or settings["daily_limit"]:
+        prompt_parts.append("\n\nドライバーの労働環境にも十分配慮していただき、")
+        labor_conditions = []
+        if settings["continuous_limit"]:
+            labor_conditions.append(f"連続運転時間は{settings['continuous_hours']}時間以内")
+        if settings["daily_limit"]:
+            labor_conditions.append(f"1日の全体拘束時間は{settings['daily_hours']}時間以内")
+        prompt_parts.append("、".join(labor_conditions) + "となるよう計画していただけますでしょうか。")
+    
+    # 最適化目標を自然な文章で明確化
+    prompt_parts.append("\n\n# 今回の計画で最も重視していただきたいポイント")
+    if settings["mode"] == "mode1":
+        prompt_parts.append("全体の移動時間をできる限り短縮することを最優先にお考えください。")
+    elif settings["mode"] == "mode2":
+        prompt_parts.append("総走行距離を最小限に抑えることを最優先にお考えください。")
+    elif settings["mode"] == "mode3":
+        prompt_parts.append("各訪問先の希望到着・出発時刻をできる限り厳守することを最優先にお考えください。")
+    
+    return "\n".join(prompt_parts)
+
+def _vehicles_section(vehicles_for_ai):
+    """利用可能な車両情報のセクション"""
+    return "\n".join(["\n## 利用可能な車両情報", vehicles_for_ai.to_markdown(index=False)])
+
+def _locations_section(locations):
+    """訪問地点の詳細情報のセクション（備考欄は除外）"""
+    prompt_parts = [
+        "\n## 訪問地点の詳細情報",
+        "| No | 始点 | 終着 | 地点 | 地点コード | 住所 | 希望到着 | 希望出発 | 積込kg | 積込m3 | 荷卸kg | 荷卸m3 |",
+        "|:--|:--|:--|:--|:--|:--|:--|:--|:--|:--|:--|:--|",
+    ]
+    for number, loc in enumerate(locations, start=1):
+        prompt_parts.append(f"| {number} | {loc.get('始点', '')} | {loc.get('終着', '')} | {loc.get('地点', '')} | {loc.get('地点コード', '')} | {loc.get('住所', '')} | {loc.get('希望到着', '')} | {loc.get('希望出発', '')} | {loc.get('積み込み重量', 0)} | {loc.get('積み込み容量', 0)} | {loc.get('荷下ろし重量', 0)} | {loc.get('荷下ろし容量', 0)} |")
+    return "\n".join(prompt_parts)
+
+#======================================================================
+# 地点間の移動データ
+#======================================================================
+
+def _usable_legs(matrix, candidates):
+    """AIに送る区間のマスク（ルートがあり、候補の区間。同じ地点同士は除く）"""
+    usable = matrix.reachable.copy()
+    if candidates is not None:
+        usable &= candidates
+    np.fill_diagonal(usable, False)
+    return usable
+
+def _travel_cells(matrix):
+    """全区間の「所要分/km」の表記（行列）"""
+    minutes = np.rint(matrix.seconds / 60).astype(np.int64)
+    kilometers = np.round(matrix.meters / 1000, 1)
+    return np.char.add(np.char.add(minutes.astype(str), "/"), np.char.mod("%.1f", kilometers))
+
+def _matrix_section(names, matrix, usable):
+    """地点間の移動時間と距離のセクション（区間ごとの文章。地点名を区間数だけ繰り返すため長い）"""
+    prompt_parts = ["\n## 地点間の移動時間と距離の詳細データ"]
+    for i, origin in enumerate(names):
+        prompt_parts.append(f"### {origin} からの移動時間・距離:")
+        seconds, meters = matrix.seconds[i], matrix.meters[i]
+        for j in np.flatnonzero(usable[i]):
+            prompt_parts.append(f"- {names[j]} まで: {format_duration(seconds[j])} ({format_distance(meters[j])})")
+    return "\n".join(prompt_parts)
+
+def _matrix_table_section(matrix, usable):
+    """地点間の移動時間と距離を、訪問地点のNoを行・列とする表で示すセクション"""
+    cells = np.where(usable, _travel_cells(matrix), "-")
+    prompt_parts = [
+        "\n## 地点間の移動時間と距離",
+        "地点は訪問地点の詳細情報のNoで示します。各行は出発地点、列は到着地点で、値は「所要時間(分)/距離(km)」です。",
+        "「-」は経路がない、または時間指定の順序上使えない区間です。",
+        "着: " + " ".join(str(j) for j in range(1, matrix.size + 1)),
+    ]
+    for i, row in enumerate(cells, start=1):
+        prompt_parts.append(f"{i}: " + " ".join(row))
+    return "\n".join(prompt_parts)
+
+def _matrix_nearest_section(matrix, usable, is_start, is_end, count):
+    """各地点から所要時間の短いcount地点と、終着地点への区間のみを示すセクション
+
+    始点からの区間はすべて含める。
+    """
+    ranked = np.where(usable, matrix.seconds, np.iinfo(np.int64).max)
+    count = max(1, min(count, matrix.size - 1))
+    nearest = np.argsort(ranked, axis=1, kind='stable')[:, :count]
+    selected = np.zeros_like(usable)
+    selected[np.repeat(np.arange(matrix.size), count), nearest.ravel()] = True
+    selected[is_start, :] = True
+    selected[:, is_end] = True
+    selected &= usable
+
+    cells = _travel_cells(matrix)
+    prompt_parts = [
+        "\n## 地点間の移動時間と距離（近い地点のみ）",
+        "地点は訪問地点の詳細情報のNoで示します。各行は「出発地点: 到着地点=所要時間(分)/距離(km)」です。",
+        f"各地点からは所要時間の短い{count}地点と終着地点への区間のみを示します。記載のない区間は遠回りのため使わないでください。",
+    ]
+    for i in range(matrix.size):
+        columns = np.flatnonzero(selected[i])
+        columns = columns[np.argsort(matrix.seconds[i, columns], kind='stable')]
+        prompt_parts.append(f"{i + 1}: " + " ".join(f"{j + 1}={cells[i, j]}" for j in columns))
+    return "\n".join(prompt_parts)
+
+def _travel_encodings():
+    """PROMPT_CONFIG["travel_encoding"]に従い、試す形式 (形式名, 近傍数) を詳しい順に並べる"""
+    encoding = PROMPT_CONFIG["travel_encoding"]
+    if encoding in ("sentences", "table"):
+        return [(encoding, None)]
+    nearest = [("nearest", count) for count in PROMPT_CONFIG["nearest_counts"]]
+    if encoding == "nearest":
+        return nearest
+    return [("table", None)] + nearest
+
+def plan_travel_section(names, matrix, table, candidates, budget):
+    """文字数の予算に収まる最も詳しい形式で移動データのセクションを作成し、(セクション, 形式名, 近傍数) を返す
+
+    どの形式も収まらない場合は最も短いものを返す（切り詰めはしない）。
+    """
+    usable = _usable_legs(matrix, candidates)
+    base = _fingerprint(names, matrix.fingerprint(), table.fingerprint(),
+                        hashlib.sha1(np.packbits(usable).tobytes()).hexdigest())
+    builders = {
+        'sentences': lambda count: _matrix_section(names, matrix, usable),
+        'table': lambda count: _matrix_table_section(matrix, usable),
+        'nearest': lambda count: _matrix_nearest_section(matrix, usable, table.is_start, table.is_end, count),
+    }
+
+    section = None
+    for encoding, count in _travel_encodings():
+        section = _cached('matrix', (base, encoding, count), lambda: builders[encoding](count))
+        if len(section) <= budget:
+            break
+    return section, encoding, count
+
+def _build_common_sections(preview, selected_vehicles, all_vehicles, table, settings):
+    """冒頭・車両情報・地点情報のセクションを、入力の指紋ごとにキャッシュして組み立てる"""
+    min_required, conflicts = analyze_vehicle_requirements(table)
+    vehicles_for_ai = get_available_vehicles_for_ai(selected_vehicles, all_vehicles, min_required)
+    
+    header_settings = {key: settings.get(key) for key in HEADER_SETTING_KEYS}
+    header = _cached(
+        'header', _fingerprint(preview, header_settings, min_required, conflicts, len(vehicles_for_ai)),
+        lambda: _header_section(preview, settings, min_required, conflicts, len(vehicles_for_ai))
+    )
+    vehicles = _cached('vehicles', frame_fingerprint(vehicles_for_ai), lambda: _vehicles_section(vehicles_for_ai))
+    locations = _cached('locations', table.fingerprint(), lambda: _locations_section(table.records))
+    return header, vehicles, locations
+
+#======================================================================
+# プロンプトの生成
+#======================================================================
+
+def generate_prompt_preview(selected_vehicles, all_vehicles, table, settings):
+    """プレビュー用プロンプトを生成（所属情報を除外）"""
+    if settings["mode"] == "mode5":
+        return "ハイブリッドモードでは、ローカルソルバーが作成した計画（車両別の到着順と時刻）のみをAIに送信し、サマリーの作成を依頼します。\n地点間の移動時間データはAIに送信されないため、地点数が増えてもプロンプトはほとんど大きくなりません。"
+    
+    header, vehicles, locations = _build_common_sections(True, selected_vehicles, all_vehicles, table, settings)
+    return "\n".join([header, PREVIEW_RULES_SECTION, vehicles, locations, PREVIEW_MATRIX_SECTION, PREVIEW_TASK_SECTION])
+
+def generate_prompt(selected_vehicles, all_vehicles, table, matrix, settings, candidates=None, diagnostics=None):
+    """AI実行用プロンプトを生成（所属情報を除外）
+
+    移動データは、プロンプト全体がVALIDATION_CONFIG["max_prompt_length"]文字に収まる最も詳しい形式で送る。
+    candidates（地点iの次に地点jを訪問できるかのマスク）で不可の区間は送らない。
+    近い地点のみに絞った場合は、その旨をdiagnostics（リスト）に追加する。
+    """
+    header, vehicles, locations = _build_common_sections(False, selected_vehicles, all_vehicles, table, settings)
+    fixed = [header, EXECUTION_RULES_SECTION, vehicles, locations, EXECUTION_TASK_SECTION]
+    budget = VALIDATION_CONFIG["max_prompt_length"] - sum(len(part) + 1 for part in fixed)
+    
+    travel, encoding, count = plan_travel_section(table.names.tolist(), matrix, table, candidates, budget)
+    if encoding == 'nearest' and diagnostics is not None:
+        diagnostics.append({
+            'level': 'info',
+            'message': f"プロンプトを{VALIDATION_CONFIG['max_prompt_length']}文字以内に収めるため、各地点から近い{count}地点への移動データのみをAIに送信します"
+        })
+    return "\n".join([header, EXECUTION_RULES_SECTION, vehicles, locations, travel, EXECUTION_TASK_SECTION])
+
+def generate_revision_prompt(prompt, results, violations):
+    """検証で問題が見つかった車両の計画のみを修正させるプロンプト（元のプロンプトに前回の計画と問題点を追加）"""
+    limit = PLAN_VALIDATION_CONFIG["max_reported_violations"]
+    errors = [violation for violation in violations if violation['level'] == 'error']
+    targets = list(dict.fromkeys(violation['vehicle'] for violation in errors if violation['vehicle']))
+    
+    prompt_parts = [prompt, "\n\n# 前回の計画の検証結果"]
+    prompt_parts.append("前回作成していただいた計画を、地点間の移動時間・希望時刻・積載・労働条件と照合したところ、以下の問題が見つかりました。")
+    for violation in errors[:limit]:
+        prompt_parts.append(f"- {violation['message']}")
+    if len(errors) > limit:
+        prompt_parts.append(f"- ほか{len(errors) - limit}件")
+    
+    if targets:
+        # 修正対象の車両の計画のみを1行1イベントで渡す
+        prompt_parts.append("\n# 修正対象の車両の前回の計画（車両 | ステータス | 提案時間 | 地点コード | 地点名）")
+        for row in results:
+            if row["車両"] in targets:
+                prompt_parts.append(f"{row['車両']} | {row['ステータス']} | {row['提案時間']} | {row['地点コード']} | {row['地点名']}")
+    
+    prompt_parts.append("\n# 修正のお願い")
+    if targets:
+        prompt_parts.append(f"- {'、'.join(targets)}の計画のみを修正して上記の問題を解消してください。それ以外の車両の計画は出力しないでください。")
+    if any(violation['kind'] == 'missing_stop' for violation in errors):
+        prompt_parts.append("- 訪問されていない地点は、いずれかの車両の計画に追加してください。追加した車両の計画も出力してください。")
+    prompt_parts.append("- 出力形式は最初の指示と同じです（サマリー、区切り線`---`、JSON）。JSONには出力する車両のすべてのイベントを含めてください。")
+    return "\n".join(prompt_parts)
+
+def generate_summary_prompt(results, solver_summary, settings):
+    """ハイブリッドモード用：解いた計画をコンパクトに渡し、サマリー文のみを依頼する"""
+    prompt_parts = ["""# 役割
+あなたは、物流業界で豊富な経験を持つ配車計画の専門家です。
+
+# タスク
+以下は配車ソルバーが作成した片道輸送の運行計画です。ルートは確定しているため変更しないでください。
+この計画の要点を、配車担当者向けのサマリーコメントとして日本語で簡潔にまとめてください。
+- 車両ごとの担当範囲と全体の所要時間の特徴
+- 希望時刻から大きく遅れる地点や、積載・労働条件上の注意点があれば警告として明記
+- 出力はサマリー文のみとし、JSONや区切り線`---`は出力しないこと
+"""]
+    
+    prompt_parts.append("# 計画条件")
+    prompt_parts.append(f"- 有料道路: {'使用する' if settings['use_tolls'] else '使用しない'}")
+    if settings["continuous_limit"]:
+        prompt_parts.append(f"- 連続運転{settings['continuous_hours']}時間ごとに{settings['rest_minutes']}分休憩")
+    if settings["daily_limit"]:
+        prompt_parts.append(f"- 1日拘束時間{settings['daily_hours']}時間以内")
+    
+    prompt_parts.append("\n# ソルバーの集計")
+    prompt_parts.append(solver_summary)
+    
+    # 到着イベントのみを「時刻 地点コード(地点名) 時間差」で1車両1行に圧縮
+    prompt_parts.append("\n# 車両別の到着順（時刻 地点コード:地点名 [希望時刻との差]）")
+    vehicle_lines = {}
+    for row in results:
+        if row["ステータス"] != "到着":
+            continue
+        stop = f"{row['提案時間'][-5:]} {row['地点コード']}:{row['地点名']}"
+        if row["時間差"]:
+            stop += f" [{row['時間差']}]"
+        vehicle_lines.setdefault(row["車両"], []).append(stop)
+    for vehicle, stops in vehicle_lines.items():
+        prompt_parts.append(f"- {vehicle}: " + " → ".join(stops))
+    
+    return "\n".join(prompt_parts)
+
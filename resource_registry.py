@@ -0,0 +1,84 @@
+# --- resource_registry.py (プロセス共通のリソース管理) ---
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from constants import REGISTRY_CONFIG
+
+def credential_key(*credentials):
+    """認証情報そのものを保持しないよう、登録キーにはハッシュを使う"""
+    joined = "\x1f".join(str(c) for c in credentials)
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+class ResourceRegistry:
+    """APIクライアントやキャッシュを、同じサーバープロセス内の全セッションで共有する
+
+    (種類, 認証情報のハッシュ)ごとに1つだけ作成し、件数上限を超えた場合や
+    一定時間使われなかった場合は、最も古いものから破棄する。
+    """
+
+    def __init__(self, max_entries, idle_ttl_seconds):
+        self.max_entries = max_entries
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get_or_create(self, kind, credential, factory, on_evict=None):
+        """登録済みのリソースを返す。未登録ならfactory()で作成して登録する"""
+        key = (kind, credential_key(credential))
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['last_used'] = now
+                self._entries.move_to_end(key)
+                return entry['resource']
+
+            resource = factory()
+            self._entries[key] = {'resource': resource, 'on_evict': on_evict, 'created_at': now, 'last_used': now}
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._release(evicted)
+            return resource
+
+    def contains(self, kind, credential):
+        """リソースが登録済みかを確認"""
+        with self._lock:
+            self._evict_idle(time.time())
+            return (kind, credential_key(credential)) in self._entries
+
+    def evict(self, kind, credential=None):
+        """指定した種類（と認証情報）のリソースを破棄"""
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == kind and (credential is None or key[1] == credential_key(credential)):
+                    self._release(self._entries.pop(key))
+
+    def _evict_idle(self, now):
+        for key in list(self._entries):
+            if now - self._entries[key]['last_used'] > self.idle_ttl_seconds:
+                self._release(self._entries.pop(key))
+
+    def _release(self, entry):
+        if entry['on_evict']:
+            try:
+                entry['on_evict'](entry['resource'])
+            except Exception:
+                pass
+
+    def get_stats(self):
+        """種類ごとの登録件数"""
+        with self._lock:
+            counts = {}
+            for kind, _ in self._entries:
+                counts[kind] = counts.get(kind, 0) + 1
+            return counts
+
+# プロセスで1つのレジストリ
+registry = ResourceRegistry(
+    max_entries=REGISTRY_CONFIG["max_entries"],
+    idle_ttl_seconds=REGISTRY_CONFIG["idle_ttl_hours"] * 3600
+)
@@ -0,0 +1,101 @@
+# --- response_cache.py (AI応答の永続キャッシュ) ---
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+def normalize_prompt(prompt):
+    """キャッシュキー用にプロンプトを正規化（文字の表記ゆれ・改行コード・行末の空白・前後の空行を揃える）"""
+    text = unicodedata.normalize("NFKC", str(prompt)).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip()
+
+def response_key(prompt, generation_params):
+    """正規化したプロンプトと生成パラメータ（モデル名・temperatureなど）からキャッシュキーを作成"""
+    payload = json.dumps([normalize_prompt(prompt), generation_params], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """キャッシュキーごとのAI応答の全文をSQLiteに保存する"""
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ai_responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_responses_last_used ON ai_responses (last_used)")
+        self._conn.commit()
+
+    def lookup(self, key):
+        """キャッシュ済みの応答を返す（なければNone）"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM ai_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE ai_responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return row[0]
+
+    def store(self, key, response):
+        """応答を保存（空の応答は保存しない）"""
+        if not response:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ai_responses (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def discard(self, key):
+        """応答を削除（解析できなかった応答を次回も返さないため）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM ai_responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self, now):
+        """期限切れ応答の削除と、件数上限を超えた分のLRU削除"""
+        self._conn.execute("DELETE FROM ai_responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        count = self._conn.execute("SELECT COUNT(*) FROM ai_responses").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM ai_responses WHERE rowid IN "
+                "(SELECT rowid FROM ai_responses ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def get_stats(self):
+        """ヒット・ミス件数を取得"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM ai_responses").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+    def close(self):
+        """データベース接続を閉じる"""
+        with self._lock:
+            self._conn.close()
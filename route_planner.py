@@ -0,0 +1,727 @@
+# --- route_planner.py (配車計画のパイプライン) ---
+
+import asyncio
+import functools
+import io
+import json
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import api_handler
+import async_api
+import route_solver
+import stream_parser
+from constants import (
+    CANDIDATE_CONFIG, DEFAULT_SETTINGS, ESTIMATOR_CONFIG, OPTIMIZATION_MODES, PLAN_VALIDATION_CONFIG, REPLAN_CONFIG
+)
+from location_table import diff_locations, normalize_locations
+from plan_validator import PlanValidator, count_errors, location_lookup, score_plan, validate_plan
+from prompt_builder import (
+    analyze_vehicle_requirements, get_available_vehicles_for_ai,
+    generate_prompt, generate_revision_prompt, generate_summary_prompt
+)
+from travel_estimator import nearest_neighbor_legs
+
+NO_PROMPT_MESSAGE = "（ローカルソルバーで計画したため、AIへのプロンプトはありません）"
+REPAIR_PROMPT_MESSAGE = "（前回の計画を入力の変更に合わせて修正したため、AIへのプロンプトはありません）"
+
+# 差分再計算で前回と同じである必要がない設定（AI応答の受け取り方のみに関わる）
+_REPLAN_IGNORED_SETTINGS = ("stream_response", "use_response_cache", "auto_revise")
+
+# 結果の行の列
+RESULT_COLUMNS = ["車両", "提案時間", "希望時間", "時間差", "ステータス", "地点ID", "地点コード", "地点名", "住所", "備考"]
+
+# CSV出力の列（英語ヘッダーでExcel互換性を高める）
+EXPORT_COLUMNS = [
+    'Vehicle', 'Proposed_Time', 'Desired_Time', 'Time_Difference',
+    'Status', 'Location_ID', 'Location_Code', 'Location_Name',
+    'Address', 'Remarks'
+]
+
+# 進捗表示用の段階（表示名, 全体に対する進捗率の範囲）
+PROGRESS_STAGES = {
+    'matrix': ("🗺️ 地点間の距離と時間を計算中", 0.0, 0.3),
+    'solver': ("🧮 ローカルソルバーで計画中", 0.3, 0.8),
+    'summary': ("🤖 AIがサマリーを作成中", 0.8, 1.0),
+    'ai': ("🤖 AIが最適なルートを思考中", 0.3, 0.9),
+    'revise': ("🛠️ 検証で見つかった問題をAIが修正中", 0.9, 1.0),
+    'candidates': ("🏁 複数の計画案を並列に作成中", 0.3, 1.0),
+    'repair': ("🔧 前回の計画に入力の変更を反映中", 0.3, 1.0),
+}
+
+def stage_reporter(on_progress, stage):
+    """段階内の進捗 (完了数, 全体数, 詳細) を全体の進捗率に換算してon_progress(表示名, 進捗率, 詳細)に渡す関数を作成"""
+    label, start, end = PROGRESS_STAGES[stage]
+
+    def report(done, total, detail=""):
+        if on_progress:
+            fraction = min(done / total, 1.0) if total else 1.0
+            on_progress(label, start + (end - start) * fraction, detail)
+
+    report(0, 1)
+    return report
+
+def default_settings():
+    """DEFAULT_SETTINGSを計画処理で使う設定の形式に変換"""
+    settings = {key: value for key, value in DEFAULT_SETTINGS.items() if key not in ("optimization_mode", "allow_multiple_trucks")}
+    settings["mode"] = DEFAULT_SETTINGS["optimization_mode"]
+    settings["custom_prompt"] = ""
+    return settings
+
+#======================================================================
+# 計画の各段階
+#======================================================================
+
+def departure_time(table):
+    """始点・終着フラグを確認し、最初の始点の希望出発を出発日時とする（未設定なら現在から1時間後）"""
+    if table.start_count == 0:
+        raise ValueError("始点フラグ(1)が設定されていません")
+    if table.end_count == 0:
+        raise ValueError("終着フラグ(2)が設定されていません")
+    return table.first_departure() or datetime.now() + timedelta(hours=1)
+
+def time_window_compatibility(table):
+    """地点iの次に地点jを訪問できるかのマスク（iの希望到着がjの希望出発より後なら不可。未設定は可）"""
+    arrival = table.arrival.to_numpy(dtype='datetime64[ns]')
+    departure = table.departure.to_numpy(dtype='datetime64[ns]')
+    # NaTとの比較はFalseになるため、未設定の地点は常に訪問可とみなされる
+    return ~(arrival[:, None] > departure[None, :])
+
+def candidate_leg_selector(table):
+    """近い地点間の区間に、始点からの区間と終着への区間を加えた取得候補のマスクを作る関数
+
+    候補の区間数は地点数 × (近傍数 + 2) 程度になる。
+    """
+    compatible = time_window_compatibility(table)
+
+    def select(coordinates):
+        candidates = nearest_neighbor_legs(coordinates, ESTIMATOR_CONFIG["neighbor_count"], compatible)
+        candidates[table.is_start, :] = True
+        candidates[:, table.is_end] = True
+        np.fill_diagonal(candidates, False)
+        return candidates
+
+    return select
+
+def fetch_travel_matrix(clients, table, departure_dt, use_tolls, on_wait=None, diagnostics=None, on_progress=None,
+                        provider="google_maps"):
+    """地点間の移動時間・距離を取得し、(TravelMatrix, キャッシュ統計) を返す
+
+    providerが"estimate"・"estimate_refine"の場合は緯度経度からの推定値を、"sparse"の場合は
+    近い地点間の区間のみを取得して残りを推定値で埋める。
+    Google Mapsで取得できない場合は、ESTIMATOR_CONFIG["fallback_on_error"]に従って推定値で続ける。
+    ルートが見つからない組などの警告はdiagnostics（リスト）に追加する。
+    on_progressにはタイルの取得状況 (取得済みタイル数, 全タイル数) を渡す。
+    """
+    if diagnostics is None:
+        diagnostics = []
+    if provider in ("estimate", "estimate_refine"):
+        response = api_handler.get_estimated_matrix(clients, table.records, on_wait=on_wait)
+    else:
+        response = api_handler.get_distance_matrix(
+            clients, table.records, departure_dt, use_tolls, on_wait=on_wait, on_progress=on_progress,
+            select_legs=candidate_leg_selector(table) if provider == "sparse" else None
+        )
+        if (not response or response.get('status') != 'OK') and ESTIMATOR_CONFIG["fallback_on_error"]:
+            diagnostics.extend((response or {}).get('diagnostics', []))
+            diagnostics.append({
+                'level': 'warning',
+                'message': f"Google Mapsで距離を取得できなかったため、推定値で計画します: {(response or {}).get('message', '不明なエラー')}"
+            })
+            response = api_handler.get_estimated_matrix(clients, table.records, on_wait=on_wait)
+    if response:
+        diagnostics.extend(response.get('diagnostics', []))
+    if not response or response.get('status') != 'OK':
+        raise Exception(f"Google Maps API エラー: {(response or {}).get('message', '不明なエラー')}")
+    return response['matrix'], response.get('cache_stats', {})
+
+def plan_with_solver(vehicles, all_vehicles, table, matrix, settings, departure_dt, on_progress=None, refine=None,
+                     seed=None):
+    """ローカルソルバーで計画を作成し、(結果の行, サマリー) を返す
+
+    on_progressには局所探索の状況 (周回数, 経過時間の割合, 目的関数値) を渡す。
+    refineは走行区間の一覧から補正後のマトリックスを返す関数（route_solver.plan_routesを参照）。
+    """
+    min_required, _ = analyze_vehicle_requirements(table)
+    vehicles_for_solver = get_available_vehicles_for_ai(vehicles, all_vehicles, min_required)
+    return route_solver.plan_routes(
+        table, matrix, vehicles_for_solver, settings, departure_dt, seed=seed, on_progress=on_progress,
+        refine=refine, refine_rounds=ESTIMATOR_CONFIG["refine_rounds"]
+    )
+
+def used_leg_refiner(clients, matrix, departure_dt, use_tolls, usage, diagnostics, on_wait=None, on_progress=None):
+    """推定値のマトリックスのうち、計画で走行する区間だけをGoogle Mapsの実測値に置き換える関数を作成
+
+    補正する区間がなければNoneを返す。取得件数はusageに、警告はdiagnosticsに追加する。
+    on_progressには補正するたびに (何回目の補正か（0始まり）, 補正した区間数) を渡す。
+    """
+    state = {'matrix': matrix, 'rounds': 0}
+
+    def refine(legs):
+        round_index = state['rounds']
+        state['rounds'] += 1
+        if not any(state['matrix'].estimated[i, j] for i, j in legs if i != j):
+            return None
+        response = api_handler.refine_matrix(clients, state['matrix'], legs, departure_dt, use_tolls, on_wait=on_wait)
+        diagnostics.extend(response.get('diagnostics', []))
+        if response.get('status') != 'OK':
+            diagnostics.append({
+                'level': 'warning',
+                'message': f"実測値での補正に失敗したため、推定値のまま計画します: {response.get('message', '不明なエラー')}"
+            })
+            return None
+        usage["maps"] += response['cache_stats']['misses']
+        usage["maps_cache_hits"] += response['cache_stats']['hits']
+        if on_progress:
+            on_progress(round_index, response['refined'])
+        state['matrix'] = response['matrix']
+        return state['matrix']
+
+    return refine
+
+def summarize_with_ai(clients, results, solver_summary, settings, on_wait=None):
+    """ハイブリッド：解いた計画だけをAIに渡してサマリーを依頼し、(プロンプト, AI応答) を返す"""
+    prompt = generate_summary_prompt(results, solver_summary, settings)
+    return prompt, api_handler.get_ai_route_plan(
+        clients, prompt, on_wait=on_wait, use_cache=settings.get("use_response_cache", True)
+    )
+
+def count_ai_usage(usage, ai_response):
+    """AI呼び出しの回数をusageに加算（キャッシュから返した応答は課金されないため別に数える）"""
+    if ai_response and ai_response.get('cached'):
+        usage["gemini_cache_hits"] += 1
+    else:
+        usage["gemini"] += 1
+
+def stream_ai_plan(clients, prompt, expected_items, on_progress=None, on_stream=None, use_cache=True):
+    """AI応答をストリーミングで受信し、全文を get_ai_route_plan と同じ形式で返す
+
+    on_streamには解析イベント ('summary', サマリー文) / ('item', dict) を、
+    on_progressには受信状況 (受信件数, 想定件数, 詳細) を渡す。
+    """
+    stream_response = api_handler.stream_ai_route_plan(clients, prompt, use_cache=use_cache)
+    if stream_response.get('status') != 'OK':
+        return stream_response
+
+    parser = stream_parser.RouteResponseParser()
+    for chunk in stream_response['stream']:
+        for kind, value in parser.feed(chunk):
+            if on_stream:
+                on_stream(kind, value)
+        if on_progress:
+            # 件数が想定を超えても完了までは100%にしない
+            on_progress(min(len(parser.items), expected_items - 1), expected_items, f"受信 {len(parser.buffer):,}文字 / {len(parser.items)}件")
+    parser.close()
+    return {
+        'status': 'OK', 'data': parser.buffer, 'cached': stream_response.get('cached', False),
+        'diagnostics': stream_response.get('diagnostics', [])
+    }
+
+def merge_revised_rows(results, revised):
+    """修正後の計画で、出力された車両の行のみを置き換える"""
+    replaced = {row["車両"] for row in revised}
+    return [row for row in results if row["車両"] not in replaced] + revised
+
+def revise_ai_plan(clients, prompt, results, summary, table, matrix, vehicles, settings, usage, diagnostics,
+                   on_wait=None, on_progress=None):
+    """AIの計画を検証し、違反（error）がある場合のみ該当車両の修正をAIに依頼する
+
+    修正で違反が減った場合のみ採用し、(結果の行, サマリー, 違反の一覧) を返す。
+    """
+    violations = validate_plan(results, table, matrix, vehicles, settings)
+    rounds = PLAN_VALIDATION_CONFIG["revise_rounds"] if settings.get("auto_revise", True) else 0
+    use_cache = settings.get("use_response_cache", True)
+    for _ in range(rounds):
+        errors = count_errors(violations)
+        if errors == 0:
+            break
+        stage_reporter(on_progress, 'revise')(0, 1, f"問題 {errors}件")
+        revision_prompt = generate_revision_prompt(prompt, results, violations)
+        ai_response = api_handler.get_ai_route_plan(clients, revision_prompt, on_wait=on_wait, use_cache=use_cache)
+        count_ai_usage(usage, ai_response)
+        diagnostics.extend((ai_response or {}).get('diagnostics', []))
+        if not ai_response or ai_response.get('status') != 'OK':
+            break
+        revised, revised_summary = process_ai_response(ai_response, table.records)
+        if not revised:
+            if use_cache:
+                api_handler.discard_cached_response(clients, revision_prompt)
+            break
+
+        merged = merge_revised_rows(results, revised)
+        merged_violations = validate_plan(merged, table, matrix, vehicles, settings)
+        if count_errors(merged_violations) >= errors:
+            diagnostics.append({'level': 'info', 'message': "AIの修正案では問題が減らなかったため、元の計画を表示します"})
+            break
+        diagnostics.append({
+            'level': 'info',
+            'message': f"検証で見つかった{errors}件の問題をAIが修正しました（残り{count_errors(merged_violations)}件）"
+        })
+        results, violations = merged, merged_violations
+        if revised_summary:
+            summary = f"{summary}\n\n【自動修正】\n{revised_summary}"
+    return results, summary, violations
+
+async def _solver_candidate(vehicles, all_vehicles, table, matrix, settings, departure_dt, seed):
+    """ローカルソルバーの計画案（計算はスレッドで実行）"""
+    loop = asyncio.get_running_loop()
+    results, summary = await loop.run_in_executor(None, functools.partial(
+        plan_with_solver, vehicles, all_vehicles, table, matrix, settings, departure_dt, seed=seed
+    ))
+    return {'results': results, 'summary': summary, 'cached': False}
+
+async def _ai_candidate(clients, prompt, temperature, table, use_cache):
+    """AIの計画案（応答を解析できなければ例外）"""
+    ai_response = await api_handler.generate_ai_route_plan(clients, prompt, use_cache=use_cache, temperature=temperature)
+    if ai_response.get('status') != 'OK':
+        raise Exception(f"Gemini API エラー: {ai_response.get('message', '不明なエラー')}")
+    results, summary = process_ai_response(ai_response, table.records)
+    if not results:
+        if use_cache:
+            api_handler.discard_cached_response(clients, prompt, temperature)
+        raise ValueError(summary.split("\n")[0])
+    return {'results': results, 'summary': summary, 'cached': ai_response.get('cached', False)}
+
+async def _scored_candidate(candidate, validator, settings):
+    """計画案を作成して検証・採点する（検証はイベントループを止めないようスレッドで実行）"""
+    result = await candidate
+    loop = asyncio.get_running_loop()
+    violations, metrics = await loop.run_in_executor(None, validator.evaluate, result['results'])
+    return dict(result, violations=violations, metrics=metrics, score=score_plan(metrics, settings))
+
+def plan_candidates(clients, vehicles, all_vehicles, table, matrix, settings, departure_dt, usage, diagnostics,
+                    on_wait=None, on_progress=None):
+    """AI・ローカルソルバーの複数の計画案を並列に作成し、マトリックスで採点した最良案を返す
+
+    案はCANDIDATE_CONFIGの組み合わせで作成し、全体の制限時間を過ぎた時点、またはソルバーの最良案と
+    同等以上（good_enough_margin以内）で違反のないAIの案が届いた時点で、残りの案を打ち切る。
+    採点はplan_validator.score_planで、画面で選んだ最適化目標の重みを使う。
+    on_progressには (完了した案の数, 案の総数, 詳細) を渡す。
+    戻り値は (結果の行, サマリー, プロンプト, 違反の一覧)。
+    """
+    min_required, _ = analyze_vehicle_requirements(table)
+    validator = PlanValidator(table, matrix, get_available_vehicles_for_ai(vehicles, all_vehicles, min_required), settings)
+    use_cache = settings.get("use_response_cache", True)
+    compatible = time_window_compatibility(table)
+
+    coros, labels, prompts = {}, {}, {}
+    for number, variant in enumerate(CANDIDATE_CONFIG["solver_variants"], start=1):
+        mode = variant.get("mode", settings["mode"])
+        name = f"solver{number}"
+        seed = variant.get("seed")
+        labels[name] = f"ローカルソルバー{number}（{OPTIMIZATION_MODES.get(mode, mode)}・{'シードなし' if seed is None else f'シード{seed}'}）"
+        coros[name] = _scored_candidate(
+            _solver_candidate(vehicles, all_vehicles, table, matrix, {**settings, "mode": mode}, departure_dt, seed),
+            validator, settings
+        )
+    if clients.gemini:
+        for number, variant in enumerate(CANDIDATE_CONFIG["ai_variants"], start=1):
+            # カスタムプロンプトはお客様の指示そのものなので、最適化目標を変えない
+            mode = settings["mode"] if settings["mode"] == "mode4" else variant.get("mode", settings["mode"])
+            name = f"ai{number}"
+            temperature = variant.get("temperature")
+            labels[name] = f"AI{number}（{OPTIMIZATION_MODES.get(mode, mode)}・temperature {temperature}）"
+            prompts[name] = generate_prompt(
+                vehicles, all_vehicles, table, matrix, {**settings, "mode": mode},
+                candidates=compatible, diagnostics=diagnostics if number == 1 else None
+            )
+            coros[name] = _scored_candidate(
+                _ai_candidate(clients, prompts[name], temperature, table, use_cache), validator, settings
+            )
+    else:
+        diagnostics.append({'level': 'info', 'message': "Gemini APIが使えないため、ローカルソルバーの案のみから選びます"})
+
+    scored = {}
+    solver_names = [name for name in coros if name.startswith("solver")]
+
+    def on_done(name, result):
+        if not isinstance(result, Exception):
+            scored[name] = result
+        if on_progress:
+            on_progress(len(finished_names) + 1, len(coros), f"{labels[name]} 完了")
+        finished_names.append(name)
+
+    def is_good(name, result):
+        # ソルバーの案がすべて揃ってから、それと同等以上で違反のないAIの案があるかを判定する
+        solver_scores = [scored[n]['score'] for n in solver_names if n in scored]
+        if not all(n in finished_names for n in solver_names) or not solver_scores:
+            return False
+        target = min(solver_scores) * (1 + CANDIDATE_CONFIG["good_enough_margin"])
+        return any(
+            candidate['metrics']['errors'] == 0 and candidate['score'] <= target
+            for n, candidate in scored.items() if n.startswith("ai")
+        )
+
+    finished_names = []
+    finished, cancelled = async_api.run(
+        async_api.race(coros, timeout=CANDIDATE_CONFIG["time_budget_seconds"], is_good=is_good, on_done=on_done),
+        on_wait=on_wait
+    )
+
+    for name in prompts:
+        if name in scored and scored[name]['cached']:
+            usage["gemini_cache_hits"] += 1
+        else:
+            # 打ち切った依頼も送信済みのため回数に含める
+            usage["gemini"] += 1
+
+    if not scored:
+        failures = "、".join(f"{labels[name]}: {result}" for name, result in finished)
+        raise Exception(f"計画案を作成できませんでした（{failures or '制限時間切れ'}）")
+
+    best = min(scored, key=lambda name: scored[name]['score'])
+    lines = [f"{len(coros)}案のうち{len(scored)}案を比較し、{labels[best]}の案を採用しました。"]
+    for name, result in finished:
+        if name in scored:
+            metrics = scored[name]['metrics']
+            lines.append(
+                f"- {labels[name]}: 評価値{scored[name]['score'] / 60:,.0f} / 走行{metrics['drive_seconds'] / 3600:.1f}時間"
+                f"・{metrics['drive_meters'] / 1000:.1f}km / 遅れ{metrics['lateness_seconds'] / 60:.0f}分"
+                f" / {metrics['vehicles']}台 / 問題{metrics['errors']}件"
+            )
+        else:
+            lines.append(f"- {labels[name]}: 失敗（{result}）")
+    if cancelled:
+        lines.append(f"- 打ち切り: {'、'.join(labels[name] for name in cancelled)}")
+    diagnostics.append({'level': 'info', 'message': "\n".join(lines)})
+
+    chosen = scored[best]
+    return chosen['results'], chosen['summary'], prompts.get(best, NO_PROMPT_MESSAGE), chosen['violations']
+
+def plan_route(clients, vehicles, all_vehicles, table, settings, on_wait=None, on_progress=None, on_stream=None):
+    """配送先データから運行計画を作成する（Streamlitに依存しない一連の処理）
+
+    clientsはセッションのAPIクライアント（api_handler.ApiClients）。
+
+    戻り値は {'results', 'summary', 'prompt', 'diagnostics', 'violations', 'usage', 'basis'}。
+    diagnosticsは警告・エラーの一覧 [{'level', 'message'}]（表示は呼び出し側で行う）。
+    violationsは計画の検証で見つかった違反の一覧（plan_validator。ローカルソルバーのみの場合は空）。
+    usageはAPI呼び出し回数 {'gemini', 'gemini_cache_hits', 'maps', 'maps_cache_hits'}（mapsは取得した要素数と
+    ジオコーディング件数。キャッシュから取得した組・応答は含めない）。
+    basisは差分再計算（replan_route）に使う計画時の入力とマトリックス。
+    on_progressは段階が進むたびに (段階の表示名, 全体の進捗率0〜1, 詳細) で呼ばれる。
+    settings["stream_response"]が有効な場合、AI応答の解析イベントをon_streamに渡す。
+    """
+    usage = {"gemini": 0, "gemini_cache_hits": 0, "maps": 0, "maps_cache_hits": 0}
+    diagnostics = []
+    violations = []
+
+    departure_dt = departure_time(table)
+    provider = settings.get("matrix_provider", "google_maps")
+    report = stage_reporter(on_progress, 'matrix')
+    matrix, cache_stats = fetch_travel_matrix(
+        clients, table, departure_dt, settings["use_tolls"], on_wait=on_wait, diagnostics=diagnostics,
+        on_progress=lambda done, total: report(done, total, f"タイル {done}/{total}"), provider=provider
+    )
+    usage["maps"] += cache_stats.get('misses', 0) + cache_stats.get('geocode_requests', 0)
+    usage["maps_cache_hits"] += cache_stats.get('hits', 0)
+
+    if settings.get("route_engine") == "multi":
+        results, summary, prompt, violations = plan_candidates(
+            clients, vehicles, all_vehicles, table, matrix, settings, departure_dt, usage, diagnostics,
+            on_wait=on_wait, on_progress=stage_reporter(on_progress, 'candidates')
+        )
+    elif settings.get("route_engine") == "local":
+        report = stage_reporter(on_progress, 'solver')
+        refine = None
+        # 補正の各回までを1区切りとし、局所探索の経過はその区切りの中で進める
+        refine_rounds = ESTIMATOR_CONFIG["refine_rounds"]
+        progress = {'rounds_done': 0, 'rounds': 1}
+        if provider in ("estimate_refine", "sparse") and refine_rounds > 0:
+            progress['rounds'] = refine_rounds
+
+            def on_refined(round_index, refined):
+                progress['rounds_done'] = round_index + 1
+                report(round_index + 1, refine_rounds, f"走行する{refined}区間を実測値で補正（{round_index + 1}/{refine_rounds}回目）")
+
+            refine = used_leg_refiner(
+                clients, matrix, departure_dt, settings["use_tolls"], usage, diagnostics, on_wait=on_wait,
+                on_progress=on_refined
+            )
+        results, summary = plan_with_solver(
+            vehicles, all_vehicles, table, matrix, settings, departure_dt,
+            on_progress=lambda iteration, elapsed, cost: report(
+                progress['rounds_done'] + elapsed, progress['rounds'], f"改善 {iteration}周目"
+            ),
+            refine=refine
+        )
+        prompt = NO_PROMPT_MESSAGE
+        if settings["mode"] == "mode5":
+            stage_reporter(on_progress, 'summary')
+            prompt, ai_response = summarize_with_ai(clients, results, summary, settings, on_wait=on_wait)
+            count_ai_usage(usage, ai_response)
+            diagnostics.extend((ai_response or {}).get('diagnostics', []))
+            if ai_response and ai_response.get('status') == 'OK':
+                summary = ai_response['data'].strip()
+            else:
+                diagnostics.append({
+                    'level': 'warning',
+                    'message': f"AIサマリーの作成に失敗したため、ソルバーのサマリーを表示します: {(ai_response or {}).get('message', '不明なエラー')}"
+                })
+    else:
+        prompt = generate_prompt(
+            vehicles, all_vehicles, table, matrix, settings,
+            candidates=time_window_compatibility(table), diagnostics=diagnostics
+        )
+        report = stage_reporter(on_progress, 'ai')
+        use_cache = settings.get("use_response_cache", True)
+        if settings.get("stream_response"):
+            # 運行計画は地点ごとの到着と移動でおおよそ地点数の2倍の件数になる
+            ai_response = stream_ai_plan(
+                clients, prompt, max(2 * len(table), 2), on_progress=report, on_stream=on_stream, use_cache=use_cache
+            )
+        else:
+            ai_response = api_handler.get_ai_route_plan(clients, prompt, on_wait=on_wait, use_cache=use_cache)
+        count_ai_usage(usage, ai_response)
+        diagnostics.extend((ai_response or {}).get('diagnostics', []))
+        if not ai_response or ai_response.get('status') != 'OK':
+            raise Exception(f"Gemini API エラー: {(ai_response or {}).get('message', '不明なエラー')}")
+        results, summary = process_ai_response(ai_response, table.records)
+        if not results and use_cache:
+            # 解析できなかった応答は、再計算で再びキャッシュから返さない
+            api_handler.discard_cached_response(clients, prompt)
+        if results:
+            min_required, _ = analyze_vehicle_requirements(table)
+            results, summary, violations = revise_ai_plan(
+                clients, prompt, results, summary, table, matrix,
+                get_available_vehicles_for_ai(vehicles, all_vehicles, min_required), settings, usage, diagnostics,
+                on_wait=on_wait, on_progress=on_progress
+            )
+
+    report_plan_errors(violations, diagnostics)
+    return {
+        'results': results, 'summary': summary, 'prompt': prompt, 'diagnostics': diagnostics,
+        'violations': violations, 'usage': usage,
+        'basis': plan_basis(vehicles, all_vehicles, table, matrix, settings, departure_dt)
+    }
+
+def report_plan_errors(violations, diagnostics):
+    """検証で見つかった問題（error）の先頭5件を警告としてdiagnosticsに追加"""
+    errors = [violation for violation in violations if violation['level'] == 'error']
+    if errors:
+        shown = "\n".join(f"- {violation['message']}" for violation in errors[:5])
+        more = f"\n- ほか{len(errors) - 5}件" if len(errors) > 5 else ""
+        diagnostics.append({'level': 'warning', 'message': f"計画に{len(errors)}件の問題があります:\n{shown}{more}"})
+
+#======================================================================
+# 差分再計算
+#======================================================================
+
+def plan_basis(vehicles, all_vehicles, table, matrix, settings, departure_dt):
+    """差分再計算に使う、計画時の入力とマトリックス"""
+    return {
+        'locations': table.records, 'matrix': matrix, 'vehicles': vehicles.copy(),
+        'all_vehicles': pd.DataFrame(all_vehicles), 'settings': dict(settings), 'departure': departure_dt
+    }
+
+def _replan_blocker(basis, vehicles, all_vehicles, table, settings, changes):
+    """前回の計画を修正できない理由（修正できる場合はNone）"""
+    if basis is None:
+        return "前回の計画がない"
+    ignored = set(_REPLAN_IGNORED_SETTINGS)
+    if {k: v for k, v in settings.items() if k not in ignored} != {k: v for k, v in basis['settings'].items() if k not in ignored}:
+        return "計画条件が前回と異なる"
+    if not vehicles.equals(basis['vehicles']) or not pd.DataFrame(all_vehicles).equals(basis['all_vehicles']):
+        return "車両が前回と異なる"
+    first_departure = table.first_departure()
+    if first_departure is not None and first_departure != basis['departure']:
+        return "出発日時が前回と異なる"
+    changed = len(changes['added']) + len(changes['removed']) + len(changes['changed'])
+    if changed == 0:
+        return "入力に変更がない"
+    if changed > REPLAN_CONFIG["max_changed_ratio"] * len(table):
+        return f"変更された地点が多い（{changed}地点）"
+    return None
+
+def previous_routes(results, locations, kept):
+    """前回の結果の行から車両ごとの訪問順を復元し、今回の地点の位置に置き換える
+
+    kept {前回の位置: 今回の位置} にない地点（削除・変更された地点）は除き、その前後の地点を
+    変更箇所として返す。戻り値は ({車両名: [今回の位置]}, 変更箇所の今回の位置の集合)。
+    """
+    locate = location_lookup(normalize_locations(locations))
+    routes, focus = {}, set()
+    dropped = {}
+    for row in results:
+        if row.get("ステータス") != "到着":
+            continue
+        vehicle = row["車両"]
+        route = routes.setdefault(vehicle, [])
+        index = kept.get(locate(row))
+        if index is None:
+            dropped[vehicle] = True
+            if route:
+                focus.add(route[-1])
+            continue
+        if dropped.pop(vehicle, False):
+            focus.add(index)
+        route.append(index)
+    return routes, focus
+
+def replan_route(clients, previous, vehicles, all_vehicles, table, settings, on_wait=None, on_progress=None,
+                 on_stream=None):
+    """前回の計画 previous（plan_routeの戻り値）を、入力の変更に合わせて修正する
+
+    地点以外の条件（車両・設定・出発日時）が前回と同じで、変更された地点が一部だけの場合は、
+    前回の住所同士の距離・移動時間を再利用して追加された住所の行・列のみを取得し、前回の訪問順に
+    ローカルソルバーの挿入・局所探索で変更を反映する（AIは呼び出さない）。
+    条件が変わった場合や変更が多い場合は、plan_routeで全体を計画し直す。戻り値はplan_routeと同じ形式。
+    """
+    basis = (previous or {}).get('basis')
+    changes = diff_locations(basis['locations'], table.records) if basis else None
+    reason = _replan_blocker(basis, vehicles, all_vehicles, table, settings, changes)
+    if reason:
+        plan = plan_route(
+            clients, vehicles, all_vehicles, table, settings, on_wait=on_wait, on_progress=on_progress, on_stream=on_stream
+        )
+        plan['diagnostics'].insert(0, {'level': 'info', 'message': f"{reason}ため、全体を計画し直しました"})
+        return plan
+
+    usage = {"gemini": 0, "gemini_cache_hits": 0, "maps": 0, "maps_cache_hits": 0}
+    diagnostics = []
+    departure_dt = basis['departure']
+    provider = settings.get("matrix_provider", "google_maps")
+    report = stage_reporter(on_progress, 'matrix')
+    response = api_handler.extend_distance_matrix(
+        clients, basis['matrix'], table.records, departure_dt, settings["use_tolls"], on_wait=on_wait,
+        on_progress=lambda done, total: report(done, total, f"タイル {done}/{total}"),
+        select_legs=candidate_leg_selector(table) if provider == "sparse" else None,
+        estimate_only=provider in ("estimate", "estimate_refine")
+    )
+    diagnostics.extend(response.get('diagnostics', []))
+    if response.get('status') != 'OK':
+        raise Exception(f"Google Maps API エラー: {response.get('message', '不明なエラー')}")
+    matrix = response['matrix']
+    usage["maps"] += response['cache_stats']['misses'] + response['cache_stats']['geocode_requests']
+    usage["maps_cache_hits"] += response['cache_stats']['hits']
+
+    report = stage_reporter(on_progress, 'repair')
+    kept = {old: new for new, old in changes['unchanged'].items()}
+    routes, focus = previous_routes(previous['results'], basis['locations'], kept)
+    refine = None
+    if provider in ("estimate_refine", "sparse"):
+        refine = used_leg_refiner(
+            clients, matrix, departure_dt, settings["use_tolls"], usage, diagnostics, on_wait=on_wait,
+            on_progress=lambda round_index, refined: report(round_index + 1, 1, f"走行する{refined}区間を実測値で補正")
+        )
+    min_required, _ = analyze_vehicle_requirements(table)
+    vehicles_for_solver = get_available_vehicles_for_ai(vehicles, all_vehicles, min_required)
+    results, summary = route_solver.repair_routes(
+        table, matrix, vehicles_for_solver, settings, departure_dt, routes, focus=focus, refine=refine
+    )
+    report(1, 1)
+    summary += (
+        f"\n【差分再計算】前回の計画に、追加{len(changes['added'])}地点・削除{len(changes['removed'])}地点"
+        f"・条件変更{len(changes['changed'])}地点を反映しました。"
+    )
+
+    violations = validate_plan(results, table, matrix, vehicles_for_solver, settings)
+    report_plan_errors(violations, diagnostics)
+    return {
+        'results': results, 'summary': summary, 'prompt': REPAIR_PROMPT_MESSAGE, 'diagnostics': diagnostics,
+        'violations': violations, 'usage': usage,
+        'basis': plan_basis(vehicles, all_vehicles, table, matrix, settings, departure_dt)
+    }
+
+#======================================================================
+# AI応答の解析
+#======================================================================
+
+def process_ai_response(ai_response, locations):
+    # AI応答の処理（CSV出力バグ修正版）
+    raw_data = ai_response.get('data', '')
+    summary_text, _, json_part = raw_data.partition('---')
+    summary_text = summary_text.strip()
+    json_part = json_part.strip()
+
+    try:
+        json_str_match = re.search(r'```json\n(.*?)\n```', json_part, re.DOTALL)
+        json_str = json_str_match.group(1) if json_str_match else json_part
+
+        if not (json_str and json_str.strip().startswith('[')):
+            return [], f"AI応答のJSON解析エラー: JSONデータが見つかりません。\n\n{raw_data}"
+
+        data = json.loads(json_str)
+        while isinstance(data, list) and len(data) == 1 and isinstance(data[0], list):
+            data = data[0]
+
+    except json.JSONDecodeError as e:
+        return [], f"AI応答のJSON解析に失敗しました（{e}）。AIの出力形式が不正な可能性があります。\n\n---受信データ---\n{raw_data}"
+
+    if not isinstance(data, list):
+        return [], f"AI応答データがリスト形式ではありません"
+
+    return normalize_ai_items(data, locations), summary_text
+
+def normalize_ai_items(data, locations):
+    # AIが出力した運行計画オブジェクトを結果表示・CSV出力用の行に正規化
+    address_map = {loc.get("地点コード"): loc.get("住所") for loc in locations if loc.get("地点コード")}
+    processed_data = []
+
+    for i, item in enumerate(data):
+        if not isinstance(item, dict): 
+            continue
+
+        # 移動ステータスの場合、次の到着ステータスを探して時間範囲を生成する
+        status = item.get('status', '')
+        proposed_time_str = item.get('proposed_time', '')
+
+        if status in ['移動', 'フェリー移動'] and proposed_time_str:
+            start_time = proposed_time_str
+            end_time = ""
+            # 次の到着イベントを探す
+            for next_item in data[i+1:]:
+                if next_item.get('status', '') in ['到着', 'フェリー乗船', 'フェリー下船']:
+                    end_time = next_item.get('proposed_time', '')
+                    break
+
+            if end_time:
+                # 提案時間を「開始時間 - 終了時間」の形式に更新
+                item['proposed_time'] = f"{start_time} - {end_time}"
+
+        # データの正規化（CSV出力対応）
+        processed_item = {
+            "車両": str(item.get('d', 'トラック1')).strip(), 
+            "提案時間": str(item.get('proposed_time', '')).strip(), 
+            "希望時間": str(item.get('desired_time', '')).strip(), 
+            "時間差": str(item.get('time_difference', '')).strip(), 
+            "ステータス": str(item.get('status', '')).strip(), 
+            "地点ID": str(item.get('location_id', '')).strip(), 
+            "地点コード": str(item.get('name_code', '')).strip(), 
+            "地点名": str(item.get('location_name', '')).strip(), 
+            "住所": str(address_map.get(item.get('name_code', ''), '')).strip(), 
+            "備考": str(item.get('remarks', '')).strip()
+        }
+        
+        # 空のデータや重複データをスキップ
+        if processed_item["車両"] and processed_item["ステータス"]:
+            processed_data.append(processed_item)
+
+    return processed_data
+
+#======================================================================
+# 結果の出力
+#======================================================================
+
+def results_to_export_frame(results):
+    """結果の行をCSV出力用のDataFrameに変換（英語ヘッダー）"""
+    df_export = pd.DataFrame(results, columns=RESULT_COLUMNS)
+    
+    # 時間データの正規化
+    df_export['提案時間'] = df_export['提案時間'].astype(str)
+    df_export['希望時間'] = df_export['希望時間'].astype(str)
+    df_export['時間差'] = df_export['時間差'].astype(str)
+    
+    # NaN値の処理
+    df_export = df_export.fillna('')
+    df_export.columns = EXPORT_COLUMNS
+    return df_export
+
+def export_csv_bytes(results):
+    """結果の行をBOM付きUTF-8のCSVに変換（Excel対応）"""
+    csv_buffer = io.StringIO()
+    results_to_export_frame(results).to_csv(csv_buffer, index=False)
+    return ('\ufeff' + csv_buffer.getvalue()).encode('utf-8')
@@ -0,0 +1,581 @@
+# --- route_solver.py (ローカル配車計画ソルバー) ---
+
+import math
+import random
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from constants import REPLAN_CONFIG, SOLVER_CONFIG
+
+# ルートが見つからない区間の移動時間・距離（実質的に使用不可）
+UNREACHABLE = 10 ** 7
+
+def _format_time(dt):
+    return dt.strftime("%Y/%m/%d %H:%M")
+
+def _format_difference(seconds):
+    """提案時刻と希望時刻の差を「+HH:MM」形式に変換"""
+    sign = "+" if seconds >= 0 else "-"
+    minutes = int(abs(seconds) // 60)
+    return f"{sign}{minutes // 60:02d}:{minutes % 60:02d}"
+
+def _to_float(value):
+    try:
+        number = float(value)
+    except (ValueError, TypeError):
+        return 0.0
+    return 0.0 if math.isnan(number) else number
+
+def _matrix_to_lists(matrix):
+    """TravelMatrixを移動時間(秒)・距離(m)の二次元リストに変換（ルートなしはUNREACHABLE）"""
+    reachable = matrix.reachable
+    np.fill_diagonal(reachable, True)
+    durations = np.where(reachable, matrix.seconds, UNREACHABLE)
+    distances = np.where(reachable, matrix.meters, UNREACHABLE)
+    np.fill_diagonal(durations, 0)
+    np.fill_diagonal(distances, 0)
+    return durations.tolist(), distances.tolist()
+
+class RoutingProblem:
+    """配送先データ(LocationTable)と距離マトリックス(TravelMatrix)から時間枠付き配車問題を組み立てる
+
+    始点フラグ(1)の最初の地点から出発し、終着フラグ(2)の最初の地点で終わる片道輸送として扱う。
+    始点・終着での積み降ろしは全車両で分担するものとして容量判定から除外する。
+    """
+
+    def __init__(self, table, matrix, vehicles, settings, start_time):
+        locations = table.records
+        self.locations = locations
+        self.start_time = start_time
+        size = len(locations)
+        self.durations, self.distances = _matrix_to_lists(matrix)
+
+        start_indices = np.flatnonzero(table.is_start)
+        end_indices = np.flatnonzero(table.is_end)
+        if len(start_indices) == 0 or len(end_indices) == 0:
+            raise ValueError("始点フラグ(1)と終着フラグ(2)の両方が必要です")
+        self.depot = int(start_indices[0])
+        self.terminal = int(end_indices[0])
+        self.stops = [i for i in range(size) if i not in (self.depot, self.terminal)]
+
+        # 時刻は出発基準時刻からの秒数で扱う（希望到着・希望出発はLocationTableで解析済みの列を使う）
+        origin = pd.Timestamp(start_time)
+        ready = (table.arrival - origin).dt.total_seconds()
+        due = (table.departure - origin).dt.total_seconds()
+        self.ready = [None if pd.isna(value) else value for value in ready]
+        self.due = [None if pd.isna(value) else value for value in due]
+        default_service = SOLVER_CONFIG["default_service_minutes"] * 60
+        self.service = [0] * size
+        for i in range(size):
+            if self.ready[i] is not None and self.due[i] is not None:
+                self.service[i] = max(0, self.due[i] - self.ready[i])
+            elif i != self.depot:
+                self.service[i] = default_service
+
+        self.pickup_weight = [_to_float(loc.get("積み込み重量")) for loc in locations]
+        self.pickup_volume = [_to_float(loc.get("積み込み容量")) for loc in locations]
+        self.drop_weight = [_to_float(loc.get("荷下ろし重量")) for loc in locations]
+        self.drop_volume = [_to_float(loc.get("荷下ろし容量")) for loc in locations]
+
+        if isinstance(vehicles, pd.DataFrame):
+            vehicles = vehicles.to_dict('records')
+        if not vehicles:
+            raise ValueError("利用可能な車両がありません")
+        self.vehicles = []
+        for index, vehicle in enumerate(vehicles):
+            self.vehicles.append({
+                "id": str(vehicle.get("車両ID") or f"トラック{index + 1}"),
+                "weight": _to_float(vehicle.get("最大積載重量")) or float("inf"),
+                "volume": _to_float(vehicle.get("最大積載容量")) or float("inf"),
+            })
+
+        # 労働条件（連続運転・1日拘束）
+        self.continuous_limit = None
+        self.rest_seconds = 0
+        if settings.get("continuous_limit") and settings.get("continuous_hours"):
+            self.continuous_limit = settings["continuous_hours"] * 3600
+            self.rest_seconds = settings.get("rest_minutes", 30) * 60
+        self.daily_limit = None
+        if settings.get("daily_limit") and settings.get("daily_hours"):
+            self.daily_limit = settings["daily_hours"] * 3600
+
+        # 最適化目標ごとの重み（mode2は距離、その他は時間を移動コストとする）
+        weights = SOLVER_CONFIG["mode_weights"].get(settings.get("mode"), SOLVER_CONFIG["mode_weights"]["mode1"])
+        self.lateness_weight = weights["lateness"]
+        self.overtime_weight = SOLVER_CONFIG["overtime_weight"]
+        self.capacity_weight = SOLVER_CONFIG["capacity_weight"]
+        self.vehicle_cost = SOLVER_CONFIG["vehicle_fixed_cost_minutes"] * 60
+        if weights["use_distance"]:
+            # 距離(m)を時速36kmで秒換算し、時間ペナルティと比較できる尺度にそろえる
+            self.cost = [[d / 10.0 for d in row] for row in self.distances]
+        else:
+            self.cost = [[float(d) for d in row] for row in self.durations]
+
+        # 近傍リスト（局所探索の対象を近い地点に限定する）
+        neighbor_count = SOLVER_CONFIG["neighbor_count"]
+        self.neighbors = [[] for _ in range(size)]
+        for i in self.stops:
+            candidates = [j for j in self.stops if j != i]
+            candidates.sort(key=lambda j: min(self.cost[i][j], self.cost[j][i]))
+            self.neighbors[i] = candidates[:neighbor_count]
+
+    def _drive(self, elapsed, driven, leg):
+        """連続運転制限を考慮して1区間を走行し、(経過時刻, 連続運転時間)を返す"""
+        if self.continuous_limit and driven + leg > self.continuous_limit:
+            rests = int((driven + leg - 1) // self.continuous_limit)
+            return elapsed + leg + rests * self.rest_seconds, driven + leg - rests * self.continuous_limit
+        return elapsed + leg, driven + leg
+
+    def evaluate(self, route, vehicle_index):
+        """ルートのコストを(移動コスト, 違反ペナルティ)で返す"""
+        if not route:
+            return 0.0, 0.0
+
+        depot, terminal = self.depot, self.terminal
+        durations, cost = self.durations, self.cost
+        ready, due, service = self.ready, self.due, self.service
+        rest_seconds = self.rest_seconds
+
+        duty_start = min(0, ready[depot]) if ready[depot] is not None else 0
+        elapsed, driven, lateness = 0, 0, 0.0
+        travel = float(self.vehicle_cost)
+        prev = depot
+        for cur in route + [terminal]:
+            travel += cost[prev][cur]
+            elapsed, driven = self._drive(elapsed, driven, durations[prev][cur])
+            if ready[cur] is not None:
+                if elapsed < ready[cur]:
+                    if rest_seconds and ready[cur] - elapsed >= rest_seconds:
+                        driven = 0
+                    elapsed = ready[cur]
+                else:
+                    lateness += elapsed - ready[cur]
+            if cur != terminal:
+                elapsed += service[cur]
+                if rest_seconds and service[cur] >= rest_seconds:
+                    driven = 0
+                if ready[cur] is None and due[cur] is not None and elapsed > due[cur]:
+                    lateness += elapsed - due[cur]
+            prev = cur
+
+        penalty = self.lateness_weight * lateness
+        if self.daily_limit and elapsed - duty_start > self.daily_limit:
+            penalty += self.overtime_weight * (elapsed - duty_start - self.daily_limit)
+        penalty += self.capacity_weight * self._capacity_excess(route, vehicle_index)
+        return travel, penalty
+
+    def _capacity_excess(self, route, vehicle_index):
+        """積載量の超過率（積載上限に対する超過の割合の合計）"""
+        vehicle = self.vehicles[vehicle_index]
+        weight = sum(self.drop_weight[i] for i in route)
+        volume = sum(self.drop_volume[i] for i in route)
+        max_weight, max_volume = weight, volume
+        for i in route:
+            weight += self.pickup_weight[i] - self.drop_weight[i]
+            volume += self.pickup_volume[i] - self.drop_volume[i]
+            max_weight = max(max_weight, weight)
+            max_volume = max(max_volume, volume)
+        excess = 0.0
+        if max_weight > vehicle["weight"]:
+            excess += (max_weight - vehicle["weight"]) / vehicle["weight"]
+        if max_volume > vehicle["volume"]:
+            excess += (max_volume - vehicle["volume"]) / vehicle["volume"]
+        return excess
+
+class Solution:
+    """車両ごとの訪問順（地点インデックスのリスト）とそのコスト"""
+
+    def __init__(self, problem, routes):
+        self.problem = problem
+        self.routes = routes
+        self.costs = [problem.evaluate(route, v) for v, route in enumerate(routes)]
+
+    def total(self):
+        return sum(travel + penalty for travel, penalty in self.costs)
+
+    def copy(self):
+        clone = Solution.__new__(Solution)
+        clone.problem = self.problem
+        clone.routes = [list(route) for route in self.routes]
+        clone.costs = list(self.costs)
+        return clone
+
+    def try_replace(self, changes):
+        """{車両: 新ルート} を評価し、総コストが下がる場合のみ反映する"""
+        new_costs = {v: self.problem.evaluate(route, v) for v, route in changes.items()}
+        old_total = sum(sum(self.costs[v]) for v in changes)
+        new_total = sum(sum(c) for c in new_costs.values())
+        if new_total < old_total - 1e-6:
+            for v, route in changes.items():
+                self.routes[v] = route
+                self.costs[v] = new_costs[v]
+            return True
+        return False
+
+def _insert_cheapest(problem, routes, costs, stop):
+    """stopを総コストの増分が最も小さい車両・位置に挿入する（routes・costsを更新）"""
+    cost = problem.cost
+    depot, terminal = problem.depot, problem.terminal
+    best = None
+    for v, route in enumerate(routes):
+        seq = [depot] + route + [terminal]
+        # 移動コストの増分が小さい位置だけを詳細評価する
+        positions = sorted(
+            range(len(seq) - 1),
+            key=lambda p: cost[seq[p]][stop] + cost[stop][seq[p + 1]] - cost[seq[p]][seq[p + 1]]
+        )[:SOLVER_CONFIG["insertion_candidates"]]
+        for p in positions:
+            candidate = route[:p] + [stop] + route[p:]
+            travel, penalty = problem.evaluate(candidate, v)
+            delta = travel + penalty - sum(costs[v])
+            if best is None or delta < best[0]:
+                best = (delta, v, candidate, (travel, penalty))
+    _, v, candidate, candidate_cost = best
+    routes[v] = candidate
+    costs[v] = candidate_cost
+
+def _arrival_order(problem, stops):
+    """希望到着時刻順（未設定の地点は最後）"""
+    return sorted(stops, key=lambda i: (problem.ready[i] is None, problem.ready[i] or 0))
+
+def _append_cheapest(problem, routes, stop):
+    """stopを、ルート末尾に追加したときの移動コストの増分が最も小さい車両に追加する（評価は行わない）"""
+    cost = problem.cost
+    terminal = problem.terminal
+    lasts = [route[-1] if route else problem.depot for route in routes]
+    v = min(range(len(routes)), key=lambda v: cost[lasts[v]][stop] + cost[stop][terminal] - cost[lasts[v]][terminal])
+    routes[v].append(stop)
+
+def _construct(problem, rng=None, deadline=None):
+    """希望到着時刻順に、最も安い位置へ挿入していく構築法
+
+    deadlineを過ぎた場合、残りの地点は挿入位置を評価せずにルートの末尾へ追加する（改善は局所探索に任せる）。
+    """
+    routes = [[] for _ in problem.vehicles]
+    costs = [(0.0, 0.0) for _ in problem.vehicles]
+    order = list(problem.stops)
+    if rng is not None:
+        rng.shuffle(order)
+    for stop in _arrival_order(problem, order):
+        if deadline is not None and time.perf_counter() > deadline:
+            _append_cheapest(problem, routes, stop)
+        else:
+            _insert_cheapest(problem, routes, costs, stop)
+    return Solution(problem, routes)
+
+def _locate(solution):
+    """地点インデックス → (車両, ルート内位置) の対応表"""
+    position = {}
+    for v, route in enumerate(solution.routes):
+        for p, stop in enumerate(route):
+            position[stop] = (v, p)
+    return position
+
+def _relocate_segment(solution, length, deadline):
+    """長さlengthの区間を近傍地点の前後へ移動（length=1でrelocate、2〜3でor-opt）"""
+    problem = solution.problem
+    improved = False
+    for stop in problem.stops:
+        if time.perf_counter() > deadline:
+            break
+        if _move_segment(solution, stop, length, _locate(solution)):
+            improved = True
+    return improved
+
+def _move_segment(solution, stop, length, position):
+    """stopから始まる区間を、近傍地点の前後のうち最初に改善する位置へ移す"""
+    problem = solution.problem
+    cost = problem.cost
+    depot, terminal = problem.depot, problem.terminal
+
+    v_from, p_from = position[stop]
+    route_from = solution.routes[v_from]
+    if p_from + length > len(route_from):
+        return False
+    segment = route_from[p_from:p_from + length]
+    before = route_from[p_from - 1] if p_from > 0 else depot
+    after = route_from[p_from + length] if p_from + length < len(route_from) else terminal
+    removal_gain = cost[before][segment[0]] + cost[segment[-1]][after] - cost[before][after]
+    remaining = route_from[:p_from] + route_from[p_from + length:]
+
+    for neighbor in problem.neighbors[stop]:
+        if neighbor in segment:
+            continue
+        v_to, p_neighbor = position[neighbor]
+        for p_to in (p_neighbor, p_neighbor + 1):
+            if v_to == v_from:
+                insert_at = p_to if p_to <= p_from else p_to - length
+                new_route = remaining[:insert_at] + segment + remaining[insert_at:]
+                if new_route != route_from and solution.try_replace({v_from: new_route}):
+                    return True
+                continue
+
+            route_to = solution.routes[v_to]
+            prev_to = route_to[p_to - 1] if p_to > 0 else depot
+            next_to = route_to[p_to] if p_to < len(route_to) else terminal
+            insertion_cost = cost[prev_to][segment[0]] + cost[segment[-1]][next_to] - cost[prev_to][next_to]
+            # 移動コストが増え、かつ減らせる違反もない移動は評価しない
+            penalty_now = solution.costs[v_from][1] + solution.costs[v_to][1]
+            vehicle_saving = problem.vehicle_cost if not remaining else 0
+            if insertion_cost - removal_gain - vehicle_saving >= penalty_now:
+                continue
+            new_to = route_to[:p_to] + segment + route_to[p_to:]
+            if solution.try_replace({v_from: remaining, v_to: new_to}):
+                return True
+    return False
+
+def _two_opt(solution, deadline):
+    """同一ルート内の区間反転（近傍地点と隣接させる反転のみ試す）"""
+    problem = solution.problem
+    improved = False
+    for v, _ in enumerate(solution.routes):
+        route = solution.routes[v]
+        if len(route) < 3:
+            continue
+        index = {stop: p for p, stop in enumerate(route)}
+        for i in range(len(route) - 1):
+            if time.perf_counter() > deadline:
+                return improved
+            for neighbor in problem.neighbors[route[i]]:
+                j = index.get(neighbor)
+                if j is None or j <= i + 1:
+                    continue
+                # route[i]の直後にneighborが来るように i+1..j を反転
+                new_route = route[:i + 1] + route[i + 1:j + 1][::-1] + route[j + 1:]
+                if solution.try_replace({v: new_route}):
+                    improved = True
+                    route = solution.routes[v]
+                    index = {stop: p for p, stop in enumerate(route)}
+                    break
+    return improved
+
+def solve(problem, time_limit=None, seed=None, on_progress=None, initial_routes=None):
+    """構築法＋局所探索（relocate, or-opt, 2-opt）で制限時間内に解を改善する
+
+    initial_routesを指定した場合は構築法を使わず、その訪問順から局所探索を始める。
+    on_progressは局所探索の1周ごとに (周回数, 経過時間の割合, 目的関数値) で呼ばれる。
+    """
+    if time_limit is None:
+        time_limit = SOLVER_CONFIG["time_limit_seconds"]
+    started = time.perf_counter()
+    deadline = started + time_limit
+    rng = random.Random(seed) if seed is not None else None
+
+    if initial_routes is not None:
+        solution = Solution(problem, [list(route) for route in initial_routes])
+    else:
+        solution = _construct(problem, rng, deadline)
+    improved = True
+    iteration = 0
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for length in (1, 2, 3):
+            improved |= _relocate_segment(solution, length, deadline)
+        improved |= _two_opt(solution, deadline)
+        iteration += 1
+        if on_progress:
+            elapsed = (time.perf_counter() - started) / time_limit if time_limit else 1.0
+            on_progress(iteration, min(elapsed, 1.0), solution.total())
+    return solution
+
+def repair(problem, routes, focus=(), time_limit=None):
+    """前回の訪問順を保ったまま、含まれていない地点を挿入し、変更箇所の周辺だけを局所探索で改善する
+
+    routesは車両ごとの訪問順（problemの地点の位置。始点・終着と重複は無視する）。
+    focusは前後の地点が変わった地点で、挿入した地点とともにその近傍地点を改善の対象とする。
+    """
+    if time_limit is None:
+        time_limit = REPLAN_CONFIG["repair_time_limit_seconds"]
+    deadline = time.perf_counter() + time_limit
+    stops = set(problem.stops)
+    seen = set()
+    cleaned = []
+    for route in routes:
+        kept = []
+        for stop in route:
+            if stop in stops and stop not in seen:
+                kept.append(stop)
+                seen.add(stop)
+        cleaned.append(kept)
+    solution = Solution(problem, cleaned)
+
+    missing = _arrival_order(problem, stops - seen)
+    for stop in missing:
+        _insert_cheapest(problem, solution.routes, solution.costs, stop)
+
+    targets = set(missing) | (set(focus) & stops)
+    for stop in list(targets):
+        targets.update(problem.neighbors[stop])
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for stop in sorted(targets):
+            if time.perf_counter() > deadline:
+                break
+            for length in (1, 2, 3):
+                improved |= _move_segment(solution, stop, length, _locate(solution))
+        improved |= _two_opt(solution, deadline)
+    return solution
+
+def repair_routes(table, matrix, vehicles, settings, start_time, routes, focus=(), refine=None):
+    """前回の計画 routes {車両名: [地点の位置]} を今回の地点・マトリックスに合わせて修正し、(結果行リスト, サマリー文)を返す
+
+    計画にない車両名の地点は挿入し直す（「トラックN」はN台目の車両とみなす）。
+    refineはplan_routesと同じで、修正後に走行する区間を補正し、訪問順を変えずに時刻だけを計算し直す。
+    """
+    problem = RoutingProblem(table, matrix, vehicles, settings, start_time)
+    index_by_name = {vehicle["id"]: v for v, vehicle in enumerate(problem.vehicles)}
+    index_by_name.update({f"トラック{v + 1}": v for v in range(len(problem.vehicles))})
+    ordered = [[] for _ in problem.vehicles]
+    for name, route in routes.items():
+        v = index_by_name.get(str(name).strip())
+        if v is not None:
+            ordered[v].extend(route)
+
+    solution = repair(problem, ordered, focus=focus)
+    if refine:
+        matrix = refine(solution_legs(solution))
+        if matrix is not None:
+            solution = Solution(RoutingProblem(table, matrix, vehicles, settings, start_time), solution.routes)
+    return solution_to_rows(solution), summarize_solution(solution)
+
+def solution_to_rows(solution):
+    """解をprocess_ai_responseと同じ列構成の行リストに変換"""
+    problem = solution.problem
+    locations = problem.locations
+    start_time = problem.start_time
+    rows = []
+
+    def at(seconds):
+        return start_time + timedelta(seconds=seconds)
+
+    def add_row(vehicle_id, proposed, status, index=None, desired="", difference="", remarks=""):
+        loc = locations[index] if index is not None else {}
+        rows.append({
+            "車両": vehicle_id,
+            "提案時間": proposed,
+            "希望時間": desired,
+            "時間差": difference,
+            "ステータス": status,
+            "地点ID": str(index + 1) if index is not None else "",
+            "地点コード": str(loc.get("地点コード", "")),
+            "地点名": str(loc.get("地点", "")),
+            "住所": str(loc.get("住所", "")),
+            "備考": remarks
+        })
+
+    for v, route in enumerate(solution.routes):
+        if not route:
+            continue
+        vehicle_id = problem.vehicles[v]["id"]
+        depot = problem.depot
+        depot_arrival = problem.ready[depot] if problem.ready[depot] is not None else 0
+        depot_arrival = min(depot_arrival, 0)
+        add_row(vehicle_id, _format_time(at(depot_arrival)), "到着", depot,
+                desired=locations[depot].get("希望到着", ""), remarks="始点拠点への到着（荷物引き取り）")
+        add_row(vehicle_id, _format_time(at(0)), "出発", depot, desired=locations[depot].get("希望出発", ""))
+
+        elapsed, driven, prev = 0, 0, depot
+        for cur in route + [problem.terminal]:
+            leg = problem.durations[prev][cur]
+            distance_km = problem.distances[prev][cur] / 1000
+            remaining = leg
+            # 連続運転制限に達する地点で休憩を挟む
+            while problem.continuous_limit and driven + remaining > problem.continuous_limit:
+                part = problem.continuous_limit - driven
+                add_row(vehicle_id, f"{_format_time(at(elapsed))} - {_format_time(at(elapsed + part))}", "移動")
+                elapsed += part
+                add_row(vehicle_id, f"{_format_time(at(elapsed))} - {_format_time(at(elapsed + problem.rest_seconds))}",
+                        "休憩", remarks=f"連続運転{problem.continuous_limit // 3600:.0f}時間到達による休憩")
+                elapsed += problem.rest_seconds
+                driven, remaining = 0, remaining - part
+            add_row(vehicle_id, f"{_format_time(at(elapsed))} - {_format_time(at(elapsed + remaining))}", "移動",
+                    remarks=f"{locations[cur].get('地点', '')}へ {leg // 60}分 / {distance_km:.1f}km")
+            elapsed += remaining
+            driven += remaining
+
+            ready = problem.ready[cur]
+            difference = ""
+            if ready is not None:
+                difference = _format_difference(elapsed - ready)
+                if elapsed < ready:
+                    if problem.rest_seconds and ready - elapsed >= problem.rest_seconds:
+                        driven = 0
+                    elapsed = ready
+            add_row(vehicle_id, _format_time(at(elapsed)), "到着", cur,
+                    desired=locations[cur].get("希望到着", ""), difference=difference)
+            if cur == problem.terminal:
+                break
+            elapsed += problem.service[cur]
+            if problem.rest_seconds and problem.service[cur] >= problem.rest_seconds:
+                driven = 0
+            difference = ""
+            if problem.due[cur] is not None:
+                difference = _format_difference(elapsed - problem.due[cur])
+            add_row(vehicle_id, _format_time(at(elapsed)), "出発", cur,
+                    desired=locations[cur].get("希望出発", ""), difference=difference)
+            prev = cur
+    return rows
+
+def summarize_solution(solution):
+    """解の要点と警告をサマリー文にまとめる"""
+    problem = solution.problem
+    used = [v for v, route in enumerate(solution.routes) if route]
+    total_seconds = 0
+    total_meters = 0
+    for v in used:
+        seq = [problem.depot] + solution.routes[v] + [problem.terminal]
+        total_seconds += sum(problem.durations[a][b] for a, b in zip(seq, seq[1:]))
+        total_meters += sum(problem.distances[a][b] for a, b in zip(seq, seq[1:]))
+
+    lines = [
+        f"ローカルソルバーで{len(problem.stops) + 2}地点を{len(used)}台の車両に割り当てました。",
+        f"総走行時間は約{total_seconds // 3600}時間{total_seconds % 3600 // 60}分、総走行距離は約{total_meters / 1000:.1f}kmです。"
+    ]
+    warnings = []
+    for v in used:
+        route = solution.routes[v]
+        vehicle_id = problem.vehicles[v]["id"]
+        if problem._capacity_excess(route, v) > 0:
+            warnings.append(f"⚠️ {vehicle_id}は積載上限を超える区間があります。")
+        if solution.costs[v][1] > 0 and problem._capacity_excess(route, v) == 0:
+            warnings.append(f"⚠️ {vehicle_id}は希望時刻または拘束時間の制限を満たせない区間があります。")
+    if any(problem.durations[a][b] >= UNREACHABLE for v in used
+           for a, b in zip([problem.depot] + solution.routes[v], solution.routes[v] + [problem.terminal])):
+        warnings.append("⚠️ ルートが見つからない区間が含まれています。")
+    return "\n".join(lines + warnings)
+
+def solution_legs(solution):
+    """解で実際に走行する区間 (出発地の位置, 目的地の位置) の一覧"""
+    problem = solution.problem
+    legs = []
+    for route in solution.routes:
+        if route:
+            seq = [problem.depot] + route + [problem.terminal]
+            legs.extend(zip(seq, seq[1:]))
+    return legs
+
+def plan_routes(table, matrix, vehicles, settings, start_time, time_limit=None, seed=None, on_progress=None,
+                refine=None, refine_rounds=0):
+    """ローカルソルバーで配車計画を作成し、(結果行リスト, サマリー文)を返す
+
+    refineを指定した場合、解で走行する区間の一覧を渡して補正後のマトリックスを受け取り
+    （補正する区間がなければNone）、その解を初期解として再計画する（最大refine_rounds回）。
+    最後の補正では訪問順を変えずに時刻だけを計算し直すため、結果の区間はすべて補正済みになる。
+    """
+    problem = RoutingProblem(table, matrix, vehicles, settings, start_time)
+    solution = solve(problem, time_limit=time_limit, seed=seed, on_progress=on_progress)
+    rounds = refine_rounds if refine else 0
+    for round_index in range(rounds):
+        matrix = refine(solution_legs(solution))
+        if matrix is None:
+            break
+        problem = RoutingProblem(table, matrix, vehicles, settings, start_time)
+        if round_index == rounds - 1:
+            solution = Solution(problem, solution.routes)
+        else:
+            solution = solve(problem, time_limit=time_limit, seed=seed, on_progress=on_progress, initial_routes=solution.routes)
+    return solution_to_rows(solution), summarize_solution(solution)
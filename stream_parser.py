@@ -0,0 +1,88 @@
+# --- stream_parser.py (AI応答のストリーミング解析) ---
+
+import json
+
+SEPARATOR = '---'
+
+class RouteResponseParser:
+    """「サマリー → --- → JSONリスト」形式のAI応答を、チャンク単位で受け取りながら解析する
+
+    feed()は新しく確定したイベントのリストを返す。
+    - ('summary', サマリー文): 区切り線`---`を受信した時点で1回
+    - ('item', dict): 運行計画のJSONオブジェクトが1件閉じるたび
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.summary = None
+        self.items = []
+        self.finished = False
+        self._decoder = json.JSONDecoder()
+        self._pos = 0
+        self._list_depth = 0
+
+    def feed(self, chunk):
+        """受信したテキストを追加し、新たに確定したイベントを返す"""
+        self.buffer += chunk
+        events = []
+
+        if self.summary is None:
+            separator_at = self.buffer.find(SEPARATOR)
+            if separator_at < 0:
+                return events
+            self.summary = self.buffer[:separator_at].strip()
+            self._pos = separator_at + len(SEPARATOR)
+            events.append(('summary', self.summary))
+
+        while not self.finished:
+            item = self._next_item()
+            if item is None:
+                break
+            self.items.append(item)
+            events.append(('item', item))
+        return events
+
+    def _skip_whitespace(self):
+        while self._pos < len(self.buffer) and self.buffer[self._pos] in ' \t\r\n,':
+            self._pos += 1
+
+    def _next_item(self):
+        """バッファから次のJSONオブジェクトを1件取り出す（未完了ならNone）"""
+        # コードフェンスや前置きの文章を読み飛ばしてリストの開始位置へ
+        if self._list_depth == 0:
+            list_start = self.buffer.find('[', self._pos)
+            if list_start < 0:
+                return None
+            self._pos = list_start + 1
+            self._list_depth = 1
+
+        self._skip_whitespace()
+        if self._pos >= len(self.buffer):
+            return None
+
+        char = self.buffer[self._pos]
+        if char == '[':
+            # [[...]] のように入れ子になった応答は内側のリストを使う
+            self._pos += 1
+            self._list_depth += 1
+            return self._next_item()
+        if char == ']':
+            self._pos += 1
+            self._list_depth -= 1
+            if self._list_depth == 0:
+                self.finished = True
+            return self._next_item() if not self.finished else None
+
+        try:
+            item, end = self._decoder.raw_decode(self.buffer, self._pos)
+        except json.JSONDecodeError:
+            # オブジェクトが閉じていない（受信途中）
+            return None
+        self._pos = end
+        return item if isinstance(item, dict) else self._next_item()
+
+    def close(self):
+        """受信完了時に呼び出し、区切り線がなかった場合は全文をサマリーとする"""
+        if self.summary is None:
+            self.summary = self.buffer.strip()
+        return self.summary
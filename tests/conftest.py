@@ -0,0 +1,37 @@
+# --- tests/conftest.py (テスト共通の設定) ---
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_handler
+from constants import CACHE_CONFIG
+
+@pytest.fixture
+def isolated_cache(tmp_path, monkeypatch):
+    """永続キャッシュをテストごとの一時ファイルに切り替える（共有済みのキャッシュはテスト後に破棄）"""
+    monkeypatch.setitem(CACHE_CONFIG, "path", str(tmp_path / "cache.sqlite3"))
+    yield CACHE_CONFIG["path"]
+    for kind in ('distance_cache', 'geocode_cache', 'response_cache'):
+        api_handler.registry.evict(kind)
+
+@pytest.fixture
+def api_clients():
+    """偽のクライアントを共有レジストリに登録し、それを使うApiClientsを返す関数（登録はテスト後に破棄）"""
+    registered = []
+
+    def register(gmaps=None, gemini=None):
+        keys = {}
+        for kind, client in (('gmaps_client', gmaps), ('gemini_model', gemini)):
+            if client is not None:
+                keys[kind] = f"test-{kind}-{id(client)}"
+                api_handler.registry.get_or_create(kind, keys[kind], lambda: client)
+                registered.append((kind, keys[kind]))
+        return api_handler.ApiClients(keys.get('gmaps_client'), keys.get('gemini_model'))
+
+    yield register
+    for kind, key in registered:
+        api_handler.registry.evict(kind, key)
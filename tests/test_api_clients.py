@@ -0,0 +1,79 @@
+# --- tests/test_api_clients.py (セッションごとのAPIクライアント) ---
+
+import google.generativeai as genai
+import pytest
+
+import api_handler
+import async_api
+
+class FakeGeocodeClient:
+    """geocodeだけの偽のGoogle Mapsクライアント"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def geocode(self, address, **kwargs):
+        return [{'geometry': {'location': {'lat': 35.0, 'lng': 139.0}}}]
+
+def test_sessions_with_different_keys_use_their_own_clients(api_clients):
+    first, second = FakeGeocodeClient("first"), FakeGeocodeClient("second")
+    session_a = api_clients(gmaps=first)
+    session_b = api_clients(gmaps=second)
+
+    assert session_a.gmaps is first
+    assert session_b.gmaps is second
+    assert session_a.gmaps_key_hash != session_b.gmaps_key_hash
+    assert session_a.gemini is None and session_a.gemini_key_hash is None
+
+def test_failed_initialization_in_another_session_does_not_affect_clients(api_clients):
+    client = FakeGeocodeClient("shared")
+    session_a = api_clients(gmaps=client)
+    diagnostics = []
+
+    assert not api_handler.initialize_gmaps("", diagnostics=diagnostics)
+
+    assert diagnostics == [{'level': 'warning', 'message': "Google Maps APIキーが設定されていません"}]
+    assert session_a.gmaps is client
+    assert api_handler.validate_api_keys(session_a) == {'gmaps': True, 'gemini': False}
+
+def test_evicted_client_is_recreated_for_the_same_key(monkeypatch):
+    created = []
+    monkeypatch.setattr(api_handler, "_create_gmaps_client", lambda key: created.append(key) or FakeGeocodeClient(key))
+    clients = api_handler.ApiClients(maps_key="maps-key-a")
+    try:
+        first = clients.gmaps
+        assert clients.gmaps is first
+        api_handler.registry.evict('gmaps_client', "maps-key-a")
+        assert clients.gmaps is not first
+        assert created == ["maps-key-a", "maps-key-a"]
+    finally:
+        api_handler.registry.evict('gmaps_client', "maps-key-a")
+
+def test_gemini_models_use_per_key_clients_without_global_configure(monkeypatch):
+    def fail(**kwargs):
+        pytest.fail("genai.configure はプロセス全体の既定キーを書き換えるため呼ばない")
+    monkeypatch.setattr(genai, "configure", fail)
+
+    model_a = api_handler._create_gemini_model("gemini-key-a")
+    model_b = api_handler._create_gemini_model("gemini-key-b")
+
+    assert model_a._client.transport._credentials.token == "gemini-key-a"
+    assert model_b._client.transport._credentials.token == "gemini-key-b"
+    assert model_a._async_client.transport._credentials.token == "gemini-key-a"
+    assert model_b._async_client.transport._credentials.token == "gemini-key-b"
+
+def test_repr_does_not_show_keys():
+    clients = api_handler.ApiClients(maps_key="secret-maps", gemini_key="secret-gemini")
+    assert "secret" not in repr(clients)
+
+def test_model_first_resolved_inside_the_event_loop_does_not_block():
+    clients = api_handler.ApiClients(gemini_key="gemini-key-in-loop")
+
+    async def resolve():
+        return clients.gemini
+
+    try:
+        model = async_api.run(resolve())
+        assert model._async_client.transport._credentials.token == "gemini-key-in-loop"
+    finally:
+        api_handler.registry.evict('gemini_model', "gemini-key-in-loop")
@@ -0,0 +1,225 @@
+# --- tests/test_candidates.py (複数の計画案の並列作成と選択) ---
+
+import asyncio
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import async_api
+import route_planner
+from constants import CANDIDATE_CONFIG
+from location_table import normalize_locations
+from plan_validator import PlanValidator
+from route_solver import RoutingProblem, Solution, solution_to_rows
+from travel_matrix import STATUS_OK, TravelMatrix
+
+START = datetime(2026, 10, 18, 8, 0)
+
+#======================================================================
+# async_api.race
+#======================================================================
+
+async def _after(seconds, value):
+    await asyncio.sleep(seconds)
+    if isinstance(value, Exception):
+        raise value
+    return value
+
+def test_race_collects_results_in_completion_order():
+    error = ValueError("失敗")
+    done = []
+    finished, cancelled = async_api.run(async_api.race(
+        {"slow": _after(0.2, "b"), "fast": _after(0.0, "a"), "broken": _after(0.1, error)},
+        on_done=lambda name, result: done.append(name)
+    ))
+    assert finished == [("fast", "a"), ("broken", error), ("slow", "b")]
+    assert done == ["fast", "broken", "slow"]
+    assert cancelled == []
+
+def test_race_cancels_the_rest_at_the_timeout():
+    started = time.perf_counter()
+    finished, cancelled = async_api.run(async_api.race(
+        {"fast": _after(0.0, "a"), "slow": _after(5, "b")}, timeout=0.2
+    ))
+    assert time.perf_counter() - started < 1
+    assert finished == [("fast", "a")]
+    assert cancelled == ["slow"]
+
+def test_race_stops_when_a_result_is_good_enough():
+    checked = []
+
+    def is_good(name, result):
+        checked.append(name)
+        return result == "good"
+
+    finished, cancelled = async_api.run(async_api.race(
+        {"first": _after(0.0, "poor"), "second": _after(0.1, "good"), "third": _after(5, "late"),
+         "broken": _after(0.05, ValueError("失敗"))},
+        is_good=is_good
+    ))
+    assert [name for name, _ in finished] == ["first", "broken", "second"]
+    assert cancelled == ["third"]
+    # 例外はis_goodに渡さない
+    assert checked == ["first", "second"]
+
+#======================================================================
+# route_planner.plan_candidates
+#======================================================================
+
+def _matrix(size):
+    steps = np.abs(np.subtract.outer(np.arange(size), np.arange(size)))
+    return TravelMatrix(
+        (steps * 600).astype(np.int32),
+        (steps * 5000).astype(np.int32),
+        np.full((size, size), STATUS_OK, dtype=np.uint8)
+    )
+
+@pytest.fixture
+def plan_inputs():
+    table = normalize_locations(
+        [{"始点": "1", "地点": "センター", "住所": "addr-0", "希望出発": "2026/10/18 08:00"}]
+        + [{"地点": f"P{i}", "住所": f"addr-{i + 1}"} for i in range(6)]
+        + [{"終着": "2", "地点": "倉庫", "住所": "addr-7"}]
+    )
+    vehicles = pd.DataFrame([{"車両ID": "T01", "車種名": "2t"}, {"車両ID": "T02", "車種名": "2t"}])
+    return table, _matrix(len(table)), vehicles
+
+def _plan(table, matrix, vehicles, routes):
+    """車両ごとの訪問順から計画の行を作成"""
+    problem = RoutingProblem(table, matrix, vehicles.to_dict('records'), {"mode": "mode1"}, START)
+    return solution_to_rows(Solution(problem, routes))
+
+class FakeCandidates:
+    """ローカルソルバー・AIの案を、名前ごとに決めた待ち時間・結果で返す偽のコルーチン"""
+
+    def __init__(self, monkeypatch, solver, ai):
+        self.solver, self.ai = solver, ai
+        self.seeds, self.temperatures = [], []
+        monkeypatch.setattr(route_planner, "_solver_candidate", self.solver_candidate)
+        monkeypatch.setattr(route_planner, "_ai_candidate", self.ai_candidate)
+
+    async def solver_candidate(self, vehicles, all_vehicles, table, matrix, settings, departure_dt, seed):
+        self.seeds.append(seed)
+        return await self._result(self.solver[len(self.seeds) - 1])
+
+    async def ai_candidate(self, clients, prompt, temperature, table, use_cache):
+        self.temperatures.append(temperature)
+        return await self._result(self.ai[len(self.temperatures) - 1])
+
+    @staticmethod
+    async def _result(spec):
+        delay, rows = spec
+        await asyncio.sleep(delay)
+        if isinstance(rows, Exception):
+            raise rows
+        return {'results': rows, 'summary': "サマリー", 'cached': False}
+
+def _run(clients, plan_inputs, settings=None):
+    table, matrix, vehicles = plan_inputs
+    usage = {"gemini": 0, "gemini_cache_hits": 0, "maps": 0, "maps_cache_hits": 0}
+    diagnostics = []
+    settings = {**route_planner.default_settings(), "mode": "mode1", **(settings or {})}
+    results, summary, prompt, violations = route_planner.plan_candidates(
+        clients, vehicles, vehicles.to_dict('records'), table, matrix, settings, START, usage, diagnostics
+    )
+    return results, prompt, violations, usage, diagnostics
+
+@pytest.fixture
+def clients(api_clients):
+    return api_clients(gemini=object())
+
+def test_lowest_score_is_chosen(monkeypatch, plan_inputs, clients):
+    table, matrix, vehicles = plan_inputs
+    stops = list(range(1, 7))
+    one_vehicle = _plan(table, matrix, vehicles, [stops, []])
+    two_vehicles = _plan(table, matrix, vehicles, [stops[:3], stops[3:]])
+    fake = FakeCandidates(
+        monkeypatch,
+        solver=[(0.0, two_vehicles)] * 3,
+        ai=[(0.0, ValueError("解析できません")), (0.05, one_vehicle), (0.1, two_vehicles)]
+    )
+
+    results, prompt, violations, usage, diagnostics = _run(clients, plan_inputs)
+
+    assert results == one_vehicle
+    assert violations == []
+    assert prompt.strip()
+    assert fake.temperatures == [variant.get("temperature") for variant in CANDIDATE_CONFIG["ai_variants"]]
+    assert usage["gemini"] == len(CANDIDATE_CONFIG["ai_variants"])
+    message = diagnostics[-1]['message']
+    # AI2の案がソルバーの案より良いため、その時点で残りのAI3を打ち切る
+    assert message.startswith("6案のうち4案を比較し、AI2（")
+    assert "失敗（解析できません）" in message and "打ち切り: AI3（" in message
+
+def test_plan_with_errors_loses_to_a_clean_plan(monkeypatch, plan_inputs, clients):
+    table, matrix, vehicles = plan_inputs
+    stops = list(range(1, 7))
+    clean = _plan(table, matrix, vehicles, [stops[:3], stops[3:]])
+    too_fast = _plan(table, matrix, vehicles, [stops, []])
+    too_fast[6]["提案時間"] = too_fast[4]["提案時間"]
+    FakeCandidates(monkeypatch, solver=[(0.0, clean)] * 3, ai=[(0.0, too_fast)] * 3)
+
+    results, _, violations, _, _ = _run(clients, plan_inputs)
+
+    assert results == clean
+    assert violations == []
+
+def test_remaining_candidates_are_cancelled_once_an_ai_plan_is_good_enough(monkeypatch, plan_inputs, clients):
+    table, matrix, vehicles = plan_inputs
+    stops = list(range(1, 7))
+    best = _plan(table, matrix, vehicles, [stops, []])
+    with_error = [dict(row) for row in best]
+    with_error[6]["提案時間"] = with_error[4]["提案時間"]
+    FakeCandidates(
+        monkeypatch,
+        solver=[(0.0, best)] * 3,
+        # 違反のある案では打ち切らず、違反のない同等の案が届いた時点で打ち切る
+        ai=[(0.05, with_error), (0.15, best), (5, best)]
+    )
+
+    started = time.perf_counter()
+    results, _, _, usage, diagnostics = _run(clients, plan_inputs)
+
+    assert time.perf_counter() - started < 2
+    assert results == best
+    assert "打ち切り: AI3（" in diagnostics[-1]['message']
+    # 打ち切った依頼も送信済みのため回数に含める
+    assert usage["gemini"] == 3
+
+def test_solver_only_without_gemini(monkeypatch, plan_inputs, api_clients):
+    table, matrix, vehicles = plan_inputs
+    plan = _plan(table, matrix, vehicles, [list(range(1, 7)), []])
+    fake = FakeCandidates(monkeypatch, solver=[(0.0, plan)] * 3, ai=[])
+
+    results, prompt, _, usage, diagnostics = _run(api_clients(), plan_inputs)
+
+    assert results == plan
+    assert prompt == route_planner.NO_PROMPT_MESSAGE
+    assert fake.temperatures == [] and usage["gemini"] == 0
+    assert diagnostics[0]['message'] == "Gemini APIが使えないため、ローカルソルバーの案のみから選びます"
+
+def test_all_candidates_failing_raises(monkeypatch, plan_inputs, api_clients):
+    FakeCandidates(monkeypatch, solver=[(0.0, RuntimeError("解なし"))] * 3, ai=[])
+    with pytest.raises(Exception, match="計画案を作成できませんでした"):
+        _run(api_clients(), plan_inputs)
+
+def test_plans_are_scored_off_the_event_loop_thread(monkeypatch, plan_inputs, clients):
+    table, matrix, vehicles = plan_inputs
+    plan = _plan(table, matrix, vehicles, [list(range(1, 7)), []])
+    FakeCandidates(monkeypatch, solver=[(0.0, plan)] * 3, ai=[(0.0, plan)] * 3)
+    threads = []
+    evaluate = PlanValidator.evaluate
+
+    def recording_evaluate(self, results):
+        threads.append(threading.current_thread().name)
+        return evaluate(self, results)
+
+    monkeypatch.setattr(PlanValidator, "evaluate", recording_evaluate)
+    _run(clients, plan_inputs)
+
+    assert threads
+    assert "api-event-loop" not in threads
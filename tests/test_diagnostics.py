@@ -0,0 +1,101 @@
+# --- tests/test_diagnostics.py (APIの警告・エラーを診断情報として返す) ---
+
+import sys
+import types
+from datetime import datetime
+
+import googlemaps.exceptions
+import pytest
+
+import api_handler
+
+class _StreamlitTripwire(types.ModuleType):
+    """属性を参照した時点で失敗する、streamlitの代わりのモジュール"""
+
+    def __getattr__(self, name):
+        raise AssertionError(f"api_handlerからst.{name}が呼ばれました")
+
+class FailingMapsClient:
+    """geocode・distance_matrixが決められた結果・例外を返す偽のGoogle Mapsクライアント"""
+
+    def __init__(self, geocode_result=None, error=None):
+        self.geocode_result = geocode_result
+        self.error = error
+
+    def geocode(self, address, **kwargs):
+        if self.error:
+            raise self.error
+        return self.geocode_result
+
+    def distance_matrix(self, origins, destinations, **kwargs):
+        raise self.error
+
+@pytest.fixture(autouse=True)
+def no_streamlit(monkeypatch):
+    monkeypatch.setitem(sys.modules, "streamlit", _StreamlitTripwire("streamlit"))
+    assert "st" not in vars(api_handler)
+
+@pytest.fixture
+def maps_key():
+    """偽のクライアントを作成するキー（登録と検証結果はテスト後に破棄）"""
+    key = "test-diagnostics-maps-key"
+    yield key
+    api_handler.registry.evict('gmaps_client', key)
+    api_handler._key_validations.pop(api_handler._key_hash('google_maps', key), None)
+
+def _use_client(monkeypatch, client):
+    monkeypatch.setattr(api_handler, "_create_gmaps_client", lambda key: client)
+
+def test_missing_maps_key_is_reported_as_warning():
+    diagnostics = []
+    assert not api_handler.initialize_gmaps("", diagnostics=diagnostics)
+    assert diagnostics == [{'level': 'warning', 'message': "Google Maps APIキーが設定されていません"}]
+
+def test_missing_gemini_key_is_reported_as_warning():
+    diagnostics = []
+    assert not api_handler.initialize_gemini("", diagnostics=diagnostics)
+    assert diagnostics == [{'level': 'warning', 'message': "Gemini APIキーが設定されていません"}]
+
+def test_failed_connection_test_is_reported_as_error(monkeypatch, maps_key):
+    _use_client(monkeypatch, FailingMapsClient(geocode_result=[]))
+    diagnostics = []
+
+    assert not api_handler.initialize_gmaps(maps_key, lazy=False, diagnostics=diagnostics)
+
+    assert diagnostics == [{'level': 'error', 'message': "Google Maps API接続テストに失敗しました"}]
+    assert not api_handler.registry.contains('gmaps_client', maps_key)
+
+def test_initialization_error_hides_the_key(monkeypatch, maps_key):
+    error = googlemaps.exceptions.ApiError('REQUEST_DENIED', f"The provided API key is invalid: {maps_key}")
+    _use_client(monkeypatch, FailingMapsClient(error=error))
+    diagnostics = []
+
+    assert not api_handler.initialize_gmaps(maps_key, lazy=False, diagnostics=diagnostics)
+
+    assert [d['level'] for d in diagnostics] == ['error']
+    assert diagnostics[0]['message'].startswith("Google Maps API初期化エラー: ")
+    assert maps_key not in diagnostics[0]['message']
+    assert "***" in diagnostics[0]['message']
+
+def test_key_known_to_be_invalid_is_reported_without_connecting(monkeypatch, maps_key):
+    _use_client(monkeypatch, FailingMapsClient(geocode_result=[]))
+    api_handler._record_key_validation(api_handler._key_hash('google_maps', maps_key), 'invalid', "REQUEST_DENIED")
+    diagnostics = []
+
+    assert not api_handler.initialize_gmaps(maps_key, lazy=True, diagnostics=diagnostics)
+
+    assert diagnostics == [{'level': 'error', 'message': "Google Maps APIキーの検証に失敗しています。キーを確認してください。"}]
+
+def test_distance_matrix_error_is_returned_in_diagnostics(monkeypatch, isolated_cache, api_clients):
+    monkeypatch.setitem(api_handler.API_CONFIG["google_maps"], "use_coordinates", False)
+    error = googlemaps.exceptions.ApiError('REQUEST_DENIED', "denied")
+    clients = api_clients(gmaps=FailingMapsClient(error=error))
+    locations = [{"地点": f"P{i}", "住所": f"addr-{i}"} for i in range(3)]
+
+    response = api_handler.get_distance_matrix(clients, locations, datetime(2026, 10, 18, 8), True)
+
+    assert response['status'] == 'API_ERROR'
+    assert [d['level'] for d in response['diagnostics']] == ['error']
+    assert response['diagnostics'][0]['message'].startswith("Distance Matrix API呼び出しエラー: ")
+    # キーが拒否されたことは検証キャッシュに記録する
+    assert api_handler._key_validations.pop(clients.gmaps_key_hash)['status'] == 'invalid'
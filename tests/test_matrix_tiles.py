@@ -0,0 +1,163 @@
+# --- tests/test_matrix_tiles.py (距離マトリックスのタイル分割・並列取得) ---
+
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import api_handler
+import route_planner
+from constants import API_CONFIG
+from travel_estimator import TravelEstimator
+from travel_matrix import TravelMatrix
+
+class FakeMatrixClient:
+    """住所「addr-N」同士の移動時間・距離を番号から決める、distance_matrixだけの偽クライアント
+
+    同時に実行中の呼び出し数の最大値をpeakに、要求された(出発地, 目的地)の組をrequestedに記録する。
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+        self.requested = []
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def element(origin, destination):
+        i, j = int(origin.split("-")[1]), int(destination.split("-")[1])
+        if i == j:
+            return {'status': 'OK', 'duration': {'value': 0}, 'distance': {'value': 0}}
+        if (i + j) % 17 == 0:
+            return {'status': 'ZERO_RESULTS'}
+        return {'status': 'OK', 'duration': {'value': 60 * abs(i - j) + i}, 'distance': {'value': 1000 * abs(i - j) + j}}
+
+    def distance_matrix(self, origins, destinations, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.requested.extend((o, d) for o in origins for d in destinations)
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            return {
+                'status': 'OK',
+                'origin_addresses': list(origins),
+                'destination_addresses': list(destinations),
+                'rows': [{'elements': [self.element(o, d) for d in destinations]} for o in origins]
+            }
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+def _locations(count):
+    return [{"地点": f"P{i}", "住所": f"addr-{i}"} for i in range(count)]
+
+@pytest.fixture
+def fake_client(monkeypatch, isolated_cache):
+    # 住所のまま問い合わせ、偽クライアントが番号を読めるようにする
+    monkeypatch.setitem(API_CONFIG["google_maps"], "use_coordinates", False)
+    return FakeMatrixClient(delay=0.02)
+
+@pytest.fixture
+def clients(fake_client, api_clients):
+    return api_clients(gmaps=fake_client)
+
+def test_tiles_cover_every_pair_once_within_request_limits():
+    maps_config = API_CONFIG["google_maps"]
+    size = 60
+    tiles = api_handler._plan_matrix_tiles({i: list(range(size)) for i in range(size)})
+
+    covered = [(i, j) for rows, cols in tiles for i in rows for j in cols]
+    assert sorted(covered) == [(i, j) for i in range(size) for j in range(size)]
+    for rows, cols in tiles:
+        assert len(rows) <= maps_config["max_dimension"]
+        assert len(cols) <= maps_config["max_dimension"]
+        assert len(rows) * len(cols) <= maps_config["max_elements_per_request"]
+
+def test_stitched_matrix_matches_single_call(fake_client, clients):
+    locations = _locations(40)
+    addresses = [loc["住所"] for loc in locations]
+
+    response = api_handler.get_distance_matrix(clients, locations, datetime(2026, 10, 18, 8), True)
+
+    assert response['status'] == 'OK'
+    assert fake_client.calls > 1
+    expected = TravelMatrix.from_response(fake_client.distance_matrix(addresses, addresses))
+    stitched = response['matrix']
+    assert (stitched.seconds == expected.seconds).all()
+    assert (stitched.meters == expected.meters).all()
+    # 同じ地点同士は取得結果によらず到達可能(0分)として扱う
+    off_diagonal = ~np.eye(len(addresses), dtype=bool)
+    assert (stitched.status[off_diagonal] == expected.status[off_diagonal]).all()
+    assert response['cache_stats']['misses'] == len(addresses) * len(addresses)
+
+def test_in_flight_calls_never_exceed_max_workers(fake_client, clients):
+    response = api_handler.get_distance_matrix(clients, _locations(60), datetime(2026, 10, 18, 8), True)
+
+    assert response['status'] == 'OK'
+    assert fake_client.calls >= 36
+    assert 1 < fake_client.peak <= API_CONFIG["google_maps"]["max_workers"]
+
+def test_only_uncached_pairs_are_requested_again(fake_client, clients):
+    when = datetime(2026, 10, 18, 8)
+    locations = _locations(30)
+    api_handler.get_distance_matrix(clients, locations, when, True)
+
+    response = api_handler.get_distance_matrix(clients, locations, when, True)
+
+    # キャッシュにはOKの要素のみを保存するため、ルートが見つからなかった組だけを取得し直す
+    failed = sum(
+        1 for o in locations for d in locations
+        if FakeMatrixClient.element(o["住所"], d["住所"])['status'] != 'OK'
+    )
+    assert response['cache_stats']['misses'] == failed
+
+def test_extend_fetches_only_rows_and_columns_of_added_addresses(fake_client, clients):
+    when = datetime(2026, 10, 18, 8)
+    previous = api_handler.get_distance_matrix(clients, _locations(10), when, True)['matrix']
+    fake_client.requested.clear()
+    # addr-4を削除し、addr-10・addr-11を追加して並びも変える
+    locations = [_locations(12)[i] for i in (11, 0, 1, 2, 3, 5, 6, 7, 8, 9, 10)]
+    addresses = [loc["住所"] for loc in locations]
+
+    response = api_handler.extend_distance_matrix(clients, previous, locations, when, True)
+
+    assert response['status'] == 'OK'
+    assert response['added'] == 2
+    added = {"addr-10", "addr-11"}
+    expected_pairs = {(o, d) for o in addresses for d in addresses if o != d and (o in added or d in added)}
+    assert sorted(fake_client.requested) == sorted(expected_pairs)
+    assert response['cache_stats']['misses'] == len(expected_pairs)
+    # 前回の住所同士の要素は再利用し、全体では一度に取得した場合と同じになる
+    expected = TravelMatrix.from_response(FakeMatrixClient().distance_matrix(addresses, addresses))
+    extended = response['matrix']
+    assert (extended.seconds == expected.seconds).all()
+    assert (extended.meters == expected.meters).all()
+    off_diagonal = ~np.eye(len(addresses), dtype=bool)
+    assert (extended.status[off_diagonal] == expected.status[off_diagonal]).all()
+
+def test_used_leg_refiner_reports_each_round(fake_client, clients):
+    addresses = [f"addr-{i}" for i in range(4)]
+    matrix = TravelEstimator.default().estimate_matrix(np.array([[35.0 + 0.01 * i, 139.0] for i in range(4)]), addresses)
+    # 住所のまま問い合わせ、偽クライアントが番号を読めるようにする
+    matrix.coordinates = None
+    usage = {"maps": 0, "maps_cache_hits": 0}
+    rounds = []
+    refine = route_planner.used_leg_refiner(
+        clients, matrix, datetime(2026, 10, 18, 8), True, usage, [],
+        on_progress=lambda round_index, refined: rounds.append((round_index, refined))
+    )
+
+    first = refine([(0, 1), (1, 2)])
+    assert first.seconds[0, 1] == FakeMatrixClient.element("addr-0", "addr-1")['duration']['value']
+    assert not first.estimated[0, 1] and first.estimated[2, 3]
+    assert refine([(0, 1), (2, 3)]) is not None
+    # 補正済みの区間だけなら取得しない
+    assert refine([(0, 1)]) is None
+    assert rounds == [(0, 2), (1, 1)]
+    assert usage["maps"] == 3
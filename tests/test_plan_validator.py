@@ -0,0 +1,210 @@
+# --- tests/test_plan_validator.py (運行計画の検証) ---
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from constants import CANDIDATE_CONFIG, SOLVER_CONFIG
+from location_table import normalize_locations
+from plan_validator import PlanValidator, flagged_vehicles, score_plan
+from route_solver import RoutingProblem, Solution, plan_routes, solution_to_rows
+from travel_matrix import STATUS_OK, STATUS_ZERO_RESULTS, TravelMatrix
+
+START = datetime(2026, 10, 18, 8, 0)
+
+def _matrix(size):
+    """位置の差×10分・差×5kmの移動時間・距離を持つマトリックス"""
+    steps = np.abs(np.subtract.outer(np.arange(size), np.arange(size)))
+    return TravelMatrix(
+        (steps * 600).astype(np.int32),
+        (steps * 5000).astype(np.int32),
+        np.full((size, size), STATUS_OK, dtype=np.uint8)
+    )
+
+def _stops(count, **fields):
+    """始点・終着の間に地点P0〜をcount件並べた配送先データ"""
+    return (
+        [{"始点": "1", "地点": "センター", "希望出発": "2026/10/18 08:00"}]
+        + [{"地点": f"P{i}", **fields} for i in range(count)]
+        + [{"終着": "2", "地点": "倉庫"}]
+    )
+
+def _line_plan(count=6, settings=None, **fields):
+    """1台で地点を順に回る計画 (table, matrix, 結果の行)
+
+    各区間は10分、各地点の滞在は既定の作業時間。行は到着・出発・移動の順に並ぶ
+    （行1: センター出発、行3: P0到着、行6: P1到着、…、最後の行: 倉庫到着）。
+    """
+    table = normalize_locations(_stops(count, **fields))
+    matrix = _matrix(len(table))
+    problem = RoutingProblem(table, matrix, [{"車両ID": "T01"}], settings or {"mode": "mode1"}, START)
+    return table, matrix, solution_to_rows(Solution(problem, [problem.stops]))
+
+def _kinds(violations):
+    return [(violation['kind'], violation['row']) for violation in violations]
+
+def _evaluate(table, matrix, rows, settings=None, vehicles=None):
+    validator = PlanValidator(table, matrix, vehicles or [{"車両ID": "T01"}], settings or {"mode": "mode1"})
+    return validator.evaluate(rows)
+
+def test_solver_plan_has_no_violations():
+    table = normalize_locations(_stops(12, 荷下ろし重量=30))
+    matrix = _matrix(len(table))
+    vehicles = [{"車両ID": f"T{v}", "最大積載重量": 200} for v in range(3)]
+    settings = {"mode": "mode1", "continuous_limit": True, "continuous_hours": 4, "rest_minutes": 30,
+                "daily_limit": True, "daily_hours": 13}
+
+    rows, _ = plan_routes(table, matrix, vehicles, settings, START, time_limit=0.2, seed=1)
+    violations, metrics = PlanValidator(table, matrix, vehicles, settings).evaluate(rows)
+
+    assert violations == []
+    assert metrics['errors'] == 0
+    assert metrics['vehicles'] == len({row["車両"] for row in rows})
+    assert metrics['drive_seconds'] == pytest.approx(metrics['drive_meters'] / 5000 * 600)
+
+def test_line_plan_metrics():
+    table, matrix, rows = _line_plan()
+    assert rows[3]["地点名"] == "P0" and rows[6]["地点名"] == "P1" and rows[-1]["地点名"] == "倉庫"
+
+    violations, metrics = _evaluate(table, matrix, rows)
+
+    assert violations == []
+    assert metrics == {'drive_seconds': 7 * 600.0, 'drive_meters': 7 * 5000.0, 'lateness_seconds': 0.0,
+                       'vehicles': 1, 'errors': 0}
+
+def test_unreadable_time():
+    table, matrix, rows = _line_plan()
+    rows[6]["提案時間"] = "未定"
+    violations, _ = _evaluate(table, matrix, rows)
+    assert _kinds(violations) == [('time_format', 6), ('missing_stop', None)]
+    assert violations[0]['level'] == 'error' and violations[0]['vehicle'] == "T01"
+
+def test_time_going_backwards():
+    table, matrix, rows = _line_plan()
+    departure = rows[4]["提案時間"]
+    rows[6]["提案時間"] = "2026/10/18 08:05"
+    violations, _ = _evaluate(table, matrix, rows)
+    # P0の出発より前にP1へ到着しているため、所要時間も足りない
+    assert departure == "2026/10/18 08:25"
+    assert _kinds(violations) == [('time_order', 6), ('travel_too_fast', 6)]
+
+def test_travel_faster_than_matrix():
+    table, matrix, rows = _line_plan()
+    rows[6]["提案時間"] = "2026/10/18 08:27"
+    violations, _ = _evaluate(table, matrix, rows)
+    assert _kinds(violations) == [('travel_too_fast', 6)]
+    # 許容誤差（所要時間の15%と5分）以内なら違反としない
+    rows[6]["提案時間"] = "2026/10/18 08:29"
+    assert _evaluate(table, matrix, rows)[0] == []
+
+def test_unreachable_leg():
+    table, matrix, rows = _line_plan()
+    matrix.status[1, 2] = STATUS_ZERO_RESULTS
+    violations, metrics = _evaluate(table, matrix, rows)
+    assert _kinds(violations) == [('unreachable', 6)]
+    assert metrics['drive_seconds'] == 6 * 600.0
+
+def test_unknown_and_missing_stops():
+    table, matrix, rows = _line_plan()
+    rows[6].update({"地点ID": "99", "地点名": "存在しない地点"})
+    violations, _ = _evaluate(table, matrix, rows)
+    assert _kinds(violations) == [('unknown_location', 6), ('missing_stop', None)]
+    assert violations[1]['vehicle'] == "" and "P1" in violations[1]['message']
+
+def test_dropped_stop_is_missing():
+    table, matrix, rows = _line_plan()
+    # P1の到着・出発を削除すると、P0からP2へ直接移動した計画になる
+    del rows[6:8]
+    violations, _ = _evaluate(table, matrix, rows)
+    assert _kinds(violations) == [('missing_stop', None)]
+
+def test_duplicate_visit_is_a_warning():
+    table, matrix, rows = _line_plan()
+    rows.insert(7, dict(rows[6]))
+    violations, metrics = _evaluate(table, matrix, rows)
+    assert _kinds(violations) == [('duplicate_visit', 7)]
+    assert violations[0]['level'] == 'warning' and metrics['errors'] == 0
+
+def test_capacity_is_reported_on_the_first_row_of_the_vehicle():
+    table, matrix, rows = _line_plan(荷下ろし重量=30)
+    violations, _ = _evaluate(table, matrix, rows, vehicles=[{"車両ID": "T01", "最大積載重量": 100}])
+    assert _kinds(violations) == [('capacity', 0)]
+    assert "最大180kg / 上限100kg" in violations[0]['message']
+    assert _evaluate(table, matrix, rows, vehicles=[{"車両ID": "T01", "最大積載重量": 180}])[0] == []
+
+def test_continuous_driving():
+    table, matrix, rows = _line_plan()
+    settings = {"mode": "mode1", "continuous_limit": True, "continuous_hours": 1, "rest_minutes": 30}
+    violations, _ = _evaluate(table, matrix, rows, settings)
+    # 10分の区間を7回運転し、上限1時間（余裕5分）を超えるのは7区間目（倉庫への到着）
+    assert _kinds(violations) == [('continuous_driving', len(rows) - 1)]
+
+    # 途中の地点で休憩時間以上待てば、連続運転時間は数え直す
+    def later(text):
+        return (datetime.strptime(text, "%Y/%m/%d %H:%M") + timedelta(minutes=30)).strftime("%Y/%m/%d %H:%M")
+
+    for row in rows[14:]:
+        row["提案時間"] = " - ".join(later(text) for text in row["提案時間"].split(" - "))
+    assert _evaluate(table, matrix, rows, settings)[0] == []
+
+def test_daily_duty_is_reported_once():
+    table, matrix, rows = _line_plan()
+    settings = {"mode": "mode1", "daily_limit": True, "daily_hours": 2}
+    violations, _ = _evaluate(table, matrix, rows, settings)
+    first_over = next(
+        index for index, row in enumerate(rows)
+        if datetime.strptime(row["提案時間"].split(" - ")[-1], "%Y/%m/%d %H:%M") > datetime(2026, 10, 18, 10, 5)
+    )
+    assert _kinds(violations) == [('daily_duty', first_over)]
+
+def test_late_arrival_adds_lateness():
+    table, matrix, rows = _line_plan()
+    table.arrival[3] = pd.Timestamp("2026-10-18 08:30")
+    violations, metrics = _evaluate(table, matrix, rows)
+    # P2への到着は9:00で、希望の8:30から30分遅れ
+    assert _kinds(violations) == [('late_arrival', 9)]
+    assert metrics['lateness_seconds'] == 1800.0 and metrics['errors'] == 0
+
+def test_flagged_vehicles_lists_vehicles_with_errors_in_order():
+    violations = [
+        {'vehicle': "T02", 'level': 'warning'},
+        {'vehicle': "T03", 'level': 'error'},
+        {'vehicle': "T01", 'level': 'error'},
+        {'vehicle': "T03", 'level': 'error'},
+        {'vehicle': "", 'level': 'error'},
+    ]
+    assert flagged_vehicles(violations) == ["T03", "T01"]
+    assert flagged_vehicles([]) == []
+
+def test_score_plan_uses_mode_weights():
+    metrics = {'drive_seconds': 3600.0, 'drive_meters': 50000.0, 'lateness_seconds': 600.0, 'vehicles': 2, 'errors': 1}
+    fixed = SOLVER_CONFIG["vehicle_fixed_cost_minutes"] * 60 * 2 + CANDIDATE_CONFIG["error_penalty_minutes"] * 60
+    mode1, mode2 = SOLVER_CONFIG["mode_weights"]["mode1"], SOLVER_CONFIG["mode_weights"]["mode2"]
+    assert score_plan(metrics, {"mode": "mode1"}) == 3600.0 + mode1["lateness"] * 600.0 + fixed
+    # mode2は距離を時速36kmで秒に換算する
+    assert score_plan(metrics, {"mode": "mode2"}) == 5000.0 + mode2["lateness"] * 600.0 + fixed
+    assert score_plan({**metrics, 'errors': 0}, {"mode": "mode1"}) < score_plan(metrics, {"mode": "mode1"})
+
+def test_large_plan_is_replayed_in_a_single_pass(monkeypatch):
+    table, matrix, rows = _line_plan(count=1500)
+    calls = {'replay': 0, 'leg': 0}
+    replay, check_leg = PlanValidator._replay, PlanValidator._check_leg
+
+    def counting_replay(self, *args):
+        calls['replay'] += 1
+        return replay(self, *args)
+
+    def counting_check_leg(self, *args):
+        calls['leg'] += 1
+        return check_leg(self, *args)
+
+    monkeypatch.setattr(PlanValidator, "_replay", counting_replay)
+    monkeypatch.setattr(PlanValidator, "_check_leg", counting_check_leg)
+    violations, metrics = _evaluate(table, matrix, rows)
+
+    assert violations == []
+    assert calls['replay'] == len(rows)
+    assert calls['leg'] == sum(1 for row in rows if row["ステータス"] == "到着")
+    assert metrics['drive_seconds'] == (len(table) - 1) * 600.0
@@ -0,0 +1,106 @@
+# --- tests/test_replan.py (前回の計画をもとにした再計画) ---
+
+from datetime import datetime
+
+import numpy as np
+
+from location_table import diff_locations, normalize_locations
+from route_solver import repair_routes
+from travel_matrix import STATUS_OK, TravelMatrix
+
+START = datetime(2026, 10, 18, 8, 0)
+
+#======================================================================
+# location_table.diff_locations
+#======================================================================
+
+def test_diff_locations_classifies_each_stop():
+    previous = [
+        {"地点": "センター", "住所": "addr-0"},
+        {"地点": "P1", "住所": "addr-1", "荷下ろし重量": 10},
+        {"地点": "P2", "住所": "addr-2"},
+        {"地点": "P3", "住所": "addr-3"},
+    ]
+    current = [
+        {"地点": "P3", "住所": "addr-3"},
+        {"地点": "センター", "住所": "addr-0"},
+        {"地点": "P1", "住所": "addr-1", "荷下ろし重量": 20},
+        {"地点": "P4", "住所": "addr-4"},
+    ]
+
+    assert diff_locations(previous, current) == {
+        'unchanged': {0: 3, 1: 0}, 'changed': {2: 1}, 'added': [3], 'removed': [2]
+    }
+
+def test_diff_locations_matches_by_code_and_address():
+    previous = [{"地点コード": "A1", "地点": "旧店名", "住所": "addr-1"}, {"地点": "P2", "住所": "addr-2"}]
+    current = [{"地点コード": "A1", "地点": "新店名", "住所": "addr-1"}, {"地点": "P2", "住所": "addr-2 別館"}]
+
+    # 地点コードが同じなら名前が変わっても同じ地点、住所が変われば別の地点
+    assert diff_locations(previous, current) == {
+        'unchanged': {}, 'changed': {0: 0}, 'added': [1], 'removed': [1]
+    }
+
+def test_diff_locations_pairs_duplicates_in_order():
+    previous = [{"地点": "P", "住所": "addr", "便": 1}, {"地点": "P", "住所": "addr", "便": 2}]
+    current = [{"地点": "P", "住所": "addr", "便": 1}, {"地点": "P", "住所": "addr", "便": 2},
+               {"地点": "P", "住所": "addr", "便": 3}]
+
+    assert diff_locations(previous, current) == {
+        'unchanged': {0: 0, 1: 1}, 'changed': {}, 'added': [2], 'removed': []
+    }
+    assert diff_locations(current, previous)['removed'] == [2]
+
+#======================================================================
+# route_solver.repair_routes
+#======================================================================
+
+def _matrix(size):
+    """位置の差×10分・差×5kmの移動時間・距離を持つマトリックス"""
+    steps = np.abs(np.subtract.outer(np.arange(size), np.arange(size)))
+    return TravelMatrix(
+        (steps * 600).astype(np.int32),
+        (steps * 5000).astype(np.int32),
+        np.full((size, size), STATUS_OK, dtype=np.uint8)
+    )
+
+def _table(count):
+    """始点・終着の間に地点P0〜をcount件並べた配送先（P{i}の位置はi + 1）"""
+    return normalize_locations(
+        [{"始点": "1", "地点": "センター", "希望出発": "2026/10/18 08:00"}]
+        + [{"地点": f"P{i}"} for i in range(count)]
+        + [{"終着": "2", "地点": "倉庫"}]
+    )
+
+def _visits(rows):
+    """車両ごとの到着地点名（始点・終着を除く）"""
+    visits = {}
+    for row in rows:
+        if row["ステータス"] == "到着" and row["地点名"] not in ("センター", "倉庫"):
+            visits.setdefault(row["車両"], []).append(row["地点名"])
+    return visits
+
+def test_repair_keeps_previous_order_and_inserts_new_stop():
+    table = _table(10)
+    vehicles = [{"車両ID": "T01"}, {"車両ID": "T02"}]
+    # P4（位置5）は前回の計画になかった地点。2台目は「トラック2」の名前で指定する
+    routes = {"T01": [1, 2, 3, 4, 6], "トラック2": [7, 8, 9, 10]}
+
+    rows, summary = repair_routes(table, _matrix(len(table)), vehicles, {"mode": "mode1"}, START, routes)
+
+    assert _visits(rows) == {
+        "T01": ["P0", "P1", "P2", "P3", "P4", "P5"],
+        "T02": ["P6", "P7", "P8", "P9"],
+    }
+    assert summary
+
+def test_repair_drops_removed_stops_and_reinserts_unknown_vehicles():
+    table = _table(6)
+    vehicles = [{"車両ID": "T01"}]
+    # 位置20は今回の地点にない（削除された地点）、T09は今回の車両にない
+    routes = {"T01": [1, 20, 2, 3, 2], "T09": [4, 5, 6]}
+
+    rows, _ = repair_routes(table, _matrix(len(table)), vehicles, {"mode": "mode1"}, START, routes)
+
+    # 重複したP1は1回だけ訪問し、T09の地点は最も安い位置に挿入する
+    assert _visits(rows) == {"T01": ["P0", "P1", "P2", "P3", "P4", "P5"]}
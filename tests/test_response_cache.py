@@ -0,0 +1,122 @@
+# --- tests/test_response_cache.py (AI応答キャッシュ) ---
+
+import pytest
+
+import api_handler
+import async_api
+import response_cache
+from response_cache import ResponseCache, normalize_prompt, response_key
+
+class FakeClock:
+    """time.time()の代わりに、進めた分だけ時刻が変わる時計"""
+
+    def __init__(self, now=1_800_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """generate_contentで呼び出し回数入りの応答を返す偽のGeminiモデル"""
+
+    def __init__(self, model_name="fake-model"):
+        self.model_name = model_name
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None):
+        self.calls += 1
+        return _Response(f"{self.model_name} 応答{self.calls}")
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    return clock
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"), ttl_seconds=3600, max_entries=3)
+    yield cache
+    cache.close()
+
+def test_prompt_normalization_ignores_width_line_endings_and_trailing_spaces():
+    assert normalize_prompt("\n計画ＡＢＣ　  \r\n１２３\r\n\n") == normalize_prompt("計画ABC\n123")
+    assert normalize_prompt("計画 ABC") != normalize_prompt("計画ABC")
+
+def test_key_depends_on_generation_params():
+    params = {"model": "gemini-1.5-flash", "temperature": 0.2}
+    assert response_key("計画", params) == response_key("計画  \r\n", dict(params))
+    assert response_key("計画", params) != response_key("計画", {**params, "temperature": 0.7})
+    assert response_key("計画", params) != response_key("計画", {**params, "model": "gemini-1.5-pro"})
+
+def test_lookup_returns_stored_response_until_ttl(cache, clock):
+    cache.store("key", "応答")
+    clock.now += 3599
+    assert cache.lookup("key") == "応答"
+    clock.now += 2
+    assert cache.lookup("key") is None
+    assert cache.get_stats()['hits'] == 1 and cache.get_stats()['misses'] == 1
+
+def test_empty_response_is_not_stored(cache):
+    cache.store("key", "")
+    assert cache.lookup("key") is None
+
+def test_discard_removes_only_that_response(cache):
+    cache.store("a", "応答A")
+    cache.store("b", "応答B")
+    cache.discard("a")
+    assert cache.lookup("a") is None
+    assert cache.lookup("b") == "応答B"
+
+def test_least_recently_used_response_is_evicted(cache, clock):
+    for key in ("a", "b", "c"):
+        cache.store(key, key)
+        clock.now += 1
+    cache.lookup("a")
+    clock.now += 1
+    cache.store("d", "d")
+    assert cache.lookup("b") is None
+    assert [cache.lookup(key) for key in ("a", "c", "d")] == ["a", "c", "d"]
+
+@pytest.fixture
+def model(isolated_cache):
+    return FakeModel()
+
+@pytest.fixture
+def clients(model, api_clients):
+    return api_clients(gemini=model)
+
+def test_ai_plan_is_cached_by_normalized_prompt(model, clients):
+    first = api_handler.get_ai_route_plan(clients, "計画を作成してください\r\n")
+    second = api_handler.get_ai_route_plan(clients, "計画を作成してください  ")
+
+    assert not first['cached'] and second['cached']
+    assert second['data'] == first['data']
+    assert model.calls == 1
+    assert api_handler.get_ai_route_plan(clients, "計画を作成してください", use_cache=False)['data'] == "fake-model 応答2"
+
+def test_ai_plan_cache_misses_on_other_temperature_or_model(model, clients, api_clients):
+    api_handler.get_ai_route_plan(clients, "計画")
+
+    other_temperature = async_api.run(api_handler.generate_ai_route_plan(clients, "計画", temperature=0.9))
+    other_model = api_handler.get_ai_route_plan(api_clients(gemini=FakeModel("other-model")), "計画")
+
+    assert not other_temperature['cached']
+    assert not other_model['cached'] and other_model['data'] == "other-model 応答1"
+    assert async_api.run(api_handler.generate_ai_route_plan(clients, "計画", temperature=0.9))['cached']
+
+def test_discarded_response_is_generated_again(model, clients):
+    api_handler.get_ai_route_plan(clients, "計画")
+    async_api.run(api_handler.generate_ai_route_plan(clients, "計画", temperature=0.9))
+
+    api_handler.discard_cached_response(clients, "計画")
+
+    assert not api_handler.get_ai_route_plan(clients, "計画")['cached']
+    # temperatureを指定して生成した応答は、同じtemperatureを渡した場合のみ削除する
+    assert async_api.run(api_handler.generate_ai_route_plan(clients, "計画", temperature=0.9))['cached']
+    api_handler.discard_cached_response(clients, "計画", 0.9)
+    assert not async_api.run(api_handler.generate_ai_route_plan(clients, "計画", temperature=0.9))['cached']
@@ -0,0 +1,92 @@
+# --- tests/test_route_solver.py (ローカル配車計画ソルバー) ---
+
+import time
+from datetime import datetime
+
+import numpy as np
+
+from constants import SOLVER_CONFIG
+from location_table import normalize_locations
+from route_solver import RoutingProblem, _construct, solve
+from travel_matrix import STATUS_OK, TravelMatrix
+
+START = datetime(2026, 10, 18, 8, 0)
+
+def _matrix(size):
+    """位置の差×10分・差×5kmの移動時間・距離を持つマトリックス"""
+    steps = np.abs(np.subtract.outer(np.arange(size), np.arange(size)))
+    return TravelMatrix(
+        (steps * 600).astype(np.int32),
+        (steps * 5000).astype(np.int32),
+        np.full((size, size), STATUS_OK, dtype=np.uint8)
+    )
+
+def _scattered_matrix(size, seed=0):
+    """平面上に散らばる地点間の直線距離（時速36km換算）のマトリックス"""
+    points = np.random.default_rng(seed).uniform(0, 30000, (size, 2))
+    meters = np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)).astype(np.int32)
+    return TravelMatrix(meters // 10, meters, np.full((size, size), STATUS_OK, dtype=np.uint8))
+
+def _problem(locations, matrix=None, vehicles=None):
+    table = normalize_locations(locations)
+    return RoutingProblem(
+        table, matrix or _matrix(len(table)), vehicles or [{"車両ID": "T01"}], {"mode": "mode1"}, START
+    )
+
+def _stops(count, **fields):
+    """始点・終着の間に地点をcount件並べた配送先データ"""
+    return (
+        [{"始点": "1", "地点": "センター", "希望出発": "2026/10/18 08:00"}]
+        + [{"地点": f"P{i}", **fields} for i in range(count)]
+        + [{"終着": "2", "地点": "倉庫"}]
+    )
+
+def test_time_windows_come_from_parsed_columns():
+    problem = _problem([
+        {"始点": "1.0", "地点": "センター", "希望出発": "2026/10/18 08:00"},
+        {"地点": "A", "希望到着": "2026-10-18 09:30:00", "希望出発": "2026/10/18 10:00"},
+        {"地点": "B", "希望到着": "不正な値"},
+        {"終着": "2", "地点": "倉庫", "希望到着": "2026/10/18 17:00"},
+    ])
+    assert (problem.depot, problem.terminal, problem.stops) == (0, 3, [1, 2])
+    assert problem.ready == [None, 5400.0, None, 32400.0]
+    assert problem.due == [0.0, 7200.0, None, None]
+    default_service = SOLVER_CONFIG["default_service_minutes"] * 60
+    assert problem.service == [0, 1800.0, default_service, default_service]
+
+def test_every_stop_is_served_exactly_once():
+    problem = _problem(_stops(40), _scattered_matrix(42), [{"車両ID": f"T{v}"} for v in range(3)])
+    solution = solve(problem, time_limit=0.3, seed=1)
+    served = [stop for route in solution.routes for stop in route]
+    assert sorted(served) == problem.stops
+
+def test_vehicle_capacity_is_respected():
+    # 1台90kgまでの車両3台で、30kgずつ9地点（ちょうど満載）を配送する
+    vehicles = [{"車両ID": f"T{v}", "最大積載重量": 90} for v in range(3)]
+    problem = _problem(_stops(9, 荷下ろし重量=30), _scattered_matrix(11), vehicles)
+    solution = solve(problem, time_limit=0.3, seed=1)
+    assert sorted(stop for route in solution.routes for stop in route) == problem.stops
+    for route in solution.routes:
+        assert sum(problem.drop_weight[stop] for stop in route) <= 90
+
+def test_200_stops_solve_within_time_limit():
+    problem = _problem(_stops(200), _scattered_matrix(202), [{"車両ID": f"T{v}"} for v in range(5)])
+    time_limit = SOLVER_CONFIG["time_limit_seconds"]
+    started = time.perf_counter()
+    solution = solve(problem)
+    elapsed = time.perf_counter() - started
+    # 期限の確認は地点・周回単位のため、最後の1件分だけ超えうる
+    assert elapsed < time_limit + 0.5
+    assert sorted(stop for route in solution.routes for stop in route) == problem.stops
+
+def test_construction_stops_inserting_at_the_deadline():
+    problem = _problem(_stops(300), _scattered_matrix(302), [{"車両ID": f"T{v}"} for v in range(5)])
+    started = time.perf_counter()
+    _construct(problem)
+    unbounded = time.perf_counter() - started
+
+    started = time.perf_counter()
+    solution = solve(problem, time_limit=0.0)
+    # 期限切れ後の地点は評価せずに末尾へ追加するため、構築法を最後まで行うより十分に速い
+    assert time.perf_counter() - started < unbounded / 2
+    assert sorted(stop for route in solution.routes for stop in route) == problem.stops
@@ -0,0 +1,118 @@
+# --- tests/test_stream_parser.py (AI応答のストリーミング解析) ---
+
+import json
+
+import pytest
+
+import api_handler
+from stream_parser import RouteResponseParser
+
+SUMMARY = "車両2台で3地点を巡回します。"
+ITEMS = [
+    {"車両ID": "T01", "訪問順": 1, "地点": "東京配送センター", "到着時刻": "08:00"},
+    {"車両ID": "T01", "訪問順": 2, "地点": "丸の内店", "到着時刻": "08:40", "備考": "{注意} [要確認]"},
+    {"車両ID": "T02", "訪問順": 1, "地点": "横浜倉庫", "到着時刻": "09:10"},
+]
+RESPONSE = (
+    SUMMARY + "\n---\n```json\n[["
+    + ",\n".join(json.dumps(item, ensure_ascii=False) for item in ITEMS)
+    + "]]\n```\n"
+)
+
+def _split(text, *markers):
+    """各マーカー文字列の途中（先頭から1文字後）でテキストを分割する"""
+    cuts = sorted(text.index(marker) + 1 for marker in markers)
+    return [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+# 区切り線の途中・JSONオブジェクトの途中・入れ子のリスト[[の間で分割
+CHUNKS = _split(RESPONSE, "---", '"訪問順": 2', "[[", '"T02"')
+
+class _Chunk:
+    def __init__(self, text):
+        self._text = text
+
+    @property
+    def text(self):
+        if self._text is None:
+            raise ValueError("テキストを含まないチャンク")
+        return self._text
+
+class FakeStreamingModel:
+    """generate_content(stream=True)で、決められたチャンクを順に返す偽のGeminiモデル"""
+
+    model_name = "fake-stream"
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        assert stream
+        self.calls += 1
+        # 終了理由のみのチャンクも混ぜる
+        return iter([_Chunk(text) for text in self.chunks] + [_Chunk(None)])
+
+def _feed_all(chunks):
+    parser = RouteResponseParser()
+    events = [parser.feed(chunk) for chunk in chunks]
+    parser.close()
+    return parser, events
+
+def test_chunks_split_at_awkward_points():
+    assert len(CHUNKS) == 5
+    assert CHUNKS[0].endswith("-") and CHUNKS[1].startswith("--")
+    assert CHUNKS[1].endswith("[") and CHUNKS[2].startswith("[")
+
+def test_summary_first_then_items_one_by_one():
+    parser, events = _feed_all(CHUNKS)
+    flat = [event for chunk_events in events for event in chunk_events]
+    assert flat[0] == ('summary', SUMMARY)
+    assert flat[1:] == [('item', item) for item in ITEMS]
+    assert parser.items == ITEMS
+    assert parser.finished
+
+    # 区切り線が揃うまではサマリーを確定しない
+    assert events[0] == []
+    assert events[1] == [('summary', SUMMARY)]
+    # 各オブジェクトは閉じたチャンクで1件ずつ確定する
+    assert events[2] == [('item', ITEMS[0])]
+    assert events[3] == [('item', ITEMS[1])]
+    assert events[4] == [('item', ITEMS[2])]
+
+def test_single_character_chunks():
+    parser, events = _feed_all(list(RESPONSE))
+    assert all(len(chunk_events) <= 1 for chunk_events in events)
+    flat = [event for chunk_events in events for event in chunk_events]
+    assert flat == [('summary', SUMMARY)] + [('item', item) for item in ITEMS]
+    # オブジェクトは閉じ括弧を受信した時点で確定する
+    item_positions = [k for k, chunk_events in enumerate(events) if chunk_events and chunk_events[0][0] == 'item']
+    assert [RESPONSE[k] for k in item_positions] == ['}'] * len(ITEMS)
+
+def test_response_without_separator_becomes_summary():
+    parser, events = _feed_all(["計画を作成できません", "でした。"])
+    assert events == [[], []]
+    assert parser.summary == "計画を作成できませんでした。"
+    assert parser.items == []
+
+@pytest.fixture
+def fake_model(isolated_cache):
+    return FakeStreamingModel(CHUNKS)
+
+@pytest.fixture
+def clients(fake_model, api_clients):
+    return api_clients(gemini=fake_model)
+
+def test_stream_ai_route_plan_with_fake_model(fake_model, clients):
+    result = api_handler.stream_ai_route_plan(clients, "テスト用プロンプト")
+    assert result['status'] == 'OK'
+    assert not result['cached']
+
+    parser = RouteResponseParser()
+    events = [event for text in result['stream'] for event in parser.feed(text)]
+    assert events == [('summary', SUMMARY)] + [('item', item) for item in ITEMS]
+
+    # 最後まで受信した応答はキャッシュされ、2回目はモデルを呼ばない
+    cached = api_handler.stream_ai_route_plan(clients, "テスト用プロンプト")
+    assert cached['cached']
+    assert "".join(cached['stream']) == RESPONSE
+    assert fake_model.calls == 1
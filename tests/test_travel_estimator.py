@@ -0,0 +1,74 @@
+# --- tests/test_travel_estimator.py (近い地点間の取得候補) ---
+
+import numpy as np
+import pytest
+
+from travel_estimator import great_circle_matrix, nearest_neighbor_legs
+
+def _coordinates(size, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([35.5 + rng.random(size) * 0.5, 139.5 + rng.random(size) * 0.5])
+
+@pytest.mark.parametrize("k", [1, 3, 8])
+def test_each_row_keeps_its_k_nearest_legs(k):
+    coordinates = _coordinates(40)
+    candidates = nearest_neighbor_legs(coordinates, k)
+
+    distances = great_circle_matrix(coordinates)
+    np.fill_diagonal(distances, np.inf)
+    for i in range(len(coordinates)):
+        nearest = np.argsort(distances[i])[:k]
+        assert candidates[i, nearest].all()
+        assert candidates[i].sum() >= k
+    assert not candidates.diagonal().any()
+
+def test_reverse_direction_of_a_nearest_leg_is_kept():
+    candidates = nearest_neighbor_legs(_coordinates(40), 2)
+    assert (candidates == candidates.T).all()
+
+def test_incompatible_legs_are_dropped():
+    size = 30
+    coordinates = _coordinates(size, seed=1)
+    rng = np.random.default_rng(2)
+    compatible = rng.random((size, size)) < 0.5
+
+    candidates = nearest_neighbor_legs(coordinates, 5, compatible)
+
+    assert not (candidates & ~compatible).any()
+    # 訪問できる区間の中で近いk件は残る
+    distances = np.where(compatible, great_circle_matrix(coordinates), np.inf)
+    np.fill_diagonal(distances, np.inf)
+    for i in range(size):
+        allowed = np.isfinite(distances[i])
+        nearest = np.argsort(distances[i])[:min(5, allowed.sum())]
+        assert candidates[i, nearest].all()
+
+def test_row_without_compatible_legs_has_no_candidates():
+    size = 5
+    compatible = np.ones((size, size), dtype=bool)
+    compatible[2, :] = False
+    compatible[:, 2] = False
+
+    candidates = nearest_neighbor_legs(_coordinates(size), 2, compatible)
+
+    assert not candidates[2].any()
+    assert not candidates[:, 2].any()
+
+def test_unknown_coordinates_stay_candidates():
+    size = 12
+    coordinates = _coordinates(size)
+    coordinates[[3, 7]] = np.nan
+    compatible = np.zeros((size, size), dtype=bool)
+
+    candidates = nearest_neighbor_legs(coordinates, 1, compatible)
+
+    unknown = np.zeros((size, size), dtype=bool)
+    unknown[[3, 7], :] = True
+    unknown[:, [3, 7]] = True
+    np.fill_diagonal(unknown, False)
+    # 距離で判定できない区間は、訪問可否のマスクにかかわらず候補にする
+    assert (candidates == unknown).all()
+
+def test_fewer_than_two_points_have_no_candidates():
+    assert not nearest_neighbor_legs(_coordinates(1), 3).any()
+    assert nearest_neighbor_legs(np.empty((0, 2)), 3).shape == (0, 0)
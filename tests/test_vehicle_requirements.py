@@ -0,0 +1,46 @@
+# --- tests/test_vehicle_requirements.py (必要車両数の区間スイープ) ---
+
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from location_table import normalize_locations
+from prompt_builder import analyze_vehicle_requirements
+
+BASE = datetime(2026, 10, 18, 9, 0)
+
+def _table(windows):
+    """(到着までの分, 出発までの分) のリストから地点データを作成"""
+    return normalize_locations([
+        {
+            "地点": f"地点{i}",
+            "住所": f"addr-{i}",
+            "希望到着": (BASE + timedelta(minutes=arrive)).strftime("%Y/%m/%d %H:%M") if arrive is not None else "",
+            "希望出発": (BASE + timedelta(minutes=depart)).strftime("%Y/%m/%d %H:%M") if depart is not None else "",
+        }
+        for i, (arrive, depart) in enumerate(windows)
+    ])
+
+def test_mutually_overlapping_stops_need_one_vehicle_each():
+    table = _table([(i, 180) for i in range(10)])
+    min_required, windows = analyze_vehicle_requirements(table)
+    assert min_required == 10
+    assert len(windows) == 1
+    assert windows[0]['count'] == 10
+    assert windows[0]['start'] == pd.Timestamp(BASE + timedelta(minutes=9))
+    assert windows[0]['end'] == pd.Timestamp(BASE + timedelta(minutes=180))
+    assert sorted(windows[0]['locations']) == sorted(f"地点{i}" for i in range(10))
+
+def test_touching_windows_do_not_overlap():
+    table = _table([(0, 60), (60, 120), (120, 180)])
+    min_required, windows = analyze_vehicle_requirements(table)
+    assert min_required == 1
+    assert windows == []
+
+def test_stops_without_a_valid_window_are_ignored():
+    table = _table([(0, 60), (30, 90), (None, 45), (50, None), (100, 40)])
+    min_required, windows = analyze_vehicle_requirements(table)
+    assert min_required == 2
+    assert [(window['start'], window['end']) for window in windows] == [
+        (pd.Timestamp(BASE + timedelta(minutes=30)), pd.Timestamp(BASE + timedelta(minutes=60)))
+    ]
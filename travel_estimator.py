@@ -0,0 +1,123 @@
+# --- travel_estimator.py (緯度経度からの移動時間・距離の推定) ---
+
+import numpy as np
+
+from constants import ESTIMATOR_CONFIG
+from travel_matrix import STATUS_ESTIMATED, STATUS_OK, TravelMatrix
+
+EARTH_RADIUS_METERS = 6371008.8
+
+def _haversine(lat1, lng1, lat2, lng2):
+    """度単位の緯度経度から大圏距離(m)を計算（配列はブロードキャストされる）"""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def great_circle_matrix(coordinates):
+    """(緯度, 経度)の配列から全地点間の大圏距離(m)の行列を計算（位置不明の地点を含む組はNaN）"""
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    lat, lng = coordinates[:, 0], coordinates[:, 1]
+    return _haversine(lat[:, None], lng[:, None], lat[None, :], lng[None, :])
+
+def great_circle_pairs(origins, destinations):
+    """(緯度, 経度)の配列同士を要素ごとに対応させた大圏距離(m)"""
+    origins = np.asarray(origins, dtype=np.float64)
+    destinations = np.asarray(destinations, dtype=np.float64)
+    return _haversine(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1])
+
+def nearest_neighbor_legs(coordinates, k, compatible=None):
+    """各地点から近いk地点への区間と、その逆方向の区間を候補とするマスク（同じ地点同士は除く）
+
+    compatible（地点iの次に地点jを訪問できるかのマスク）で不可の区間は候補にしない。
+    位置不明の地点を含む区間は距離で判定できないため、すべて候補とする。
+    """
+    distances = great_circle_matrix(coordinates)
+    size = len(distances)
+    unknown = np.isnan(distances)
+    candidates = np.zeros((size, size), dtype=bool)
+    if size < 2:
+        return candidates
+
+    allowed = ~unknown if compatible is None else ~unknown & compatible
+    ranked = np.where(allowed, distances, np.inf)
+    np.fill_diagonal(ranked, np.inf)
+    k = min(k, size - 1)
+    # 行ごとの近いk件のみを部分ソートで取り出す
+    nearest = np.argpartition(ranked, k - 1, axis=1)[:, :k]
+    rows = np.repeat(np.arange(size), k)
+    candidates[rows, nearest.ravel()] = True
+    candidates &= np.isfinite(ranked)
+    candidates |= candidates.T & allowed
+    candidates |= unknown
+    np.fill_diagonal(candidates, False)
+    return candidates
+
+class TravelEstimator:
+    """大圏距離を距離帯ごとの迂回係数で道路距離に、平均速度で移動時間に換算する
+
+    距離帯の境界はESTIMATOR_CONFIG["band_edges_km"]。係数・速度はキャッシュ済みの実測値から
+    calibrate()で求め、実測値が少ない帯は既定値を使う。
+    """
+
+    def __init__(self, detour_factors, speeds, sample_counts=None):
+        self.band_edges = np.asarray(ESTIMATOR_CONFIG["band_edges_km"], dtype=np.float64) * 1000
+        self.detour_factors = np.asarray(detour_factors, dtype=np.float64)
+        self.speeds = np.asarray(speeds, dtype=np.float64)  # m/秒
+        self.sample_counts = list(sample_counts) if sample_counts is not None else [0] * len(self.speeds)
+
+    @classmethod
+    def default(cls):
+        """既定の係数・速度の推定器"""
+        speeds = np.asarray(ESTIMATOR_CONFIG["default_speeds_kmh"], dtype=np.float64) / 3.6
+        return cls(ESTIMATOR_CONFIG["default_detour_factors"], speeds)
+
+    @classmethod
+    def calibrate(cls, great_circle, road_meters, seconds):
+        """実測の (大圏距離, 道路距離, 移動時間) の組から、距離帯ごとの迂回係数と平均速度を求める（中央値）"""
+        estimator = cls.default()
+        great_circle = np.asarray(great_circle, dtype=np.float64)
+        road_meters = np.asarray(road_meters, dtype=np.float64)
+        seconds = np.asarray(seconds, dtype=np.float64)
+        valid = (great_circle > 0) & (road_meters > 0) & (seconds > 0)
+        bands = np.digitize(great_circle, estimator.band_edges)
+
+        for band in range(len(estimator.speeds)):
+            mask = valid & (bands == band)
+            count = int(mask.sum())
+            estimator.sample_counts[band] = count
+            if count < ESTIMATOR_CONFIG["min_samples"]:
+                continue
+            # 極端な値（フェリー・位置ずれ）の影響を抑えるため中央値を使う
+            estimator.detour_factors[band] = max(1.0, float(np.median(road_meters[mask] / great_circle[mask])))
+            estimator.speeds[band] = float(np.median(road_meters[mask] / seconds[mask]))
+        return estimator
+
+    def estimate(self, great_circle):
+        """大圏距離(m)の配列から (道路距離(m), 移動時間(秒)) の配列を推定"""
+        bands = np.digitize(np.nan_to_num(great_circle), self.band_edges)
+        meters = great_circle * self.detour_factors[bands]
+        return meters, meters / self.speeds[bands]
+
+    def estimate_matrix(self, coordinates, addresses=None):
+        """地点の(緯度, 経度)から全要素が推定値のTravelMatrixを作成（位置不明の地点を含む組は未取得のまま）"""
+        meters, seconds = self.estimate(great_circle_matrix(coordinates))
+        known = ~np.isnan(meters)
+        matrix = TravelMatrix.empty(len(meters), addresses)
+        matrix.coordinates = np.asarray(coordinates, dtype=np.float64)
+        matrix.meters[known] = np.rint(meters[known]).astype(np.int32)
+        matrix.seconds[known] = np.rint(seconds[known]).astype(np.int32)
+        matrix.status[known] = STATUS_OK | STATUS_ESTIMATED
+        np.fill_diagonal(matrix.seconds, 0)
+        np.fill_diagonal(matrix.meters, 0)
+        np.fill_diagonal(matrix.status, STATUS_OK)
+        return matrix
+
+    def describe(self):
+        """補正結果の説明文（画面・ログ表示用）"""
+        edges = [0] + [int(edge / 1000) for edge in self.band_edges] + [None]
+        parts = []
+        for band, (low, high) in enumerate(zip(edges, edges[1:])):
+            label = f"{low}km〜{high}km" if high is not None else f"{low}km以上"
+            source = f"実測{self.sample_counts[band]}組" if self.sample_counts[band] >= ESTIMATOR_CONFIG["min_samples"] else "既定値"
+            parts.append(f"{label}: 迂回係数{self.detour_factors[band]:.2f}・時速{self.speeds[band] * 3.6:.0f}km（{source}）")
+        return " / ".join(parts)
@@ -0,0 +1,161 @@
+# --- travel_matrix.py (地点間の移動時間・距離マトリックス) ---
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# 要素ステータスのビットフラグ
+STATUS_OK = 1
+STATUS_ZERO_RESULTS = 2
+STATUS_NOT_FOUND = 4
+STATUS_ERROR = 8
+# 緯度経度からの推定値（STATUS_OKと組み合わせて使う）
+STATUS_ESTIMATED = 16
+
+_STATUS_FLAGS = {
+    'OK': STATUS_OK,
+    'ZERO_RESULTS': STATUS_ZERO_RESULTS,
+    'NOT_FOUND': STATUS_NOT_FOUND,
+}
+
+def format_duration(seconds):
+    """移動時間(秒)を「1時間5分」形式の文字列に変換"""
+    minutes = int(round(seconds / 60))
+    if minutes < 60:
+        return f"{max(minutes, 1)}分"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}時間{minutes}分" if minutes else f"{hours}時間"
+
+def format_distance(meters):
+    """距離(m)を「12.3 km」形式の文字列に変換"""
+    if meters < 1000:
+        return f"{int(meters)} m"
+    km = meters / 1000
+    return f"{km:.0f} km" if km >= 100 else f"{km:.1f} km"
+
+class TravelMatrix:
+    """地点間の移動時間(秒)・距離(m)を連続したint32配列で保持する
+
+    statusは要素ごとのビットフラグ（STATUS_OKなど）。ルートが見つからない要素の
+    秒・メートルは0のままとし、reachableで判定する。
+    coordinatesは地点ごとの(緯度, 経度)のfloat64配列（不明な地点はNaN、未取得ならNone）。
+    """
+
+    FILES = ('seconds.npy', 'meters.npy', 'status.npy')
+
+    def __init__(self, seconds, meters, status, addresses=None, coordinates=None):
+        self.seconds = seconds
+        self.meters = meters
+        self.status = status
+        self.addresses = list(addresses) if addresses is not None else []
+        self.coordinates = coordinates
+
+    @classmethod
+    def empty(cls, size, addresses=None):
+        """全要素が未取得(NOT_FOUND)のマトリックスを作成"""
+        return cls(
+            np.zeros((size, size), dtype=np.int32),
+            np.zeros((size, size), dtype=np.int32),
+            np.full((size, size), STATUS_NOT_FOUND, dtype=np.uint8),
+            addresses
+        )
+
+    @classmethod
+    def from_response(cls, response):
+        """Distance Matrix APIのレスポンス（rows/elements形式）から作成"""
+        rows = response['rows']
+        matrix = cls.empty(len(rows), response.get('origin_addresses'))
+        for i, row in enumerate(rows):
+            for j, element in enumerate(row['elements']):
+                matrix.set_element(i, j, element)
+        return matrix
+
+    def set_element(self, i, j, element):
+        """APIの1要素（dict）を書き込む"""
+        status = element.get('status') if element else 'NOT_FOUND'
+        self.status[i, j] = _STATUS_FLAGS.get(status, STATUS_ERROR)
+        if status == 'OK':
+            self.seconds[i, j] = element['duration']['value']
+            self.meters[i, j] = element['distance']['value']
+        else:
+            self.seconds[i, j] = 0
+            self.meters[i, j] = 0
+
+    def set_tile(self, rows, cols, tile_response):
+        """タイル単位のAPIレスポンスを、元の行・列位置に書き込む"""
+        for i, row in zip(rows, tile_response.get('rows', [])):
+            for j, element in zip(cols, row.get('elements', [])):
+                self.set_element(i, j, element)
+
+    def expand(self, positions, addresses=None):
+        """重複を除いた地点のマトリックスを、元の地点の並び（positions[元の位置] = 重複除去後の位置）に展開
+
+        同じ地点同士（対角要素を含む）は移動時間・距離0で到達可能とする。
+        """
+        positions = np.asarray(positions)
+        index = np.ix_(positions, positions)
+        coordinates = self.coordinates[positions] if self.coordinates is not None else None
+        expanded = TravelMatrix(self.seconds[index], self.meters[index], self.status[index], addresses, coordinates)
+        same_point = positions[:, None] == positions[None, :]
+        expanded.seconds[same_point] = 0
+        expanded.meters[same_point] = 0
+        expanded.status[same_point] = STATUS_OK
+        return expanded
+
+    @property
+    def size(self):
+        return self.seconds.shape[0]
+
+    @property
+    def reachable(self):
+        """ルートが取得できた要素のマスク"""
+        return (self.status & STATUS_OK) != 0
+
+    @property
+    def estimated(self):
+        """実測値ではなく推定値の要素のマスク"""
+        return (self.status & STATUS_ESTIMATED) != 0
+
+    def copy(self):
+        """配列をコピーした書き込み可能なマトリックスを作成（メモリマップで読み込んだものにも使える）"""
+        coordinates = np.array(self.coordinates) if self.coordinates is not None else None
+        return TravelMatrix(np.array(self.seconds), np.array(self.meters), np.array(self.status), self.addresses, coordinates)
+
+    def failed_pairs(self):
+        """ルートが見つからない（ZERO_RESULTS以外の異常）要素の (i, j) 一覧"""
+        return [tuple(pair) for pair in np.argwhere((self.status & (STATUS_NOT_FOUND | STATUS_ERROR)) != 0)]
+
+    def fingerprint(self):
+        """内容の指紋（キャッシュキー用）"""
+        digest = hashlib.sha1()
+        for array in (self.seconds, self.meters, self.status):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def save(self, directory):
+        """配列を.npyとして保存（loadでメモリマップとして読み込める）"""
+        os.makedirs(directory, exist_ok=True)
+        for name, array in zip(self.FILES, (self.seconds, self.meters, self.status)):
+            np.save(os.path.join(directory, name), array)
+        if self.coordinates is not None:
+            np.save(os.path.join(directory, 'coordinates.npy'), self.coordinates)
+        with open(os.path.join(directory, 'addresses.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.addresses, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """saveした配列を読み込む（mmap=Trueならコピーせずにメモリマップで参照）"""
+        mmap_mode = 'r' if mmap else None
+        seconds, meters, status = (np.load(os.path.join(directory, name), mmap_mode=mmap_mode) for name in cls.FILES)
+        addresses = []
+        addresses_path = os.path.join(directory, 'addresses.json')
+        if os.path.exists(addresses_path):
+            with open(addresses_path, encoding='utf-8') as f:
+                addresses = json.load(f)
+        coordinates = None
+        coordinates_path = os.path.join(directory, 'coordinates.npy')
+        if os.path.exists(coordinates_path):
+            coordinates = np.load(coordinates_path, mmap_mode=mmap_mode)
+        return cls(seconds, meters, status, addresses, coordinates)